@@ -0,0 +1,128 @@
+"""
+Сравнение быстрого RU/EN/VI детектора с прежним langdetect: точность и скорость.
+
+Запуск из корня репозитория:
+    python -m bench.bench_lang_detect [--repeat 200]
+"""
+import argparse
+import json
+import time
+from typing import Callable, List, Optional, Tuple
+
+from langdetect import detect, LangDetectException
+
+from bot.services.lang_detect import ISO_TO_APP, detect_language
+
+SAMPLES: List[Tuple[str, Optional[str]]] = [
+    # RU
+    ("спасибо", "RU"),
+    ("Привет, как дела?", "RU"),
+    ("Сколько это стоит?", "RU"),
+    ("Завтра в 10 встречаемся у входа в торговый центр", "RU"),
+    ("ок, понял", "RU"),
+    ("Я не знаю, где находится ближайшая аптека.", "RU"),
+    ("Доставка будет в пятницу после обеда", "RU"),
+    ("да", "RU"),
+    ("Скинь, пожалуйста, адрес отеля", "RU"),
+    ("Внимание! С понедельника офис работает с 9:00 до 18:00.", "RU"),
+    # EN
+    ("how much?", "EN"),
+    ("Thank you very much", "EN"),
+    ("ok", "EN"),
+    ("Where is the nearest pharmacy?", "EN"),
+    ("I will be there in five minutes", "EN"),
+    ("Please send me the invoice by tomorrow morning.", "EN"),
+    ("hello", "EN"),
+    ("The meeting has been moved to Friday afternoon.", "EN"),
+    ("sorry, I don't understand", "EN"),
+    ("Can you recommend a good restaurant nearby?", "EN"),
+    # EN: короткие реплики, langdetect на них ошибается, а слова похожи на VI слоги
+    ("Hi", "EN"),
+    ("no", "EN"),
+    ("Let me check", "EN"),
+    ("see you soon", "EN"),
+    ("see you later", "EN"),
+    ("call me", "EN"),
+    ("good night", "EN"),
+    ("Hi there", "EN"),
+    # VI с диакритикой
+    ("xin chào", "VI"),
+    ("Cảm ơn bạn rất nhiều", "VI"),
+    ("Bao nhiêu tiền?", "VI"),
+    ("Tôi không hiểu", "VI"),
+    ("Ngày mai chúng ta gặp nhau lúc mấy giờ?", "VI"),
+    ("Món này có cay không?", "VI"),
+    ("Đi thẳng rồi rẽ trái", "VI"),
+    ("Chào buổi sáng", "VI"),
+    # VI без диакритики
+    ("xin chao", "VI"),
+    ("cam on ban", "VI"),
+    ("bao nhieu tien", "VI"),
+    ("toi khong biet", "VI"),
+    ("anh oi cho em hoi", "VI"),
+    ("toi di", "VI"),
+    ("em an com chua", "VI"),
+    ("mai gap nhe", "VI"),
+    # не RU/EN/VI
+    ("Guten Morgen, wie geht es dir?", None),
+    ("Buenos días, ¿cómo estás?", None),
+    ("Ich habe keine Zeit heute", None),
+    ("Où est la gare, s'il vous plaît?", None),
+    ("12345", None),
+    ("👍👍", None),
+]
+
+
+def _langdetect_only(text: str) -> Optional[str]:
+    """Прежняя реализация detect_language (до быстрого классификатора)."""
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        return ISO_TO_APP.get(detect(text))
+    except LangDetectException:
+        return None
+
+
+def _run(name: str, fn: Callable[[str], Optional[str]], repeat: int) -> dict:
+    correct = 0
+    errors = []
+    for text, expected in SAMPLES:
+        got = fn(text)
+        if got == expected:
+            correct += 1
+        else:
+            errors.append({"text": text, "expected": expected, "got": got})
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text, _expected in SAMPLES:
+            fn(text)
+    elapsed = time.perf_counter() - started
+    calls = repeat * len(SAMPLES)
+
+    return {
+        "detector": name,
+        "accuracy": round(correct / len(SAMPLES), 3),
+        "us_per_call": round(elapsed / calls * 1e6, 2),
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    # Прогрев: langdetect лениво грузит профили при первом вызове
+    _langdetect_only("warm up")
+
+    results = [
+        _run("fast", detect_language, args.repeat),
+        _run("langdetect", _langdetect_only, args.repeat),
+    ]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Сквозной нагрузочный прогон без сети: настоящие роутеры из bot/handlers,
+фейковый OpenAI (bench/fake_openai.py) и FakeSession вместо Bot API.
+
+    python -m bench.bench_load --users 50 --messages 20 --voice-share 0.2 \\
+        --latency-ms 400 --rate-limit-rate 0.02
+
+N пользователей параллельно выбирают пару (/start + кнопка), затем каждый шлёт
+свои сообщения по очереди (как в одном чате). Задержка апдейта — время
+dp.feed_update, т.е. до отправки ответа. Результат — JSON: пропускная способность,
+p50/p95/p99 по текстам и голосовым, вызовы фейковых API и счётчики бота.
+С JOB_QUEUE_ENABLED=1 измеряется только приём апдейта — ответы уходят из очереди.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from bench.common import dump, latency_summary
+from bench.fake_openai import add_config_args, config_from_args, start_fake_openai
+from bench.fake_telegram import (
+    SAMPLE_TEXTS,
+    FakeSession,
+    make_callback_update,
+    make_command_update,
+    make_text_update,
+    make_voice_update,
+)
+
+LONG_TEXT = (
+    "Добрый день! Напоминаю, что завтра в десять утра у нас встреча у главного входа "
+    "торгового центра. Пожалуйста, возьмите с собой паспорт и распечатанное подтверждение "
+    "бронирования, без них охрана не пропустит. Если опаздываете, напишите заранее, "
+    "чтобы мы успели предупредить организаторов."
+)
+
+# Счётчики бота, которые попадают в отчёт (по префиксу)
+REPORTED_COUNTER_PREFIXES = (
+    "translation_cache_",
+    "translation_retry",
+    "translation_batch_",
+    "translation_speculative_",
+    "openai_",
+    "handler_",
+    "voice_",
+    "singleflight_",
+    "lang_detect_fallback",
+    "fast_path_",
+    "outbox_",
+)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fake_openai, openai_runner, base_url = await start_fake_openai(config_from_args(args))
+    try:
+        return await _run_bot(args, fake_openai, base_url)
+    finally:
+        await openai_runner.cleanup()
+
+
+async def _run_bot(args: argparse.Namespace, fake_openai, base_url: str) -> Dict[str, Any]:
+    # Настройки бота читаются при импорте — окружение готовим до него
+    tmpdir = tempfile.mkdtemp(prefix="bench-load-")
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCH")
+    os.environ["DATABASE_PATH"] = os.path.join(tmpdir, "bench.db")
+
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
+    from aiogram.types import Update
+
+    from bot.main import create_dispatcher
+    from bot.services import metrics
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    session = FakeSession(latency_ms=args.telegram_latency_ms)
+    bot = Bot(
+        token="123456:BENCH",
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    dp = create_dispatcher()
+
+    latencies: Dict[str, List[float]] = {"text": [], "long_text": [], "voice": []}
+    failures = 0
+    counter = 0
+
+    async def feed(raw: Dict[str, Any]) -> None:
+        update = Update.model_validate(raw, context={"bot": bot})
+        await dp.feed_update(bot, update)
+
+    async def user_flow(user_id: int) -> None:
+        nonlocal failures, counter
+        await feed(make_command_update(user_id, "/start"))
+        await feed(make_callback_update(user_id, "to:EN" if user_id % 2 else "to:VI"))
+
+        for _ in range(args.messages):
+            if args.think_ms:
+                await asyncio.sleep(random.expovariate(1000.0 / args.think_ms))
+
+            roll = random.random()
+            if roll < args.voice_share:
+                kind, raw = "voice", make_voice_update(user_id)
+            elif roll < args.voice_share + args.long_share:
+                kind, raw = "long_text", make_text_update(user_id, LONG_TEXT)
+            else:
+                text = random.choice(SAMPLE_TEXTS)
+                if args.unique:
+                    counter += 1
+                    text = f"{text} {counter}"
+                kind, raw = "text", make_text_update(user_id, text)
+
+            started = time.perf_counter()
+            try:
+                await feed(raw)
+            except Exception:
+                failures += 1
+                logging.getLogger(__name__).exception("Update failed")
+            latencies[kind].append(time.perf_counter() - started)
+
+    # Shutdown закрывает БД и пулы даже если startup упал на полпути — иначе
+    # поток aiosqlite не даст процессу завершиться
+    try:
+        await dp.emit_startup(bot=bot)
+        started = time.perf_counter()
+        await asyncio.gather(*(user_flow(200000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await dp.emit_shutdown(bot=bot)
+
+    everything = [value for values in latencies.values() for value in values]
+    counters = metrics.snapshot()
+    return {
+        "users": args.users,
+        "messages": len(everything),
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(len(everything) / elapsed, 2) if elapsed else 0.0,
+        "latency": latency_summary(everything),
+        "latency_by_kind": {
+            kind: {"count": len(values), **latency_summary(values)}
+            for kind, values in latencies.items()
+            if values
+        },
+        "openai_calls": fake_openai.calls,
+        "telegram_calls": session.calls,
+        "bot_counters": {
+            name: value
+            for name, value in sorted(counters.items())
+            if name.startswith(REPORTED_COUNTER_PREFIXES)
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--voice-share", type=float, default=0.2)
+    parser.add_argument("--long-share", type=float, default=0.1, help="share of long (streamed) texts")
+    parser.add_argument("--unique", action="store_true", help="make every text unique (no cache hits)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between messages of a user")
+    parser.add_argument("--telegram-latency-ms", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="keep INFO logs of the bot")
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    print(dump(asyncio.run(run(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Микробенчмарки чистых функций и горячих путей без сети: детекция языка,
+выбор направления, ключ кэша, LRU, метрики, чтение настроек пользователя из SQLite.
+
+Запуск из корня репозитория:
+    python -m bench.bench_micro [--rounds 200] [--inner 50] [--only detect]
+
+Результат — JSON: для каждого кейса ops/sec и p50/p95/p99 одного вызова в микросекундах.
+Сравнивать версии: сохранить вывод до и после изменения и сделать diff.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+# Настройки читаются при импорте bot.config — окружение готовим до импорта бота
+_tmpdir = tempfile.mkdtemp(prefix="bench-micro-")
+os.environ["DATABASE_PATH"] = os.path.join(_tmpdir, "bench.db")
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCH")
+
+from bench.bench_lang_detect import SAMPLES  # noqa: E402
+from bench.common import dump, latency_summary  # noqa: E402
+from bot.db import storage  # noqa: E402
+from bot.handlers.translation import choose_direction, voice_reply_text  # noqa: E402
+from bot.services import fast_path, metrics  # noqa: E402
+from bot.services.cache import LRUCache  # noqa: E402
+from bot.services.lang_detect import analyze_text, detect_language_ex  # noqa: E402
+from bot.services.translation_service import cache_key, normalize_text  # noqa: E402
+
+TEXTS = [text for text, _lang in SAMPLES]
+
+
+def _measure(name: str, fn: Callable[[int], None], rounds: int, inner: int) -> Dict[str, Any]:
+    """fn(i) is called rounds × inner times; latency per call = round time / inner."""
+    fn(0)
+    per_call: List[float] = []
+    started = time.perf_counter()
+    for r in range(rounds):
+        t0 = time.perf_counter()
+        for i in range(inner):
+            fn(r * inner + i)
+        per_call.append((time.perf_counter() - t0) / inner)
+    elapsed = time.perf_counter() - started
+    return {
+        "name": name,
+        "calls": rounds * inner,
+        "ops_per_second": round(rounds * inner / elapsed, 1) if elapsed else 0.0,
+        **latency_summary(per_call, scale=1e6, unit="us"),
+    }
+
+
+async def _measure_async(
+    name: str,
+    fn: Callable[[int], Awaitable[Any]],
+    rounds: int,
+    inner: int,
+) -> Dict[str, Any]:
+    await fn(0)
+    per_call: List[float] = []
+    started = time.perf_counter()
+    for r in range(rounds):
+        t0 = time.perf_counter()
+        for i in range(inner):
+            await fn(r * inner + i)
+        per_call.append((time.perf_counter() - t0) / inner)
+    elapsed = time.perf_counter() - started
+    return {
+        "name": name,
+        "calls": rounds * inner,
+        "ops_per_second": round(rounds * inner / elapsed, 1) if elapsed else 0.0,
+        **latency_summary(per_call, scale=1e6, unit="us"),
+    }
+
+
+def sync_cases() -> Dict[str, Callable[[int], None]]:
+    detections = [detect_language_ex(text) for text in TEXTS]
+    lru = LRUCache(1024)
+    for i in range(1024):
+        lru.set(i, i)
+
+    def detect(i: int) -> None:
+        detect_language_ex(TEXTS[i % len(TEXTS)])
+
+    def analyze(i: int) -> None:
+        analyze_text(TEXTS[i % len(TEXTS)])
+
+    def direction(i: int) -> None:
+        j = i % len(TEXTS)
+        choose_direction(detections[j].lang, "RU", "EN" if i % 2 else "VI", TEXTS[j], detections[j].stats)
+
+    def key(i: int) -> None:
+        cache_key(TEXTS[i % len(TEXTS)], "RU", "EN")
+
+    def normalize(i: int) -> None:
+        normalize_text(TEXTS[i % len(TEXTS)])
+
+    def lru_hit(i: int) -> None:
+        lru.get(i % 1024)
+
+    def lru_set(i: int) -> None:
+        lru.set(i, i)
+
+    def reply_filter(i: int) -> None:
+        voice_reply_text(TEXTS[i % len(TEXTS)], "RU")
+
+    def phrase(i: int) -> None:
+        fast_path.lookup_phrase(TEXTS[i % len(TEXTS)], "RU", "EN")
+
+    def untranslatable(i: int) -> None:
+        fast_path.untranslatable_kind(TEXTS[i % len(TEXTS)])
+
+    def observe(i: int) -> None:
+        metrics.observe("bench_seconds", (i % 100) / 1000.0)
+
+    return {
+        "detect_language_ex": detect,
+        "analyze_text": analyze,
+        "choose_direction": direction,
+        "cache_key": key,
+        "normalize_text": normalize,
+        "lru_get_hit": lru_hit,
+        "lru_set_evict": lru_set,
+        "voice_reply_text": reply_filter,
+        "fast_path_lookup_phrase": phrase,
+        "fast_path_untranslatable_kind": untranslatable,
+        "metrics_observe": observe,
+    }
+
+
+async def run_storage_cases(rounds: int, inner: int, only: str) -> List[Dict[str, Any]]:
+    try:
+        await storage.init_db()
+        users = 1000
+        for user_id in range(users):
+            await storage.set_language_pair(user_id, "RU", "EN")
+
+        async def cached(i: int) -> None:
+            await storage.get_user_languages(i % users)
+
+        async def uncached(i: int) -> None:
+            storage._user_cache.clear()
+            await storage.get_user_languages(i % users)
+
+        async def translation_miss(i: int) -> None:
+            await storage.get_cached_translation(f"missing-{i}")
+
+        cases = {
+            "storage_get_user_languages_cached": cached,
+            "storage_get_user_languages_db": uncached,
+            "storage_get_cached_translation_miss": translation_miss,
+        }
+        return [
+            await _measure_async(name, fn, rounds, inner)
+            for name, fn in cases.items()
+            if only in name
+        ]
+    finally:
+        await storage.close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--inner", type=int, default=50)
+    parser.add_argument("--only", default="", help="run only cases whose name contains this")
+    args = parser.parse_args()
+
+    results = [
+        _measure(name, fn, args.rounds, args.inner)
+        for name, fn in sync_cases().items()
+        if args.only in name
+    ]
+    # SQLite — по одному запросу на вызов, раундов меньше
+    results += asyncio.run(
+        run_storage_cases(max(1, args.rounds // 10), args.inner, args.only)
+    )
+    print(dump(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Общие помощники бенчмарков: перцентили и JSON-вывод."""
+import json
+import math
+from typing import Any, Dict, Sequence
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence (q in 0..100)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies: Sequence[float], scale: float = 1000.0, unit: str = "ms") -> Dict[str, float]:
+    """p50/p95/p99/max of latencies in seconds, converted with `scale` (ms by default)."""
+    values = sorted(latencies)
+    return {
+        f"p50_{unit}": round(percentile(values, 50) * scale, 3),
+        f"p95_{unit}": round(percentile(values, 95) * scale, 3),
+        f"p99_{unit}": round(percentile(values, 99) * scale, 3),
+        f"max_{unit}": round((values[-1] if values else 0.0) * scale, 3),
+    }
+
+
+def dump(result: Any) -> str:
+    return json.dumps(result, ensure_ascii=False, indent=2, sort_keys=False)
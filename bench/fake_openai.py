@@ -0,0 +1,330 @@
+"""
+Фейковый OpenAI API для офлайн-бенчмарков: chat.completions (обычный, JSON-режим,
+стрим) и audio.transcriptions (text и verbose_json) с настраиваемыми задержками
+и ошибками (500 и 429 с retry-after-ms).
+
+    python -m bench.fake_openai --port 8082 --latency-ms 400 --jitter-ms 150 \\
+        --error-rate 0.01 --rate-limit-rate 0.02
+
+Бота запускаем с OPENAI_BASE_URL=http://127.0.0.1:8082/v1 (ключ может быть любым).
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+# Ответы в каждом языке — их пропускает проверка языка перевода в боте
+PHRASES: Dict[str, List[str]] = {
+    "RU": [
+        "Сколько это стоит?",
+        "Спасибо большое, до завтра.",
+        "Где находится ближайшая аптека?",
+        "Встречаемся у входа в десять часов.",
+    ],
+    "EN": [
+        "How much does it cost?",
+        "Thank you very much, see you tomorrow.",
+        "Where is the nearest pharmacy?",
+        "We meet at the entrance at ten o'clock.",
+    ],
+    "VI": [
+        "Cái này giá bao nhiêu?",
+        "Cảm ơn bạn rất nhiều, hẹn gặp lại ngày mai.",
+        "Hiệu thuốc gần nhất ở đâu?",
+        "Chúng ta gặp nhau ở lối vào lúc mười giờ.",
+    ],
+}
+
+LANG_BY_NAME = {"russian": "RU", "english": "EN", "vietnamese": "VI"}
+WHISPER_CODES = {"ru": "RU", "en": "EN", "vi": "VI"}
+WHISPER_NAMES = {"RU": "russian", "EN": "english", "VI": "vietnamese"}
+
+_TARGET_RE = re.compile(r"Target language:\s*(\w+)")
+
+
+@dataclass
+class FakeOpenAIConfig:
+    latency_ms: float = 300.0
+    jitter_ms: float = 100.0
+    # Whisper обычно медленнее чата
+    whisper_latency_ms: float = 800.0
+    # Пауза между кусками стрима
+    stream_chunk_ms: float = 30.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after_ms: int = 500
+    # Доля голосовых, которые Whisper «слышит» не на языке пары (для второго прохода)
+    wrong_language_rate: float = 0.0
+
+
+def _delay(mean_ms: float, jitter_ms: float) -> float:
+    return max(0.0, random.gauss(mean_ms, jitter_ms)) / 1000.0
+
+
+def _phrase(lang: str, seed: str, min_len: int = 0) -> str:
+    """Deterministic text in `lang`, roughly as long as the source (at least min_len)."""
+    phrases = PHRASES.get(lang, PHRASES["EN"])
+    index = zlib.crc32(seed.encode("utf-8"))
+    parts = [phrases[index % len(phrases)]]
+    while sum(len(p) + 1 for p in parts) < min_len:
+        index += 1
+        parts.append(phrases[index % len(phrases)])
+    return " ".join(parts)
+
+
+def _target_lang(prompt: str) -> str:
+    match = _TARGET_RE.search(prompt)
+    if not match:
+        return "EN"
+    return LANG_BY_NAME.get(match.group(1).lower(), "EN")
+
+
+def _source_text(prompt: str) -> str:
+    _, _, text = prompt.partition("Text:\n")
+    return text or prompt
+
+
+class FakeOpenAI:
+    """OpenAI API stand-in: answers chat and transcription requests and counts them."""
+
+    def __init__(self, config: Optional[FakeOpenAIConfig] = None):
+        self.config = config or FakeOpenAIConfig()
+        self.calls: Dict[str, int] = {}
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _failure(self, kind: str) -> Optional[web.Response]:
+        """Injected failure response, or None."""
+        roll = random.random()
+        if roll < self.config.rate_limit_rate:
+            self._count(f"{kind}_429")
+            return web.json_response(
+                {"error": {"message": "Rate limit reached (fake)", "type": "requests"}},
+                status=429,
+                headers={"retry-after-ms": str(self.config.retry_after_ms)},
+            )
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self._count(f"{kind}_500")
+            return web.json_response(
+                {"error": {"message": "Internal error (fake)", "type": "server_error"}},
+                status=500,
+            )
+        return None
+
+    # -- chat ---------------------------------------------------------------
+
+    def _chat_content(self, body: Dict[str, Any]) -> str:
+        messages = body.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        lang = _target_lang(prompt)
+        json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        if not json_mode:
+            text = _source_text(prompt)
+            return _phrase(lang, text, len(text) // 2)
+
+        items_raw = prompt.partition("Items:\n")[2]
+        if items_raw:
+            # Пакетный запрос микробатчера
+            items = json.loads(items_raw)
+            return json.dumps(
+                {
+                    "translations": [
+                        {"id": item["id"], "translation": _phrase(lang, item["text"]), "language": lang}
+                        for item in items
+                    ]
+                },
+                ensure_ascii=False,
+            )
+        text = _source_text(prompt)
+        return json.dumps(
+            {"translation": _phrase(lang, text, len(text) // 2), "language": lang},
+            ensure_ascii=False,
+        )
+
+    async def handle_chat(self, request: web.Request) -> web.StreamResponse:
+        self._count("chat")
+        body = await request.json()
+        await asyncio.sleep(_delay(self.config.latency_ms, self.config.jitter_ms))
+        failure = self._failure("chat")
+        if failure is not None:
+            return failure
+
+        content = self._chat_content(body)
+        created = int(time.time())
+        completion_id = f"chatcmpl-fake-{random.getrandbits(32):x}"
+        if not body.get("stream"):
+            return web.json_response(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": body.get("model", "fake"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }
+            )
+
+        self._count("chat_stream")
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if i == 0 else " " + word},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(self.config.stream_chunk_ms / 1000.0)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    # -- audio --------------------------------------------------------------
+
+    async def handle_transcription(self, request: web.Request) -> web.Response:
+        self._count("transcription")
+        fields: Dict[str, str] = {}
+        size = 0
+        async for part in await request.multipart():
+            if part.name == "file":
+                size = len(await part.read())
+            else:
+                fields[part.name] = await part.text()
+
+        await asyncio.sleep(
+            _delay(self.config.whisper_latency_ms, self.config.jitter_ms) + size / 1e7
+        )
+        failure = self._failure("transcription")
+        if failure is not None:
+            return failure
+
+        forced = WHISPER_CODES.get(fields.get("language", ""))
+        if forced:
+            lang = forced
+        elif random.random() < self.config.wrong_language_rate:
+            lang = "EN" if random.random() < 0.5 else "VI"
+        else:
+            lang = "RU"
+        text = _phrase(lang, str(size))
+
+        if fields.get("response_format") == "verbose_json":
+            return web.json_response(
+                {
+                    "task": "transcribe",
+                    "language": WHISPER_NAMES[lang],
+                    "duration": 3.0,
+                    "text": text,
+                    "segments": [
+                        {
+                            "id": 0,
+                            "start": 0.0,
+                            "end": 3.0,
+                            "text": text,
+                            "avg_logprob": -0.2,
+                            "no_speech_prob": 0.01,
+                        }
+                    ],
+                }
+            )
+        if fields.get("response_format") == "text":
+            return web.Response(text=text + "\n", content_type="text/plain")
+        return web.json_response({"text": text})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.calls)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post("/v1/chat/completions", self.handle_chat)
+        app.router.add_post("/v1/audio/transcriptions", self.handle_transcription)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+async def start_fake_openai(
+    config: Optional[FakeOpenAIConfig] = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+):
+    """
+    Start the fake API in the current loop. Returns (fake, runner, base_url);
+    port 0 picks a free port.
+    """
+    fake = FakeOpenAI(config)
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    return fake, runner, f"http://{host}:{bound_port}/v1"
+
+
+def add_config_args(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeOpenAIConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--whisper-latency-ms", type=float, default=defaults.whisper_latency_ms)
+    parser.add_argument("--stream-chunk-ms", type=float, default=defaults.stream_chunk_ms)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+    parser.add_argument("--retry-after-ms", type=int, default=defaults.retry_after_ms)
+    parser.add_argument("--wrong-language-rate", type=float, default=defaults.wrong_language_rate)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeOpenAIConfig:
+    return FakeOpenAIConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        whisper_latency_ms=args.whisper_latency_ms,
+        stream_chunk_ms=args.stream_chunk_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after_ms=args.retry_after_ms,
+        wrong_language_rate=args.wrong_language_rate,
+    )
+
+
+async def _serve(config: FakeOpenAIConfig, port: int) -> None:
+    _fake, runner, base_url = await start_fake_openai(config, port=port)
+    print(f"Fake OpenAI on {base_url} (stats: /stats)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=8082)
+    add_config_args(parser)
+    args = parser.parse_args()
+    asyncio.run(_serve(config_from_args(args), args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Фейковый Telegram для нагрузочных прогонов webhook-режима без сети.
+
+1. Фейковый Bot API (отвечает на sendMessage/editMessageText/getFile/… и отдаёт файлы):
+       python -m bench.fake_telegram api --port 8081
+   Бота запускаем с TELEGRAM_API_BASE=http://127.0.0.1:8081:
+       TELEGRAM_API_BASE=http://127.0.0.1:8081 WEBHOOK_WORKERS=4 python -m bot.webhook
+
+2. Отправитель апдейтов в webhook:
+       python -m bench.fake_telegram send --url http://127.0.0.1:8080/webhook \\
+           --users 50 --messages 20 --secret "$WEBHOOK_SECRET"
+
+3. FakeSession — сессия aiogram без сети: Bot(..., session=FakeSession()) отвечает
+   на методы Bot API локально, и апдейты можно прогонять через настоящие роутеры
+   dp.feed_update(...) прямо в процессе (см. bench/bench_load.py).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiohttp import ClientSession, web
+
+SAMPLE_TEXTS = [
+    "спасибо",
+    "Сколько это стоит?",
+    "how much?",
+    "Where is the nearest pharmacy?",
+    "xin chào",
+    "Cảm ơn bạn rất nhiều",
+    "Завтра в 10 встречаемся у входа в торговый центр",
+]
+
+# Минимальный OGG-заголовок: для Whisper-заглушки содержимое не важно
+FAKE_OGG = b"OggS" + b"\x00" * 256
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+
+def _chat(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+
+
+def make_text_update(user_id: int, text: str) -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def make_command_update(user_id: int, command: str) -> Dict[str, Any]:
+    update = make_text_update(user_id, command)
+    update["message"]["entities"] = [
+        {"type": "bot_command", "offset": 0, "length": len(command.split()[0])}
+    ]
+    return update
+
+
+def make_callback_update(user_id: int, data: str) -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": _chat(user_id),
+                "text": "Выбери язык",
+            },
+        },
+    }
+
+
+def make_voice_update(
+    user_id: int,
+    file_unique_id: Optional[str] = None,
+    duration: int = 3,
+) -> Dict[str, Any]:
+    unique = file_unique_id or f"voice-{next(_message_ids)}"
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "voice": {
+                "file_id": f"file-{unique}",
+                "file_unique_id": unique,
+                "duration": duration,
+                "mime_type": "audio/ogg",
+                "file_size": len(FAKE_OGG),
+            },
+        },
+    }
+
+
+def fake_result(method: str, params: Dict[str, Any]) -> Any:
+    """A plausible Bot API result for the method (raw JSON, as Telegram would return it)."""
+    method = method.lower()
+    if method in ("sendmessage", "editmessagetext", "senddocument"):
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": int(params.get("message_id") or next(_message_ids)),
+            "date": int(time.time()),
+            "chat": _chat(chat_id),
+            "text": params.get("text") or "",
+        }
+    if method == "getfile":
+        file_id = params.get("file_id", "file")
+        return {
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_size": len(FAKE_OGG),
+            "file_path": f"voice/{file_id}.ogg",
+        }
+    if method == "getme":
+        return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+    return True
+
+
+class FakeBotAPI:
+    """Bot API stand-in: answers every method with a plausible result and counts calls."""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        return fake_result(method, params)
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        self.calls["file"] = self.calls.get("file", 0) + 1
+        return web.Response(body=FAKE_OGG, content_type="audio/ogg")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.calls)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+class FakeSession(BaseSession):
+    """
+    aiogram session that never touches the network: every method gets
+    fake_result() after `latency_ms`, downloads return FAKE_OGG.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        super().__init__()
+        self.latency = latency_ms / 1000.0
+        self.calls: Dict[str, int] = {}
+
+    async def close(self) -> None:
+        pass
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[Any],
+        timeout: Optional[int] = None,
+    ) -> Any:
+        name = method.__api_method__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = {
+            key: getattr(method, key, None) for key in ("chat_id", "message_id", "text", "file_id")
+        }
+        content = json.dumps({"ok": True, "result": fake_result(name, params)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    async def stream_content(
+        self,
+        url: str,
+        headers: Optional[Dict[str, Any]] = None,
+        timeout: int = 30,
+        chunk_size: int = 65536,
+        raise_for_status: bool = True,
+    ) -> AsyncGenerator[bytes, None]:
+        self.calls["file"] = self.calls.get("file", 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        yield FAKE_OGG
+
+
+async def run_api(port: int) -> None:
+    runner = web.AppRunner(FakeBotAPI().app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    print(f"Fake Bot API on http://127.0.0.1:{port} (stats: /stats)")
+    await asyncio.Event().wait()
+
+
+async def send_updates(
+    url: str,
+    users: int,
+    messages: int,
+    secret: str = "",
+    voice_share: float = 0.0,
+    setup: bool = True,
+) -> Dict[str, Any]:
+    """
+    Каждый пользователь сначала выбирает пару (/start + кнопка EN), затем шлёт
+    `messages` апдейтов подряд. Возвращает пропускную способность приёма апдейтов.
+    """
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    latencies: List[float] = []
+    failures = 0
+
+    async with ClientSession(headers=headers) as session:
+
+        async def post(update: Dict[str, Any]) -> None:
+            nonlocal failures
+            started = time.perf_counter()
+            async with session.post(url, data=json.dumps(update)) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    failures += 1
+            latencies.append(time.perf_counter() - started)
+
+        async def user_flow(user_id: int) -> None:
+            if setup:
+                await post(make_command_update(user_id, "/start"))
+                await post(make_callback_update(user_id, "to:EN"))
+            for _ in range(messages):
+                if random.random() < voice_share:
+                    await post(make_voice_update(user_id))
+                else:
+                    await post(make_text_update(user_id, random.choice(SAMPLE_TEXTS)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_flow(100000 + i) for i in range(users)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "updates": len(latencies),
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    api = sub.add_parser("api", help="run the fake Bot API server")
+    api.add_argument("--port", type=int, default=8081)
+
+    send = sub.add_parser("send", help="send synthetic updates to a webhook")
+    send.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    send.add_argument("--users", type=int, default=20)
+    send.add_argument("--messages", type=int, default=10)
+    send.add_argument("--secret", default="")
+    send.add_argument("--voice-share", type=float, default=0.0)
+
+    args = parser.parse_args()
+    if args.command == "api":
+        asyncio.run(run_api(args.port))
+    else:
+        result = asyncio.run(
+            send_updates(args.url, args.users, args.messages, args.secret, args.voice_share)
+        )
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
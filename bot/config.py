@@ -13,6 +13,147 @@ class Settings:
     openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
     openai_whisper_model: str = os.getenv("OPENAI_WHISPER_MODEL", "whisper-1")
     database_path: str = os.getenv("DATABASE_PATH", "bot.db")
+    # Свой (или тестовый) Bot API сервер вместо api.telegram.org
+    telegram_api_base: str = os.getenv("TELEGRAM_API_BASE", "")
+    # OpenAI-совместимый API вместо api.openai.com (например, bench/fake_openai.py)
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "")
+
+    # Webhook-режим (python -m bot.webhook)
+    webhook_url: str = os.getenv("WEBHOOK_URL", "")  # публичный адрес; пусто — не вызывать setWebhook
+    webhook_path: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    webhook_secret: str = os.getenv("WEBHOOK_SECRET", "")
+    webhook_host: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    webhook_port: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+    webhook_workers: int = int(os.getenv("WEBHOOK_WORKERS", "1"))
+    # Сколько апдейтов может ждать в очереди одного воркера
+    webhook_queue_size: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+    # Кэш переводов: in-process LRU + таблица translation_cache в SQLite
+    translation_cache_size: int = int(os.getenv("TRANSLATION_CACHE_SIZE", "2048"))
+    translation_cache_ttl: int = int(os.getenv("TRANSLATION_CACHE_TTL", "86400"))
+    # "lru" — вытесняем давно не использованные, "fifo" — самые старые по времени записи
+    translation_cache_policy: str = os.getenv("TRANSLATION_CACHE_POLICY", "lru")
+    translation_cache_db_max_rows: int = int(os.getenv("TRANSLATION_CACHE_DB_MAX_ROWS", "50000"))
+    translation_cache_db_max_age: int = int(os.getenv("TRANSLATION_CACHE_DB_MAX_AGE", str(30 * 86400)))
+
+    # Перевод одним запросом: модель возвращает JSON с переводом и кодом языка ответа
+    translation_structured: bool = os.getenv("TRANSLATION_STRUCTURED", "1") == "1"
+
+    # Потоковый перевод длинных текстов с постепенным редактированием сообщения
+    translation_stream: bool = os.getenv("TRANSLATION_STREAM", "1") == "1"
+    stream_min_chars: int = int(os.getenv("STREAM_MIN_CHARS", "200"))
+    # Не чаще одного edit_text в столько секунд на сообщение (лимиты Telegram)
+    stream_edit_interval: float = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+    # Пул процессов для ffmpeg/pydub: воркеры, предел очереди и таймаут задачи (сек)
+    audio_workers: int = int(os.getenv("AUDIO_WORKERS", "2"))
+    audio_queue_limit: int = int(os.getenv("AUDIO_QUEUE_LIMIT", "8"))
+    audio_job_timeout: float = float(os.getenv("AUDIO_JOB_TIMEOUT", "60"))
+
+    # Whisper verbose_json: язык и уверенность сегментов решают, нужен ли второй проход
+    voice_verbose: bool = os.getenv("VOICE_VERBOSE", "1") == "1"
+    # Сразу запускать параллельно проход с языком lang_from (быстрее, но дороже)
+    voice_speculative: bool = os.getenv("VOICE_SPECULATIVE", "0") == "1"
+    voice_min_avg_logprob: float = float(os.getenv("VOICE_MIN_AVG_LOGPROB", "-1.0"))
+
+    # Лимиты OpenAI (0 — без ограничения), размер очереди и число повторов
+    openai_chat_rpm: float = float(os.getenv("OPENAI_CHAT_RPM", "500"))
+    openai_chat_tpm: float = float(os.getenv("OPENAI_CHAT_TPM", "200000"))
+    openai_whisper_rpm: float = float(os.getenv("OPENAI_WHISPER_RPM", "50"))
+    openai_queue_limit: int = int(os.getenv("OPENAI_QUEUE_LIMIT", "200"))
+    openai_max_retries: int = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+
+    # Очередь задач в SQLite: апдейт → transcribe → translate → send отдельными пулами воркеров
+    job_queue_enabled: bool = os.getenv("JOB_QUEUE_ENABLED", "0") == "1"
+    job_transcribe_concurrency: int = int(os.getenv("JOB_TRANSCRIBE_CONCURRENCY", "4"))
+    job_translate_concurrency: int = int(os.getenv("JOB_TRANSLATE_CONCURRENCY", "8"))
+    job_send_concurrency: int = int(os.getenv("JOB_SEND_CONCURRENCY", "8"))
+    job_max_attempts: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    job_lease_seconds: float = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+    job_poll_interval: float = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+    # Упавшие задачи (status='failed') храним для разбора столько секунд
+    job_failed_max_age: int = int(os.getenv("JOB_FAILED_MAX_AGE", str(7 * 24 * 3600)))
+
+    # Микробатчинг коротких переводов: окно ожидания (сек), размер пачки и лимиты символов
+    batch_enabled: bool = os.getenv("BATCH_ENABLED", "0") == "1"
+    batch_window: float = float(os.getenv("BATCH_WINDOW", "0.02"))
+    batch_max_items: int = int(os.getenv("BATCH_MAX_ITEMS", "16"))
+    batch_max_chars: int = int(os.getenv("BATCH_MAX_CHARS", "2000"))
+    batch_max_text_chars: int = int(os.getenv("BATCH_MAX_TEXT_CHARS", "200"))
+
+    # Локальный HTTP /metrics в формате Prometheus; 0 — выключен.
+    # В webhook-режиме с воркерами воркер i слушает METRICS_PORT + i.
+    metrics_host: str = os.getenv("METRICS_HOST", "127.0.0.1")
+    metrics_port: int = int(os.getenv("METRICS_PORT", "0"))
+
+    # Длинные тексты (длиннее chunk_threshold символов) режем на куски по chunk_max_chars
+    # и переводим параллельно, не больше chunk_concurrency кусков одновременно
+    chunk_threshold: int = int(os.getenv("CHUNK_THRESHOLD", "2000"))
+    chunk_max_chars: int = int(os.getenv("CHUNK_MAX_CHARS", "1500"))
+    chunk_concurrency: int = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+
+    # Длинное аудио (дольше long_audio_seconds) режем по паузам на куски до
+    # audio_segment_seconds и распознаём параллельно; 0 — всегда одним запросом
+    long_audio_seconds: int = int(os.getenv("LONG_AUDIO_SECONDS", "120"))
+    audio_segment_seconds: int = int(os.getenv("AUDIO_SEGMENT_SECONDS", "60"))
+    audio_min_silence_ms: int = int(os.getenv("AUDIO_MIN_SILENCE_MS", "500"))
+    audio_segment_concurrency: int = int(os.getenv("AUDIO_SEGMENT_CONCURRENCY", "4"))
+
+    # Кэш распознанных аудио по file_unique_id (таблица voice_cache)
+    voice_cache_enabled: bool = os.getenv("VOICE_CACHE_ENABLED", "1") == "1"
+    voice_cache_max_rows: int = int(os.getenv("VOICE_CACHE_MAX_ROWS", "20000"))
+    voice_cache_max_age: int = int(os.getenv("VOICE_CACHE_MAX_AGE", str(30 * 24 * 3600)))
+
+    # Быстрый путь без модели: эмодзи/числа/ссылки (эхо или пропуск) и таблица частых фраз.
+    # PHRASE_TABLE_PATH — необязательный JSON со строками [ru, en, vi] в дополнение к встроенным
+    fast_path_enabled: bool = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+    fast_path_echo: bool = os.getenv("FAST_PATH_ECHO", "1") == "1"
+    phrase_table_path: str = os.getenv("PHRASE_TABLE_PATH", "")
+
+    # Сквозной срок обработки одного апдейта/задачи (сек; 0 — без срока) и таймаут одного HTTP-запроса к OpenAI
+    update_deadline: float = float(os.getenv("UPDATE_DEADLINE", "90"))
+    openai_timeout: float = float(os.getenv("OPENAI_TIMEOUT", "60"))
+    # Хеджирование: если запрос дольше p95 своего типа и размера, параллельно шлём дубль
+    # (чат — в OPENAI_FALLBACK_MODEL, если задана). Дублей не больше HEDGE_MAX_SHARE от запросов
+    hedge_enabled: bool = os.getenv("HEDGE_ENABLED", "1") == "1"
+    hedge_initial_delay: float = float(os.getenv("HEDGE_INITIAL_DELAY", "5.0"))
+    hedge_min_delay: float = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+    hedge_max_share: float = float(os.getenv("HEDGE_MAX_SHARE", "0.05"))
+    openai_fallback_model: str = os.getenv("OPENAI_FALLBACK_MODEL", "")
+
+    # Лимиты отправки в Telegram: всего сообщений в секунду, в личный чат в секунду,
+    # в группу в минуту; burst — сколько можно отправить в чат подряд без паузы
+    telegram_global_rate: float = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+    telegram_chat_rate: float = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+    telegram_group_rate: float = float(os.getenv("TELEGRAM_GROUP_RATE", "20"))
+    telegram_chat_burst: int = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+    # Сколько раз повторять сообщение после RetryAfter
+    outbox_max_retries: int = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+
+    # Детектор не уверен в языке (confidence ниже порога) — переводим сразу в обе стороны
+    # пары и берём прошедший проверку вариант; только для текстов до SPECULATIVE_MAX_CHARS
+    speculative_enabled: bool = os.getenv("SPECULATIVE_ENABLED", "1") == "1"
+    speculative_confidence: float = float(os.getenv("SPECULATIVE_CONFIDENCE", "0.7"))
+    speculative_max_chars: int = int(os.getenv("SPECULATIVE_MAX_CHARS", "500"))
+
+    # Диагностика: сторож event loop (стек, если loop занят дольше LOOP_LAG_THRESHOLD сек),
+    # ASYNCIO_DEBUG=1 — ещё и лог медленных колбэков от самого asyncio (дороже).
+    # /profile доступен только пользователям из ADMIN_IDS (через запятую)
+    diagnostics_enabled: bool = os.getenv("DIAGNOSTICS_ENABLED", "1") == "1"
+    loop_lag_threshold: float = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+    asyncio_debug: bool = os.getenv("ASYNCIO_DEBUG", "0") == "1"
+    admin_ids: tuple = tuple(
+        int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x
+    )
+    profile_dir: str = os.getenv("PROFILE_DIR", "profiles")
+    profile_max_seconds: float = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+    # Кэш языковых пар пользователей (LRU) и сколько последних активных грузить на старте
+    user_cache_size: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    user_cache_warm_size: int = int(os.getenv("USER_CACHE_WARM_SIZE", "1000"))
+    # При WEBHOOK_WORKERS>1 /lang в личке меняет пару в другом воркере, чем тот,
+    # что обслуживает группу: там запись живёт не дольше этого (сек)
+    user_cache_sharded_ttl: float = float(os.getenv("USER_CACHE_SHARDED_TTL", "5"))
 
 
 settings = Settings()
@@ -21,4 +162,7 @@ if not settings.telegram_bot_token:
     raise RuntimeError("TELEGRAM_BOT_TOKEN is not set in environment / .env")
 
 if not settings.openai_api_key:
-    raise RuntimeError("OPENAI_API_KEY is not set in environment / .env")
\ No newline at end of file
+    raise RuntimeError("OPENAI_API_KEY is not set in environment / .env")
+
+if settings.translation_cache_policy not in ("lru", "fifo"):
+    raise RuntimeError("TRANSLATION_CACHE_POLICY must be 'lru' or 'fifo'")
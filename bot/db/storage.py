@@ -1,7 +1,16 @@
+import json
+import logging
+import time
+from dataclasses import dataclass
+
 import aiosqlite
-from typing import Optional, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 from bot.config import settings
+from bot.services import metrics
+from bot.services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
 
 
 CREATE_TABLE_SQL = """
@@ -11,74 +20,572 @@ CREATE TABLE IF NOT EXISTS user_settings (
     lang_to     TEXT,
     updated_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX IF NOT EXISTS idx_user_settings_updated
+    ON user_settings (updated_at);
+"""
+
+CREATE_TRANSLATION_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS translation_cache (
+    cache_key    TEXT PRIMARY KEY,
+    translation  TEXT NOT NULL,
+    created_at   REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_translation_cache_last_used
+    ON translation_cache (last_used_at);
+CREATE INDEX IF NOT EXISTS idx_translation_cache_created
+    ON translation_cache (created_at);
+"""
+
+# Результаты распознавания аудио по file_unique_id Telegram: пересланное голосовое
+# не скачиваем и не распознаём повторно. forced_lang = '' — проход с автоопределением языка.
+CREATE_VOICE_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS voice_cache (
+    file_unique_id TEXT NOT NULL,
+    forced_lang    TEXT NOT NULL,
+    transcript     TEXT NOT NULL,
+    language       TEXT,
+    avg_logprob    REAL NOT NULL DEFAULT 0,
+    no_speech_prob REAL NOT NULL DEFAULT 0,
+    created_at     REAL NOT NULL,
+    last_used_at   REAL NOT NULL,
+    PRIMARY KEY (file_unique_id, forced_lang)
+);
+CREATE INDEX IF NOT EXISTS idx_voice_cache_last_used
+    ON voice_cache (last_used_at);
+CREATE INDEX IF NOT EXISTS idx_voice_cache_created
+    ON voice_cache (created_at);
+"""
+
+# Очередь задач конвейера (transcribe → translate → send) с арендой:
+# задача, взятая воркером, возвращается в очередь, если аренда истекла (например, рестарт).
+CREATE_JOBS_SQL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    stage        TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_until  REAL,
+    created_at   REAL NOT NULL,
+    last_error   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_stage_status
+    ON jobs (stage, status, available_at);
+"""
+
+# WAL: читатели не блокируют писателя, synchronous=NORMAL в WAL безопасен
+# для целостности и не делает fsync на каждый коммит.
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+)
+
+# Все запросы — константы модуля: sqlite3 держит их скомпилированными
+# в кэше подготовленных выражений соединения и не парсит SQL повторно.
+STATEMENT_CACHE_SIZE = 128
+
+SET_LANG_FROM_SQL = """
+INSERT INTO user_settings (user_id, lang_from, lang_to)
+VALUES (?, ?, NULL)
+ON CONFLICT(user_id) DO UPDATE SET
+    lang_from = excluded.lang_from,
+    lang_to   = NULL,
+    updated_at = CURRENT_TIMESTAMP
+RETURNING lang_from, lang_to
+"""
+
+SET_LANG_TO_SQL = """
+UPDATE user_settings
+SET lang_to = ?, updated_at = CURRENT_TIMESTAMP
+WHERE user_id = ?
+RETURNING lang_from, lang_to
 """
 
+SET_LANGUAGE_PAIR_SQL = """
+INSERT INTO user_settings (user_id, lang_from, lang_to)
+VALUES (?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    lang_from = excluded.lang_from,
+    lang_to   = excluded.lang_to,
+    updated_at = CURRENT_TIMESTAMP
+RETURNING lang_from, lang_to
+"""
+
+GET_USER_LANGUAGES_SQL = "SELECT lang_from, lang_to FROM user_settings WHERE user_id = ?"
+
+RECENT_USERS_SQL = """
+SELECT user_id, lang_from, lang_to FROM user_settings
+ORDER BY updated_at DESC
+LIMIT ?
+"""
+
+RESET_USER_LANGUAGES_SQL = """
+UPDATE user_settings
+SET lang_from = NULL,
+    lang_to   = NULL,
+    updated_at = CURRENT_TIMESTAMP
+WHERE user_id = ?
+RETURNING lang_from, lang_to
+"""
+
+# Читаем и отмечаем использование одним запросом
+TOUCH_TRANSLATION_SQL = """
+UPDATE translation_cache
+SET last_used_at = ?
+WHERE cache_key = ? AND created_at >= ?
+RETURNING translation
+"""
+
+PUT_TRANSLATION_SQL = """
+INSERT INTO translation_cache (cache_key, translation, created_at, last_used_at)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(cache_key) DO UPDATE SET
+    translation  = excluded.translation,
+    created_at   = excluded.created_at,
+    last_used_at = excluded.last_used_at
+"""
+
+PRUNE_TRANSLATIONS_BY_AGE_SQL = "DELETE FROM translation_cache WHERE created_at < ?"
+
+PRUNE_TRANSLATIONS_BY_SIZE_SQL = """
+DELETE FROM translation_cache
+WHERE cache_key IN (
+    SELECT cache_key FROM translation_cache
+    ORDER BY {order_column} DESC
+    LIMIT -1 OFFSET ?
+)
+"""
+
+TOUCH_VOICE_SQL = """
+UPDATE voice_cache
+SET last_used_at = ?
+WHERE file_unique_id = ? AND forced_lang = ? AND created_at >= ?
+RETURNING transcript, language, avg_logprob, no_speech_prob
+"""
+
+PUT_VOICE_SQL = """
+INSERT INTO voice_cache (
+    file_unique_id, forced_lang, transcript, language,
+    avg_logprob, no_speech_prob, created_at, last_used_at
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(file_unique_id, forced_lang) DO UPDATE SET
+    transcript     = excluded.transcript,
+    language       = excluded.language,
+    avg_logprob    = excluded.avg_logprob,
+    no_speech_prob = excluded.no_speech_prob,
+    created_at     = excluded.created_at,
+    last_used_at   = excluded.last_used_at
+"""
+
+PRUNE_VOICE_BY_AGE_SQL = "DELETE FROM voice_cache WHERE created_at < ?"
+
+PRUNE_VOICE_BY_SIZE_SQL = """
+DELETE FROM voice_cache
+WHERE rowid IN (
+    SELECT rowid FROM voice_cache
+    ORDER BY last_used_at DESC
+    LIMIT -1 OFFSET ?
+)
+"""
+
+ENQUEUE_JOB_SQL = """
+INSERT INTO jobs (stage, payload, available_at, created_at)
+VALUES (?, ?, ?, ?)
+"""
+
+# Одним запросом: берём самую старую доступную задачу этапа (новую или с истёкшей арендой)
+LEASE_JOB_SQL = """
+UPDATE jobs
+SET status = 'leased', lease_until = ?, attempts = attempts + 1
+WHERE id = (
+    SELECT id FROM jobs
+    WHERE stage = ?
+      AND ((status = 'pending' AND available_at <= ?)
+           OR (status = 'leased' AND lease_until < ?))
+    ORDER BY id
+    LIMIT 1
+)
+RETURNING id, payload, attempts, created_at
+"""
+
+ACK_JOB_SQL = "DELETE FROM jobs WHERE id = ?"
+
+RETRY_JOB_SQL = """
+UPDATE jobs
+SET status = 'pending', available_at = ?, lease_until = NULL, last_error = ?
+WHERE id = ?
+"""
+
+# Продление аренды: только пока задача у того же воркера (attempts меняется при каждой аренде)
+RENEW_JOB_LEASE_SQL = """
+UPDATE jobs
+SET lease_until = ?
+WHERE id = ? AND status = 'leased' AND attempts = ?
+"""
+
+SAVE_JOB_PAYLOAD_SQL = "UPDATE jobs SET payload = ? WHERE id = ?"
+
+PRUNE_FAILED_JOBS_SQL = "DELETE FROM jobs WHERE status = 'failed' AND created_at < ?"
+
+GIVE_UP_JOB_SQL = """
+UPDATE jobs
+SET status = 'failed', lease_until = NULL, last_error = ?
+WHERE id = ?
+"""
+
+JOB_DEPTHS_SQL = """
+SELECT stage, COUNT(*) FROM jobs
+WHERE status IN ('pending', 'leased')
+GROUP BY stage
+"""
+
+# Долгоживущее соединение: создаётся в init_db(), закрывается в close_db().
+# Работает в autocommit-режиме, поэтому отдельный commit() на каждый вызов не нужен.
+_db: Optional[aiosqlite.Connection] = None
+
+# Write-through кэш настроек пользователей: заполняется при чтении,
+# синхронно обновляется всеми функциями записи ниже. Хранит и «нет записи» (None),
+# чтобы неизвестные пользователи тоже не ходили на диск.
+# Write-through работает только внутри процесса: у шардированных воркеров вебхука
+# (чат группы и личка пользователя в разных воркерах) запись устаревает по TTL.
+_MISSING = object()
+_user_cache = LRUCache(
+    settings.user_cache_size,
+    ttl=settings.user_cache_sharded_ttl if settings.webhook_workers > 1 else 0,
+)
+
+LangPair = Tuple[Optional[str], Optional[str]]
+
+
+def _conn() -> aiosqlite.Connection:
+    if _db is None:
+        raise RuntimeError("Database is not initialized, call init_db() first")
+    return _db
+
 
 async def init_db() -> None:
-    """Initialize SQLite database and tables."""
-    async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute(CREATE_TABLE_SQL)
-        await db.commit()
+    """Open the shared connection, apply pragmas and create tables."""
+    global _db
+
+    if _db is None:
+        _db = await aiosqlite.connect(
+            settings.database_path,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in PRAGMAS:
+            await _db.execute(pragma)
+
+    await _db.executescript(CREATE_TABLE_SQL)
+    await _db.executescript(CREATE_TRANSLATION_CACHE_SQL)
+    await _db.executescript(CREATE_VOICE_CACHE_SQL)
+    await _db.executescript(CREATE_JOBS_SQL)
+    await prune_translation_cache()
+    await prune_voice_cache()
+    await prune_failed_jobs()
+
+
+async def close_db() -> None:
+    """Close the shared connection."""
+    global _db
+
+    if _db is not None:
+        await _db.close()
+        _db = None
+    _user_cache.clear()
+
+
+@metrics.timed("db_user_write")
+async def _write_user_row(user_id: int, sql: str, params: tuple) -> Optional[LangPair]:
+    """Run a user_settings write with RETURNING and store the result in the cache."""
+    async with _conn().execute(sql, params) as cursor:
+        row = await cursor.fetchone()
+
+    pair = (row[0], row[1]) if row is not None else None
+    _user_cache.set(user_id, pair)
+    return pair
 
 
 async def set_lang_from(user_id: int, lang_from: str) -> None:
     """Set or update the first language for a user."""
-    async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute(
-            """
-            INSERT INTO user_settings (user_id, lang_from, lang_to)
-            VALUES (?, ?, NULL)
-            ON CONFLICT(user_id) DO UPDATE SET
-                lang_from = excluded.lang_from,
-                lang_to   = NULL,
-                updated_at = CURRENT_TIMESTAMP
-            """,
-            (user_id, lang_from),
-        )
-        await db.commit()
+    await _write_user_row(user_id, SET_LANG_FROM_SQL, (user_id, lang_from))
 
 
 async def set_lang_to(user_id: int, lang_to: str) -> None:
     """Set or update the second language for a user."""
-    async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute(
-            """
-            UPDATE user_settings
-            SET lang_to = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-            """,
-            (lang_to, user_id),
-        )
-        await db.commit()
+    await _write_user_row(user_id, SET_LANG_TO_SQL, (lang_to, user_id))
+
+
+async def set_language_pair(
+    user_id: int,
+    lang_from: str,
+    lang_to: str,
+) -> LangPair:
+    """Upsert both languages and return the stored (lang_from, lang_to) in one round trip."""
+    pair = await _write_user_row(
+        user_id, SET_LANGUAGE_PAIR_SQL, (user_id, lang_from, lang_to)
+    )
+    return pair  # type: ignore[return-value]
 
 
 async def get_user_languages(
     user_id: int,
-) -> Optional[Tuple[Optional[str], Optional[str]]]:
+) -> Optional[LangPair]:
     """Return (lang_from, lang_to) for the user, or None if not found."""
-    async with aiosqlite.connect(settings.database_path) as db:
-        async with db.execute(
-            "SELECT lang_from, lang_to FROM user_settings WHERE user_id = ?",
-            (user_id,),
-        ) as cursor:
+    cached = _user_cache.get(user_id, _MISSING)
+    if cached is not _MISSING:
+        return cached
+
+    with metrics.timed("db_get_user_languages"):
+        async with _conn().execute(GET_USER_LANGUAGES_SQL, (user_id,)) as cursor:
             row = await cursor.fetchone()
 
-    if row is None:
-        return None
-    return row[0], row[1]
+    pair = (row[0], row[1]) if row is not None else None
+    _user_cache.set(user_id, pair)
+    return pair
 
 
 async def reset_user_languages(user_id: int) -> None:
     """Reset both languages for the user."""
-    async with aiosqlite.connect(settings.database_path) as db:
-        await db.execute(
-            """
-            UPDATE user_settings
-            SET lang_from = NULL,
-                lang_to   = NULL,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-            """,
-            (user_id,),
+    await _write_user_row(user_id, RESET_USER_LANGUAGES_SQL, (user_id,))
+
+
+async def warm_user_cache(limit: Optional[int] = None) -> int:
+    """
+    Preload settings of the most recently active users (by updated_at).
+    Returns the number of cached users.
+    """
+    if limit is None:
+        limit = settings.user_cache_warm_size
+    limit = min(limit, settings.user_cache_size)
+    if limit <= 0:
+        return 0
+
+    async with _conn().execute(RECENT_USERS_SQL, (limit,)) as cursor:
+        rows = await cursor.fetchall()
+
+    # Самых свежих кладём последними, чтобы они дольше жили в LRU
+    for user_id, lang_from, lang_to in reversed(rows):
+        _user_cache.set(user_id, (lang_from, lang_to))
+    return len(rows)
+
+
+# size/hits/misses/evictions кэша настроек — в /metrics
+metrics.register_collector(lambda: metrics.export_stats("user_cache", _user_cache.stats()))
+
+
+@metrics.timed("db_get_translation")
+async def get_cached_translation(cache_key: str) -> Optional[str]:
+    """Return a persisted translation for the cache key, or None."""
+    now = time.time()
+    max_age = settings.translation_cache_db_max_age
+    min_created_at = now - max_age if max_age > 0 else 0
+
+    async with _conn().execute(
+        TOUCH_TRANSLATION_SQL, (now, cache_key, min_created_at)
+    ) as cursor:
+        row = await cursor.fetchone()
+
+    if row is None:
+        return None
+    return row[0]
+
+
+@metrics.timed("db_put_translation")
+async def put_cached_translation(cache_key: str, translation: str) -> None:
+    """Insert or refresh a translation in the persistent cache."""
+    now = time.time()
+    await _conn().execute(PUT_TRANSLATION_SQL, (cache_key, translation, now, now))
+
+
+@metrics.timed("db_prune_translations")
+async def prune_translation_cache() -> int:
+    """
+    Evict expired rows and trim the table down to the configured size.
+    Order of eviction follows settings.translation_cache_policy
+    (lru — by last use, fifo — by creation time).
+    Returns the number of deleted rows.
+    """
+    db = _conn()
+    deleted = 0
+
+    max_age = settings.translation_cache_db_max_age
+    if max_age > 0:
+        cursor = await db.execute(PRUNE_TRANSLATIONS_BY_AGE_SQL, (time.time() - max_age,))
+        deleted += cursor.rowcount
+
+    max_rows = settings.translation_cache_db_max_rows
+    if max_rows > 0:
+        order_column = (
+            "last_used_at" if settings.translation_cache_policy == "lru" else "created_at"
+        )
+        cursor = await db.execute(
+            PRUNE_TRANSLATIONS_BY_SIZE_SQL.format(order_column=order_column),
+            (max_rows,),
         )
-        await db.commit()
\ No newline at end of file
+        deleted += cursor.rowcount
+
+    if deleted:
+        logger.info("Pruned %s rows from translation_cache", deleted)
+    return deleted
+
+
+@dataclass
+class VoiceResult:
+    transcript: str
+    language: Optional[str]
+    avg_logprob: float
+    no_speech_prob: float
+
+
+@metrics.timed("db_get_voice_result")
+async def get_voice_result(file_unique_id: str, forced_lang: Optional[str]) -> Optional[VoiceResult]:
+    """Stored transcript of the file for the pass (forced_lang None — auto-detect), or None."""
+    now = time.time()
+    max_age = settings.voice_cache_max_age
+    min_created_at = now - max_age if max_age > 0 else 0
+
+    async with _conn().execute(
+        TOUCH_VOICE_SQL, (now, file_unique_id, forced_lang or "", min_created_at)
+    ) as cursor:
+        row = await cursor.fetchone()
+
+    if row is None:
+        return None
+    return VoiceResult(transcript=row[0], language=row[1], avg_logprob=row[2], no_speech_prob=row[3])
+
+
+@metrics.timed("db_put_voice_result")
+async def put_voice_result(
+    file_unique_id: str,
+    forced_lang: Optional[str],
+    result: VoiceResult,
+) -> None:
+    """Insert or refresh the transcript of a file for the pass."""
+    now = time.time()
+    await _conn().execute(
+        PUT_VOICE_SQL,
+        (
+            file_unique_id,
+            forced_lang or "",
+            result.transcript,
+            result.language,
+            result.avg_logprob,
+            result.no_speech_prob,
+            now,
+            now,
+        ),
+    )
+
+
+async def prune_voice_cache() -> int:
+    """Evict expired rows and the least recently used ones above the size limit."""
+    db = _conn()
+    deleted = 0
+
+    max_age = settings.voice_cache_max_age
+    if max_age > 0:
+        cursor = await db.execute(PRUNE_VOICE_BY_AGE_SQL, (time.time() - max_age,))
+        deleted += cursor.rowcount
+
+    max_rows = settings.voice_cache_max_rows
+    if max_rows > 0:
+        cursor = await db.execute(PRUNE_VOICE_BY_SIZE_SQL, (max_rows,))
+        deleted += cursor.rowcount
+
+    if deleted:
+        logger.info("Pruned %s rows from voice_cache", deleted)
+    return deleted
+
+
+@dataclass
+class Job:
+    id: int
+    stage: str
+    payload: Dict[str, Any]
+    attempts: int
+    created_at: float
+
+
+@metrics.timed("db_enqueue_job")
+async def enqueue_job(stage: str, payload: Dict[str, Any], delay: float = 0.0) -> int:
+    """Persist a job for the given pipeline stage and return its id."""
+    now = time.time()
+    cursor = await _conn().execute(
+        ENQUEUE_JOB_SQL,
+        (stage, json.dumps(payload, ensure_ascii=False), now + delay, now),
+    )
+    return cursor.lastrowid
+
+
+@metrics.timed("db_lease_job")
+async def lease_job(stage: str, lease_seconds: float) -> Optional[Job]:
+    """Take the oldest available job of the stage for lease_seconds, or None."""
+    now = time.time()
+    async with _conn().execute(
+        LEASE_JOB_SQL, (now + lease_seconds, stage, now, now)
+    ) as cursor:
+        row = await cursor.fetchone()
+
+    if row is None:
+        return None
+    return Job(
+        id=row[0],
+        stage=stage,
+        payload=json.loads(row[1]),
+        attempts=row[2],
+        created_at=row[3],
+    )
+
+
+@metrics.timed("db_ack_job")
+async def ack_job(job_id: int) -> None:
+    """Mark the job as done (it is removed from the table)."""
+    await _conn().execute(ACK_JOB_SQL, (job_id,))
+
+
+async def retry_job(job_id: int, error: str, delay: float) -> None:
+    """Return a leased job to the queue after `delay` seconds."""
+    await _conn().execute(RETRY_JOB_SQL, (time.time() + delay, error[:1000], job_id))
+
+
+async def renew_job_lease(job: Job, lease_seconds: float) -> bool:
+    """Extend the lease of a job we hold; False if the lease was lost (taken by another worker)."""
+    cursor = await _conn().execute(
+        RENEW_JOB_LEASE_SQL, (time.time() + lease_seconds, job.id, job.attempts)
+    )
+    return cursor.rowcount > 0
+
+
+async def save_job_payload(job_id: int, payload: Dict[str, Any]) -> None:
+    """Persist the progress a stage wrote into its payload (seen by a retry of the job)."""
+    await _conn().execute(SAVE_JOB_PAYLOAD_SQL, (json.dumps(payload, ensure_ascii=False), job_id))
+
+
+async def prune_failed_jobs() -> int:
+    """Delete failed jobs older than settings.job_failed_max_age seconds."""
+    max_age = settings.job_failed_max_age
+    if max_age <= 0:
+        return 0
+    cursor = await _conn().execute(PRUNE_FAILED_JOBS_SQL, (time.time() - max_age,))
+    if cursor.rowcount:
+        logger.info("Pruned %s failed jobs", cursor.rowcount)
+    return cursor.rowcount
+
+
+async def give_up_job(job_id: int, error: str) -> None:
+    """Keep the job as failed for inspection; it is not retried anymore."""
+    await _conn().execute(GIVE_UP_JOB_SQL, (error[:1000], job_id))
+
+
+async def job_queue_depths() -> Dict[str, int]:
+    """Number of pending + leased jobs per stage."""
+    async with _conn().execute(JOB_DEPTHS_SQL) as cursor:
+        rows = await cursor.fetchall()
+    return {stage: count for stage, count in rows}
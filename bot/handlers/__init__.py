@@ -1,3 +1,3 @@
-from . import start, translation  # noqa: F401
+from . import admin, start, translation  # noqa: F401
 
-__all__ = ["start", "translation"]
\ No newline at end of file
+__all__ = ["admin", "start", "translation"]
\ No newline at end of file
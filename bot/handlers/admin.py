@@ -0,0 +1,59 @@
+import html
+import logging
+
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile, Message
+
+from bot.config import settings
+from bot.services import diagnostics, metrics, outbox
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_SECONDS = 10.0
+
+
+@router.message(Command("profile"), F.from_user.id.in_(set(settings.admin_ids)))
+async def cmd_profile(message: Message, command: CommandObject):
+    """
+    /profile [секунды] — сэмплирующий профиль живого процесса (только ADMIN_IDS).
+    Присылает файл collapsed-стеков для flamegraph.pl / speedscope и топ функций.
+    """
+    try:
+        seconds = float(command.args) if command.args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        await outbox.answer(message, "Usage: /profile [seconds]")
+        return
+
+    if diagnostics.profiler.running:
+        await outbox.answer(message, "⏳ Profile is already running.")
+        return
+
+    await outbox.answer(
+        message,
+        f"🔬 Profiling for {min(seconds, settings.profile_max_seconds):.0f}s… "
+        f"(updates in flight: {metrics.gauges.get('updates_in_flight', 0):.0f}, "
+        f"loop stalls so far: {metrics.counters.get('loop_blocked', 0)})",
+    )
+    try:
+        path, samples, top = await diagnostics.run_profile(seconds)
+    except Exception as e:
+        logger.exception("Profile failed: %s", e)
+        await outbox.answer(message, f"❌ Profile failed: {html.escape(str(e))}")
+        return
+
+    logger.info("Profile written to %s (%s samples)", path, samples)
+    # Подпись к файлу — не длиннее 1024 символов, обрезаем по строкам, чтобы не сломать <pre>
+    caption = f"{samples} samples, top frames of the event loop thread:\n"
+    lines = []
+    for frame, count in top:
+        line = f"{count / max(samples, 1):6.1%}  {html.escape(frame)}"
+        if len(caption) + len("<pre></pre>") + sum(len(x) + 1 for x in lines) + len(line) > 1024:
+            break
+        lines.append(line)
+    caption += "<pre>" + "\n".join(lines) + "</pre>"
+    await outbox.send(
+        message.chat.id,
+        lambda: message.answer_document(FSInputFile(path), caption=caption),
+    )
@@ -0,0 +1,136 @@
+"""
+Этапы конвейера для очереди задач (settings.job_queue_enabled):
+transcribe → translate → send. Каждый этап берёт payload задачи и возвращает
+следующую задачу; ответы пользователю отправляются только на этапе send.
+"""
+from functools import partial
+from typing import Any, Dict
+
+from aiogram import Bot
+
+from bot.config import settings
+from bot.handlers.translation import (
+    NO_SPEECH_TEXT,
+    TEXT_ERROR_TEXT,
+    TRANSCRIBE_ERROR_TEXT,
+    VOICE_ERROR_TEXT,
+    choose_direction,
+    is_ambiguous,
+    translate_message_text,
+    voice_reply_text,
+)
+from bot.services import metrics, outbox
+from bot.services.chunking import split_message
+from bot.services.hedging import set_audio_deadline
+from bot.services.job_queue import NextJob, job_queue
+from bot.services.lang_detect import detect_language_ex
+from bot.services.rate_limit import current_user_id
+from bot.services.translation_service import translate_speculative
+from bot.services.voice_service import (
+    AudioRef,
+    is_long_audio,
+    join_transcripts,
+    recognize_long_voice,
+    recognize_voice,
+)
+
+
+def _send_job(payload: Dict[str, Any], text: str) -> NextJob:
+    return "send", {"chat_id": payload["chat_id"], "text": text, "trace_id": payload.get("trace_id")}
+
+
+async def transcribe_stage(bot: Bot, payload: Dict[str, Any]) -> NextJob:
+    current_user_id.set(payload["user_id"])
+    lang_from, lang_to = payload["lang_from"], payload["lang_to"]
+    audio = AudioRef(
+        file_id=payload["file_id"],
+        file_unique_id=payload["file_unique_id"],
+        mime_type=payload.get("mime_type"),
+        file_name=payload.get("file_name"),
+        duration=payload.get("duration"),
+    )
+    set_audio_deadline(audio.duration)
+    if is_long_audio(audio):
+        # В очереди длинная запись целиком проходит этап transcribe, частичных ответов нет
+        transcript = join_transcripts(
+            [t async for t in recognize_long_voice(bot, audio, lang_from, lang_to)]
+        )
+    else:
+        transcript = await recognize_voice(bot, audio, lang_from, lang_to)
+
+    text = transcript.text
+    if not text.strip():
+        metrics.inc("voice_no_speech")
+        return _send_job(payload, NO_SPEECH_TEXT)
+
+    detection = detect_language_ex(text)
+    src_lang, dst_lang = choose_direction(
+        detection.lang or transcript.language, lang_from, lang_to, text, stats=detection.stats
+    )
+    return "translate", {
+        "trace_id": payload.get("trace_id"),
+        "kind": "voice",
+        "chat_id": payload["chat_id"],
+        "user_id": payload["user_id"],
+        "text": text,
+        "src": src_lang,
+        "dst": dst_lang,
+        "lang_from": lang_from,
+        "lang_to": lang_to,
+        "speculative": is_ambiguous(detection, text, lang_from, lang_to, transcript.language),
+    }
+
+
+async def translate_stage(bot: Bot, payload: Dict[str, Any]) -> NextJob:
+    current_user_id.set(payload["user_id"])
+    dst_lang = payload["dst"]
+    # У задач, поставленных до появления lang_from/lang_to в payload, пары нет
+    if payload.get("speculative") and "lang_from" in payload:
+        translation, _, dst_lang = await translate_speculative(
+            payload["text"],
+            payload["lang_from"],
+            payload["lang_to"],
+            guess=(payload["src"], payload["dst"]),
+        )
+    else:
+        translation = await translate_message_text(payload["text"], payload["src"], payload["dst"])
+    if payload["kind"] == "voice":
+        translation = voice_reply_text(translation, dst_lang)
+    return _send_job(payload, translation)
+
+
+async def send_stage(bot: Bot, payload: Dict[str, Any]) -> NextJob:
+    # Повтор после сбоя не отправляет заново уже доставленные части
+    sent = payload.get("sent_parts", 0)
+    with metrics.timed("telegram_send"):
+        parts = split_message(payload["text"]) or [payload["text"]]
+        for i, part in enumerate(parts[sent:], start=sent):
+            await outbox.send_message(bot, payload["chat_id"], part)
+            payload["sent_parts"] = i + 1
+            await job_queue.checkpoint(payload)
+    return None
+
+
+async def _report_failure(text: str, payload: Dict[str, Any], error: Exception) -> None:
+    await job_queue.enqueue(*_send_job(payload, text))
+
+
+async def _report_translate_failure(payload: Dict[str, Any], error: Exception) -> None:
+    text = VOICE_ERROR_TEXT if payload.get("kind") == "voice" else TEXT_ERROR_TEXT
+    await job_queue.enqueue(*_send_job(payload, text))
+
+
+def register_job_stages(bot: Bot) -> None:
+    job_queue.register(
+        "transcribe",
+        partial(transcribe_stage, bot),
+        settings.job_transcribe_concurrency,
+        on_give_up=partial(_report_failure, TRANSCRIBE_ERROR_TEXT),
+    )
+    job_queue.register(
+        "translate",
+        partial(translate_stage, bot),
+        settings.job_translate_concurrency,
+        on_give_up=_report_translate_failure,
+    )
+    job_queue.register("send", partial(send_stage, bot), settings.job_send_concurrency)
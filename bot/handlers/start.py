@@ -5,9 +5,9 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from bot.db.storage import (
     set_lang_from,
-    set_lang_to,
-    get_user_languages,
+    set_language_pair,
 )
+from bot.services import outbox
 
 router = Router()
 
@@ -49,7 +49,8 @@ async def _ask_target_language(message: Message, with_greeting: bool = True):
     else:
         prefix = ""
 
-    await message.answer(
+    await outbox.answer(
+        message,
         prefix + "Выбери язык, на который переводить сообщения:",
         reply_markup=build_target_lang_keyboard(),
     )
@@ -84,16 +85,16 @@ async def on_target_language(callback: CallbackQuery):
     user_id = callback.from_user.id
     lang_to_code = callback.data.split(":", maxsplit=1)[1]
 
-    # Сохраняем пару RU -> lang_to_code
-    await set_lang_from(user_id, lang_from=NATIVE_LANG)
-    await set_lang_to(user_id, lang_to=lang_to_code)
-
-    lang_from_code, _ = await get_user_languages(user_id)
+    # Сохраняем пару RU -> lang_to_code одним запросом
+    lang_from_code, _ = await set_language_pair(
+        user_id, lang_from=NATIVE_LANG, lang_to=lang_to_code
+    )
     from_meta = LANGS[lang_from_code]
     to_meta = LANGS[lang_to_code]
     display_code = DISPLAY_CODES[lang_to_code]
 
-    await callback.message.edit_text(
+    await outbox.edit_text(
+        callback.message,
         "Язык перевода настроен ✅\n\n"
         f"{from_meta['flag']} Русский (RU) 🔁 "
         f"{to_meta['flag']} {to_meta['label']} ({display_code})\n\n"
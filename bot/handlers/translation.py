@@ -1,39 +1,51 @@
 import logging
-import tempfile
-from pathlib import Path
+import time
 from typing import Optional, Tuple
 
 from aiogram import Router, F
 from aiogram.types import Message
 
+from bot.config import settings
 from bot.db.storage import get_user_languages
-from bot.services.lang_detect import detect_language
-from bot.services.translation_service import translate_text, AppLang
-from bot.services.voice_service import transcribe_audio
+from bot.services import fast_path, metrics, outbox
+from bot.services.audio_pool import AudioQueueFull
+from bot.services.chunking import TELEGRAM_MESSAGE_LIMIT, split_message
+from bot.services.hedging import DeadlineExceeded, set_audio_deadline
+from bot.services.job_queue import job_queue
+from bot.services.lang_detect import (
+    Detection,
+    TextStats,
+    analyze_text,
+    detect_language,
+    detect_language_ex,
+)
+from bot.services.rate_limit import SchedulerBusy, current_user_id
+from bot.services.translation_service import (
+    AppLang,
+    finalize_stream,
+    translate_chunked,
+    translate_long_text,
+    translate_speculative,
+    translate_text,
+    translate_text_stream,
+)
+from bot.services.voice_service import (
+    AudioDownloadError,
+    is_long_audio,
+    recognize_long_voice,
+    recognize_voice,
+)
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 
-def _looks_latin(text: str) -> bool:
-    """Грубая эвристика: текст похож на латиницу (английский)."""
-    letters = [ch for ch in text if ch.isalpha()]
-    if not letters:
-        return False
-    latin = sum("a" <= ch.lower() <= "z" for ch in letters)
-    return latin / len(letters) > 0.6
-
-
-def _has_cyrillic(text: str) -> bool:
-    """Проверяем, есть ли кириллица (русский)."""
-    return any("а" <= ch.lower() <= "я" or ch in "ёЁ" for ch in text)
-
-
 def choose_direction(
     detected: Optional[str],
     lang_from: AppLang,
     lang_to: AppLang,
     text: str,
+    stats: Optional[TextStats] = None,
 ) -> Tuple[AppLang, AppLang]:
     """
     Упрощённая логика для русского бота:
@@ -47,19 +59,24 @@ def choose_direction(
         * если текст похож на латиницу и lang_to == EN -> считаем, что это EN и переводим на RU
         * иначе считаем, что это RU и переводим на lang_to
     - Если распознали другой язык -> переводим на RU (как наиболее безопасный вариант)
+
+    stats — статистика алфавитов из detect_language_ex, чтобы не сканировать текст заново.
     """
+    if stats is None:
+        stats = analyze_text(text)
+
     if detected == lang_from:  # RU -> lang_to
         # но если пара RU-VI и в тексте совсем нет кириллицы, то это, скорее всего, VI -> RU
-        if lang_to == "VI" and not _has_cyrillic(text):
+        if lang_to == "VI" and not stats.has_cyrillic:
             return lang_to, lang_from
         return lang_from, lang_to
     if detected == lang_to:  # EN/VI -> RU
         return lang_to, lang_from
     if detected is None:
-        if lang_to == "EN" and _looks_latin(text):
+        if lang_to == "EN" and stats.looks_latin:
             # короткий латинский текст при паре RU-EN — скорее всего английский
             return lang_to, lang_from
-        if lang_to == "VI" and not _has_cyrillic(text):
+        if lang_to == "VI" and not stats.has_cyrillic:
             # при паре RU-VI и отсутствии кириллицы считаем, что это вьетнамский
             return lang_to, lang_from
         # иначе считаем, что это русский
@@ -68,14 +85,48 @@ def choose_direction(
     return detected, lang_from
 
 
+BUSY_TEXT = "⏳ Сейчас слишком много запросов. Попробуй через минуту."
+NO_SPEECH_TEXT = "I could not recognize any speech in this audio."
+NOT_HEARD_TEXT = "Извини, не расслышал. Пожалуйста, перезапиши голосовое — переведу."
+TEXT_ERROR_TEXT = "❌ Error while translating text. Please try again later."
+VOICE_ERROR_TEXT = "❌ Ошибка при переводе голосового сообщения. Попробуй ещё раз."
+TRANSCRIBE_ERROR_TEXT = "❌ Error while transcribing your voice message."
+DOWNLOAD_ERROR_TEXT = "❌ Could not download audio file."
+AUDIO_BUSY_TEXT = "⏳ Сейчас много аудио в обработке. Попробуй через минуту."
+TIMEOUT_TEXT = "⌛ Перевод занял слишком много времени. Попробуй ещё раз."
+
+
+def voice_reply_text(translation: str, dst_lang: AppLang) -> str:
+    """
+    На ГС не показывать английский/вьетнамский текстом — только перевод на русский или «не расслышал».
+    Если ответ в «чужом» языке (EN/VI), когда ждали русский — не показываем.
+    Если ждали EN/VI — только при совпадении.
+    """
+    out_lang = detect_language(translation)
+    if dst_lang == "RU":
+        # Ждали русский: показываем, если ответ не EN и не VI (русский или не определили — ок)
+        show_translation = out_lang not in ("EN", "VI")
+    else:
+        # Ждали EN или VI: показываем только если ответ точно в целевом языке
+        show_translation = out_lang == dst_lang
+
+    if not show_translation:
+        metrics.inc("voice_not_heard")
+        return NOT_HEARD_TEXT
+    return translation
+
+
 async def _ensure_lang_pair(message: Message) -> Optional[Tuple[AppLang, AppLang]]:
     user_id = message.from_user.id
+    # Для честной очереди запросов к OpenAI
+    current_user_id.set(user_id)
     lang_pair = await get_user_languages(user_id)
 
     if not lang_pair or not lang_pair[0] or not lang_pair[1]:
-        await message.answer(
+        await outbox.answer(
+            message,
             "Language pair is not configured yet.\n"
-            "Please send /start and select two languages first."
+            "Please send /start and select two languages first.",
         )
         return None
 
@@ -83,6 +134,155 @@ async def _ensure_lang_pair(message: Message) -> Optional[Tuple[AppLang, AppLang
     return lang_from, lang_to  # type: ignore[return-value]
 
 
+def _lookup_phrase(text: str, src_lang: AppLang, dst_lang: AppLang) -> Optional[str]:
+    """Частая фраза из локальной таблицы (без запроса к модели) или None."""
+    if not settings.fast_path_enabled:
+        return None
+    phrase = fast_path.lookup_phrase(text, src_lang, dst_lang)
+    fast_path.record("phrase" if phrase is not None else None)
+    return phrase
+
+
+async def _answer_text(message: Message, text: str, **kwargs) -> None:
+    """Ответ, разбитый на сообщения не длиннее лимита Telegram (4096 символов)."""
+    with metrics.timed("telegram_send"):
+        for part in split_message(text) or [text]:
+            await outbox.answer(message, part, **kwargs)
+
+
+def is_ambiguous(
+    detection: Detection,
+    text: str,
+    lang_from: AppLang,
+    lang_to: AppLang,
+    hint: Optional[str] = None,
+) -> bool:
+    """
+    Направление перевода под вопросом: детектор не уверен или видит язык вне пары.
+    hint — язык от Whisper; если он из пары и детектор ему не противоречит, сомнений нет.
+    """
+    if not settings.speculative_enabled or len(text) > settings.speculative_max_chars:
+        return False
+    if lang_from == lang_to:
+        return False
+    if hint in (lang_from, lang_to) and detection.lang in (None, hint):
+        return False
+    return (
+        detection.lang not in (lang_from, lang_to)
+        or detection.confidence < settings.speculative_confidence
+    )
+
+
+async def translate_message_text(text: str, src_lang: AppLang, dst_lang: AppLang) -> str:
+    """Короткий текст — одним запросом, длинный — кусками параллельно."""
+    if len(text) > settings.chunk_threshold:
+        return await translate_long_text(text, source_lang=src_lang, target_lang=dst_lang)
+    return await translate_text(text, source_lang=src_lang, target_lang=dst_lang)
+
+
+async def _translate_transcript(
+    text: str,
+    detection: Detection,
+    lang_from: AppLang,
+    lang_to: AppLang,
+    hint: Optional[str] = None,
+) -> Tuple[str, AppLang]:
+    """
+    Перевод распознанной речи: фраза из таблицы, оба направления сразу, если язык
+    под вопросом, иначе по choose_direction. Возвращает (перевод, целевой язык).
+    """
+    src_lang, dst_lang = choose_direction(
+        detection.lang or hint, lang_from, lang_to, text, stats=detection.stats
+    )
+    phrase = _lookup_phrase(text, src_lang, dst_lang)
+    if phrase is not None:
+        return phrase, dst_lang
+    if is_ambiguous(detection, text, lang_from, lang_to, hint):
+        translation, _, dst_lang = await translate_speculative(
+            text, lang_from, lang_to, guess=(src_lang, dst_lang)
+        )
+        return translation, dst_lang
+    return await translate_message_text(text, src_lang, dst_lang), dst_lang
+
+
+async def _answer_chunked(
+    message: Message,
+    text: str,
+    src_lang: AppLang,
+    dst_lang: AppLang,
+) -> None:
+    """
+    Длинный текст: куски переводятся параллельно, готовое начало отправляем сразу,
+    не дожидаясь остальных.
+    """
+    started = time.monotonic()
+    sent_any = False
+    async for part in translate_chunked(text, source_lang=src_lang, target_lang=dst_lang):
+        if not part.strip():
+            continue
+        await _answer_text(message, part)
+        if not sent_any:
+            sent_any = True
+            metrics.observe("translation_time_to_first_text_seconds", time.monotonic() - started)
+    metrics.observe("translation_total_seconds", time.monotonic() - started)
+
+
+async def _answer_streaming(
+    message: Message,
+    text: str,
+    src_lang: AppLang,
+    dst_lang: AppLang,
+) -> None:
+    """
+    Потоковый ответ: плейсхолдер, затем edit_text по мере генерации.
+    Правки склеиваются — не чаще settings.stream_edit_interval секунд, а в очереди
+    outbox остаётся только последняя.
+    Текст отправляем без parse_mode: недописанный кусок может оборвать HTML-тег.
+    """
+    started = time.monotonic()
+    placeholder = await outbox.answer(message, "…", parse_mode=None)
+
+    parts = []
+    shown = ""
+    next_edit_at = 0.0
+    try:
+        async for delta in translate_text_stream(text, source_lang=src_lang, target_lang=dst_lang):
+            parts.append(delta)
+            now = time.monotonic()
+            if now < next_edit_at:
+                continue
+
+            current = "".join(parts).strip()
+            # Длиннее одного сообщения промежуточно не показываем — финал разобьём на части
+            if not current or current == shown or len(current) + 2 > TELEGRAM_MESSAGE_LIMIT:
+                continue
+            # Не ждём отправки: outbox заменит устаревшую правку, если чат занят
+            outbox.edit_text_later(placeholder, current + " …", parse_mode=None)
+
+            if not shown:
+                metrics.observe("translation_time_to_first_text_seconds", now - started)
+            shown = current
+            next_edit_at = now + settings.stream_edit_interval
+
+        final = await finalize_stream(
+            text, "".join(parts), source_lang=src_lang, target_lang=dst_lang
+        )
+    except Exception as e:
+        logger.exception("Streaming translation error: %s", e)
+        metrics.inc(metrics.labeled("handler_errors", stage="stream"))
+        await outbox.edit_text(placeholder, TEXT_ERROR_TEXT)
+        return
+
+    if not shown:
+        metrics.observe("translation_time_to_first_text_seconds", time.monotonic() - started)
+    parts = split_message(final) or ["…"]
+    with metrics.timed("telegram_send"):
+        await outbox.edit_text(placeholder, parts[0], parse_mode=None)
+        for part in parts[1:]:
+            await outbox.answer(message, part, parse_mode=None)
+    metrics.observe("translation_total_seconds", time.monotonic() - started)
+
+
 @router.message(F.text & ~F.via_bot)
 async def handle_text(message: Message):
     """
@@ -95,32 +295,152 @@ async def handle_text(message: Message):
     lang_from, lang_to = lang_pair
     text = message.text.strip()
 
-    detected = detect_language(text)
+    if settings.fast_path_enabled:
+        kind = fast_path.untranslatable_kind(text)
+        if kind is not None:
+            # Переводить нечего: эмодзи/числа/ссылки возвращаем как есть, команды пропускаем
+            fast_path.record(kind)
+            if kind != "command" and settings.fast_path_echo:
+                await outbox.answer(message, text, parse_mode=None)
+            return
+
+    detection = detect_language_ex(text)
+    detected = detection.lang
     logger.info(
-        "Text message from %s, detected_lang=%s, pair=(%s,%s)",
+        "Text message from %s, detected_lang=%s (%.2f), pair=(%s,%s)",
         message.from_user.id,
         detected,
+        detection.confidence,
         lang_from,
         lang_to,
     )
 
-    src_lang, dst_lang = choose_direction(detected, lang_from, lang_to, text)
+    src_lang, dst_lang = choose_direction(
+        detected, lang_from, lang_to, text, stats=detection.stats
+    )
+    phrase = _lookup_phrase(text, src_lang, dst_lang)
+    if phrase is not None:
+        await _answer_text(message, phrase)
+        return
+    speculative = is_ambiguous(detection, text, lang_from, lang_to)
+
+    if settings.job_queue_enabled:
+        await job_queue.enqueue(
+            "translate",
+            {
+                "kind": "text",
+                "chat_id": message.chat.id,
+                "user_id": message.from_user.id,
+                "text": text,
+                "src": src_lang,
+                "dst": dst_lang,
+                "lang_from": lang_from,
+                "lang_to": lang_to,
+                "speculative": speculative,
+            },
+        )
+        return
+
+    started = time.monotonic()
     try:
-        translation = await translate_text(text, source_lang=src_lang, target_lang=dst_lang)
+        if speculative:
+            # Направление не ясно — оба направления параллельно вместо догадки и повтора
+            translation, _, _ = await translate_speculative(
+                text, lang_from, lang_to, guess=(src_lang, dst_lang)
+            )
+        elif len(text) > settings.chunk_threshold:
+            await _answer_chunked(message, text, src_lang, dst_lang)
+            return
+        elif settings.translation_stream and len(text) >= settings.stream_min_chars:
+            await _answer_streaming(message, text, src_lang, dst_lang)
+            return
+        else:
+            translation = await translate_text(text, source_lang=src_lang, target_lang=dst_lang)
+    except SchedulerBusy:
+        metrics.inc("handler_busy")
+        await outbox.answer(message, BUSY_TEXT)
+        return
+    except DeadlineExceeded:
+        logger.warning("Translation deadline exceeded for %s", message.from_user.id)
+        await outbox.answer(message, TIMEOUT_TEXT)
+        return
     except Exception as e:
         logger.exception("Translation error: %s", e)
-        await message.answer("❌ Error while translating text. Please try again later.")
+        metrics.inc(metrics.labeled("handler_errors", stage="translate_text"))
+        await outbox.answer(message, TEXT_ERROR_TEXT)
         return
 
     # Только перевод, без дополнительных фраз
-    await message.answer(translation)
+    await _answer_text(message, translation)
+    elapsed = time.monotonic() - started
+    metrics.observe("translation_time_to_first_text_seconds", elapsed)
+    metrics.observe("translation_total_seconds", elapsed)
+
+
+async def _answer_long_voice(
+    message: Message,
+    audio,
+    lang_from: AppLang,
+    lang_to: AppLang,
+) -> None:
+    """
+    Длинная запись: куски распознаются параллельно, а каждый готовый (по порядку)
+    сразу переводим и отправляем — начало перевода приходит, пока хвост ещё
+    распознаётся. Неразборчивые куски пропускаем, «не расслышал» — только если
+    не получилось ни одного.
+    """
+    heard_any = False
+    sent_any = False
+    try:
+        async for transcript in recognize_long_voice(message.bot, audio, lang_from, lang_to):
+            text = transcript.text
+            if not text.strip():
+                continue
+            heard_any = True
+
+            translation, dst_lang = await _translate_transcript(
+                text, detect_language_ex(text), lang_from, lang_to, hint=transcript.language
+            )
+            reply = voice_reply_text(translation, dst_lang)
+            if reply == NOT_HEARD_TEXT:
+                continue
+            await _answer_text(message, reply)
+            sent_any = True
+    except AudioDownloadError as e:
+        logger.exception("Failed to download audio: %s", e)
+        metrics.inc(metrics.labeled("handler_errors", stage="download"))
+        await outbox.answer(message, DOWNLOAD_ERROR_TEXT)
+        return
+    except AudioQueueFull:
+        logger.warning("Audio queue is full, rejecting audio from %s", message.from_user.id)
+        await outbox.answer(message, AUDIO_BUSY_TEXT)
+        return
+    except SchedulerBusy:
+        metrics.inc("handler_busy")
+        await outbox.answer(message, BUSY_TEXT)
+        return
+    except DeadlineExceeded:
+        logger.warning("Long audio deadline exceeded for %s", message.from_user.id)
+        await outbox.answer(message, TIMEOUT_TEXT)
+        return
+    except Exception as e:
+        logger.exception("Long audio error: %s", e)
+        metrics.inc(metrics.labeled("handler_errors", stage="long_audio"))
+        await outbox.answer(message, VOICE_ERROR_TEXT)
+        return
+
+    if not heard_any:
+        metrics.inc("voice_no_speech")
+        await outbox.answer(message, NO_SPEECH_TEXT)
+    elif not sent_any:
+        await outbox.answer(message, NOT_HEARD_TEXT)
 
 
 @router.message(F.voice | F.audio)
 async def handle_voice(message: Message):
     """
     Handle voice messages:
-    1. Download file
+    1. Download file into memory
     2. Transcribe with Whisper
     3. Auto-detect language and translate
     """
@@ -130,48 +450,69 @@ async def handle_voice(message: Message):
 
     lang_from, lang_to = lang_pair
 
-    tmp_dir = Path(tempfile.gettempdir())
-    file_name = f"tg_{message.from_user.id}_{message.message_id}.ogg"
-    local_path = tmp_dir / file_name
+    audio = message.voice or message.audio
+    if audio is None:
+        await outbox.answer(message, "Unsupported audio type.")
+        return
 
-    try:
-        if message.voice:
-            await message.bot.download(message.voice, destination=local_path)
-        elif message.audio:
-            await message.bot.download(message.audio, destination=local_path)
-        else:
-            await message.answer("Unsupported audio type.")
-            return
-    except Exception as e:
-        logger.exception("Failed to download audio: %s", e)
-        await message.answer("❌ Could not download audio file.")
+    if settings.job_queue_enabled:
+        await job_queue.enqueue(
+            "transcribe",
+            {
+                "chat_id": message.chat.id,
+                "user_id": message.from_user.id,
+                "file_id": audio.file_id,
+                "file_unique_id": audio.file_unique_id,
+                "mime_type": audio.mime_type,
+                "file_name": getattr(audio, "file_name", None),
+                "duration": audio.duration,
+                "lang_from": lang_from,
+                "lang_to": lang_to,
+            },
+        )
+        return
+
+    set_audio_deadline(audio.duration)
+
+    if is_long_audio(audio):
+        await _answer_long_voice(message, audio, lang_from, lang_to)
         return
 
     try:
-        text = await transcribe_audio(local_path)
-        detected = detect_language(text)
-        # Если распознанный язык не из пары — пробуем ещё раз с подсказкой «русский» (часто помогает)
-        if detected not in (lang_from, lang_to) and text.strip():
-            text2 = await transcribe_audio(local_path, forced_lang=lang_from)
-            if text2 and text2.strip():
-                text = text2
-                detected = detect_language(text)
-                logger.info("Voice retry with forced_lang=%s, new detected=%s", lang_from, detected)
+        # Скачиваем в память; проход с подсказкой «русский» (lang_from) — только если первый неудачен
+        transcript = await recognize_voice(message.bot, audio, lang_from, lang_to)
+    except AudioDownloadError as e:
+        logger.exception("Failed to download audio: %s", e)
+        metrics.inc(metrics.labeled("handler_errors", stage="download"))
+        await outbox.answer(message, DOWNLOAD_ERROR_TEXT)
+        return
+    except AudioQueueFull:
+        logger.warning("Audio queue is full, rejecting voice from %s", message.from_user.id)
+        await outbox.answer(message, AUDIO_BUSY_TEXT)
+        return
+    except SchedulerBusy:
+        metrics.inc("handler_busy")
+        await outbox.answer(message, BUSY_TEXT)
+        return
+    except DeadlineExceeded:
+        logger.warning("Transcription deadline exceeded for %s", message.from_user.id)
+        await outbox.answer(message, TIMEOUT_TEXT)
+        return
     except Exception as e:
         logger.exception("Failed to transcribe audio: %s", e)
-        await message.answer("❌ Error while transcribing your voice message.")
+        metrics.inc(metrics.labeled("handler_errors", stage="transcribe"))
+        await outbox.answer(message, TRANSCRIBE_ERROR_TEXT)
         return
-    finally:
-        try:
-            if local_path.exists():
-                local_path.unlink()
-        except OSError:
-            pass
 
+    text = transcript.text
     if not text.strip():
-        await message.answer("I could not recognize any speech in this audio.")
+        metrics.inc("voice_no_speech")
+        await outbox.answer(message, NO_SPEECH_TEXT)
         return
 
+    detection = detect_language_ex(text)
+    # Локальный детектор не уверен — берём язык, который определил Whisper
+    detected = detection.lang or transcript.language
     logger.info(
         "Voice message from %s, detected_lang=%s, pair=(%s,%s), text='%s'",
         message.from_user.id,
@@ -181,29 +522,22 @@ async def handle_voice(message: Message):
         text[:100],
     )
 
-    src_lang, dst_lang = choose_direction(detected, lang_from, lang_to, text)
     try:
-        translation = await translate_text(text, source_lang=src_lang, target_lang=dst_lang)
+        translation, dst_lang = await _translate_transcript(
+            text, detection, lang_from, lang_to, hint=transcript.language
+        )
+    except SchedulerBusy:
+        metrics.inc("handler_busy")
+        await outbox.answer(message, BUSY_TEXT)
+        return
+    except DeadlineExceeded:
+        logger.warning("Voice translation deadline exceeded for %s", message.from_user.id)
+        await outbox.answer(message, TIMEOUT_TEXT)
+        return
     except Exception as e:
         logger.exception("Translation error (voice): %s", e)
-        await message.answer("❌ Ошибка при переводе голосового сообщения. Попробуй ещё раз.")
-        return
-
-    # На ГС не показывать английский/вьетнамский текстом — только перевод на русский или «не расслышал».
-    # Если ответ в «чужом» языке (EN/VI), когда ждали русский — не показываем. Если ждали EN/VI — только при совпадении.
-    out_lang = detect_language(translation)
-    show_translation = False
-    if dst_lang == "RU":
-        # Ждали русский: показываем, если ответ не EN и не VI (русский или не определили — ок)
-        show_translation = out_lang not in ("EN", "VI")
-    else:
-        # Ждали EN или VI: показываем только если ответ точно в целевом языке
-        show_translation = out_lang == dst_lang
-
-    if not show_translation:
-        await message.answer(
-            "Извини, не расслышал. Пожалуйста, перезапиши голосовое — переведу."
-        )
+        metrics.inc(metrics.labeled("handler_errors", stage="translate_voice"))
+        await outbox.answer(message, VOICE_ERROR_TEXT)
         return
 
-    await message.answer(translation)
\ No newline at end of file
+    await _answer_text(message, voice_reply_text(translation, dst_lang))
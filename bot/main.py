@@ -2,38 +2,103 @@ import asyncio
 import logging
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
 from bot.config import settings
-from bot.db.storage import init_db
-from bot.handlers import start, translation
+from bot.db.storage import close_db, init_db, warm_user_cache
+from bot.handlers import admin, start, translation
+from bot.handlers.jobs import register_job_stages
+from bot.services import diagnostics, fast_path, metrics
+from bot.services.audio_pool import shutdown_audio_pool
+from bot.services.job_queue import job_queue
+from bot.services.outbox import outbox
+from bot.services.tracing import TraceMiddleware, configure_logging
 
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(name)s - %(message)s",
-)
+configure_logging()
 
 logger = logging.getLogger(__name__)
 
+# aiohttp-раннер локального /metrics (settings.metrics_port)
+_metrics_runner = None
 
-async def main():
-    logger.info("Initializing database...")
-    await init_db()
 
-    bot = Bot(
+def create_bot() -> Bot:
+    """Bot instance; TELEGRAM_API_BASE points it at a local Bot API server (or a fake one)."""
+    session = None
+    if settings.telegram_api_base:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_base))
+
+    return Bot(
         token=settings.telegram_bot_token,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
+
+
+async def on_startup(bot: Bot) -> None:
+    global _metrics_runner
+
+    if settings.diagnostics_enabled:
+        diagnostics.start(asyncio.get_running_loop())
+
+    if settings.metrics_port and _metrics_runner is None:
+        _metrics_runner = await metrics.start_http_server(
+            settings.metrics_host, settings.metrics_port
+        )
+
+    if settings.fast_path_enabled:
+        rows = fast_path.load_phrases(settings.phrase_table_path)
+        logger.info("Phrase table loaded: %s rows", rows)
+
+    logger.info("Initializing database...")
+    await init_db()
+    warmed = await warm_user_cache()
+    logger.info("User settings cache warmed with %s users", warmed)
+
+    if settings.job_queue_enabled:
+        # Незавершённые до рестарта задачи подхватятся, когда истечёт их аренда
+        register_job_stages(bot)
+        job_queue.start()
+
+
+async def on_shutdown() -> None:
+    global _metrics_runner
+
+    await job_queue.stop()
+    # Дать уйти уже поставленным в очередь ответам
+    await outbox.drain()
+    shutdown_audio_pool()
+    await close_db()
+    await metrics.stop_http_server(_metrics_runner)
+    _metrics_runner = None
+    await diagnostics.stop()
+
+
+def create_dispatcher() -> Dispatcher:
+    """Dispatcher with all routers and the per-process startup/shutdown hooks."""
     dp = Dispatcher()
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    dp.update.outer_middleware(TraceMiddleware())
 
     dp.include_router(start.router)
+    # До translation: тот принимает любой текст, включая команды
+    dp.include_router(admin.router)
     dp.include_router(translation.router)
+    return dp
+
+
+async def main():
+    bot = create_bot()
+    dp = create_dispatcher()
 
     logger.info("Starting bot polling...")
     await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+CPU-heavy audio operations (pydub + ffmpeg).
+
+Functions here run inside the audio process pool (see audio_pool.py), so they
+must stay module-level, take/return plain bytes and not import bot.config.
+"""
+import io
+from typing import List, Optional, Tuple
+
+from pydub import AudioSegment
+from pydub.silence import detect_silence
+
+
+def transcode_to_mp3(data: bytes, src_format: Optional[str] = None) -> bytes:
+    """Decode audio (any format ffmpeg understands) and re-encode it to MP3."""
+    audio = AudioSegment.from_file(io.BytesIO(data), format=src_format)
+    out = io.BytesIO()
+    audio.export(out, format="mp3")
+    return out.getvalue()
+
+
+def split_on_silence(
+    data: bytes,
+    src_format: Optional[str],
+    max_segment_ms: int,
+    min_silence_ms: int = 500,
+    silence_margin_db: float = 16.0,
+) -> List[bytes]:
+    """
+    Cut long audio into segments of at most max_segment_ms, preferring cuts in
+    the middle of pauses (quieter than the average level by silence_margin_db
+    for at least min_silence_ms). Without a pause in the window the segment is
+    cut at max_segment_ms. Segments that are silent as a whole are dropped.
+    Each segment is returned as mono 16 kHz MP3 — small enough for Whisper.
+    """
+    audio = AudioSegment.from_file(io.BytesIO(data), format=src_format)
+    if len(audio) == 0 or audio.dBFS == float("-inf"):
+        return []
+
+    threshold = audio.dBFS - silence_margin_db
+    pauses = detect_silence(
+        audio, min_silence_len=min_silence_ms, silence_thresh=threshold, seek_step=50
+    )
+    cut_points = [(start + end) // 2 for start, end in pauses]
+
+    bounds: List[Tuple[int, int]] = []
+    start = 0
+    while len(audio) - start > max_segment_ms:
+        limit = start + max_segment_ms
+        candidates = [cut for cut in cut_points if start < cut <= limit]
+        # Режем по паузе, только если кусок выходит не короче четверти окна
+        if candidates and candidates[-1] - start >= max_segment_ms // 4:
+            cut = candidates[-1]
+        else:
+            cut = limit
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, len(audio)))
+
+    segments = []
+    for start, end in bounds:
+        segment = audio[start:end]
+        if segment.dBFS == float("-inf") or segment.dBFS < threshold:
+            continue
+        out = io.BytesIO()
+        segment.set_channels(1).set_frame_rate(16000).export(out, format="mp3", bitrate="48k")
+        segments.append(out.getvalue())
+    return segments
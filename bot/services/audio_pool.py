@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from bot.config import settings
+from bot.services import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AudioQueueFull(RuntimeError):
+    """Too many audio jobs are already queued — reject instead of waiting."""
+
+
+class AudioJobTimeout(RuntimeError):
+    """An audio job did not finish within its timeout."""
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Задачи в пуле: выполняются + ждут свободного процесса
+_pending = 0
+# Номер текущего пула: колбэки задач сломанного пула счётчик уже не трогают
+_generation = 0
+
+
+def _drop_broken_executor(executor: ProcessPoolExecutor) -> None:
+    """Forget a pool whose worker died, so the next job starts a new one."""
+    global _executor, _pending, _generation
+
+    if _executor is not executor:
+        return
+    logger.warning("Audio process pool is broken, restarting it")
+    metrics.inc("audio_pool_restarts")
+    executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _pending = 0
+    _generation += 1
+    metrics.set_gauge("audio_queue_depth", _pending)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+
+    if _executor is None:
+        # spawn: дочерние процессы не наследуют event loop, соединения и клиентов родителя
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.audio_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+async def run_audio_job(
+    func: Callable[..., Any],
+    *args: Any,
+    timeout: Optional[float] = None,
+) -> Any:
+    """
+    Run a CPU-heavy audio function in the process pool without blocking the event loop.
+
+    Raises AudioQueueFull right away if settings.audio_queue_limit jobs are already
+    pending, and AudioJobTimeout if the job takes longer than the timeout.
+    The worker process itself cannot be interrupted, so a timed out job still
+    occupies its worker until ffmpeg finishes; the caller just stops waiting.
+    If a worker died (BrokenProcessPool), the pool is recreated for later jobs.
+    """
+    global _pending
+
+    if _pending >= settings.audio_queue_limit:
+        metrics.inc("audio_jobs_rejected")
+        raise AudioQueueFull(f"audio queue is full ({_pending} jobs pending)")
+
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    executor = _get_executor()
+    try:
+        job = executor.submit(func, *args)
+    except BrokenProcessPool:
+        # Пул сломался раньше, а заметили только сейчас — задача ещё не потеряна
+        _drop_broken_executor(executor)
+        executor = _get_executor()
+        job = executor.submit(func, *args)
+    _pending += 1
+    metrics.set_gauge("audio_queue_depth", _pending)
+    # Задача занимает пул, пока процесс её не закончит, а не пока мы ждём результат:
+    # счётчик уменьшаем по завершении самой задачи (колбэк приходит из потока пула)
+    generation = _generation
+    job.add_done_callback(lambda _: _call_soon(loop, lambda: _job_finished(generation)))
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(job), timeout or settings.audio_job_timeout)
+    except BrokenProcessPool:
+        _drop_broken_executor(executor)
+        raise
+    except asyncio.TimeoutError:
+        metrics.inc("audio_jobs_timeout")
+        raise AudioJobTimeout(f"{func.__name__} timed out") from None
+    finally:
+        metrics.inc("audio_jobs_total")
+        metrics.observe("audio_job_seconds", time.monotonic() - started)
+
+
+def _call_soon(loop: asyncio.AbstractEventLoop, callback: Callable[[], None]) -> None:
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        # Loop уже закрыт (остановка бота) — считать больше нечего
+        pass
+
+
+def _job_finished(generation: int) -> None:
+    global _pending
+
+    if generation != _generation:
+        return
+    _pending -= 1
+    metrics.set_gauge("audio_queue_depth", _pending)
+
+
+def shutdown_audio_pool() -> None:
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bot.services import metrics
+from bot.services.hedging import deadline
+
+logger = logging.getLogger(__name__)
+
+Direction = Tuple[str, str]
+# Результат перевода одного текста: (перевод, прошёл ли проверку языка)
+Result = Tuple[str, bool]
+# Пакетный перевод: список (перевод, заявленный язык) в порядке входа или None, если ответ битый
+BatchTranslate = Callable[[List[str], str, str], Awaitable[Optional[List[Tuple[str, Optional[str]]]]]]
+SingleTranslate = Callable[[str, str, str], Awaitable[Result]]
+Verify = Callable[[str, str, Optional[str]], bool]
+
+
+@dataclass
+class _Item:
+    text: str
+    future: asyncio.Future
+    # Срок апдейта, приславшего текст (time.monotonic()), None — без срока
+    deadline: Optional[float] = None
+
+
+@dataclass
+class _Batch:
+    items: List[_Item] = field(default_factory=list)
+    chars: int = 0
+    started: float = field(default_factory=time.monotonic)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """
+    Collects short translations for up to `window` seconds per direction and
+    sends them as one completion. A batch is flushed early when it reaches
+    `max_items` texts or `max_chars` characters. If the batch answer is malformed
+    every item falls back to its own call; items whose translation fails the
+    language check are re-translated individually.
+
+    The flush runs in a fresh context, not in the one of whichever caller
+    happened to start the batch: the batch call gets the tightest deadline of
+    its members, and every individual call the deadline of its own item.
+    """
+
+    def __init__(
+        self,
+        translate_batch: BatchTranslate,
+        translate_one: SingleTranslate,
+        verify: Verify,
+        window: float,
+        max_items: int,
+        max_chars: int,
+    ):
+        self._translate_batch = translate_batch
+        self._translate_one = translate_one
+        self._verify = verify
+        self.window = window
+        self.max_items = max(1, max_items)
+        self.max_chars = max_chars
+        self._pending: Dict[Direction, _Batch] = {}
+
+    async def submit(self, text: str, source_lang: str, target_lang: str) -> Result:
+        direction = (source_lang, target_lang)
+        batch = self._pending.get(direction)
+        if batch is not None and batch.chars + len(text) > self.max_chars:
+            self._flush(direction)
+            batch = None
+
+        if batch is None:
+            batch = _Batch()
+            self._pending[direction] = batch
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.window, self._flush, direction
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append(_Item(text, future, deadline.get()))
+        batch.chars += len(text)
+        if len(batch.items) >= self.max_items:
+            self._flush(direction)
+
+        return await future
+
+    def _flush(self, direction: Direction) -> None:
+        batch = self._pending.pop(direction, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        # call_later и submit выполняются в контексте чужого апдейта (trace id, срок, user id)
+        contextvars.Context().run(asyncio.create_task, self._run(direction, batch))
+
+    async def _run(self, direction: Direction, batch: _Batch) -> None:
+        source_lang, target_lang = direction
+        # Ожидавшие могли уже уйти (отмена) — их тексты не переводим
+        items = [item for item in batch.items if not item.future.done()]
+        if not items:
+            return
+
+        metrics.observe("translation_batch_size", len(items), metrics.SIZE_BUCKETS)
+        metrics.observe(
+            "translation_batch_fill_ratio", len(items) / self.max_items, metrics.SIZE_BUCKETS
+        )
+
+        try:
+            await self._run_items(items, source_lang, target_lang)
+        finally:
+            metrics.observe("translation_batch_seconds", time.monotonic() - batch.started)
+
+    async def _run_items(self, items: List[_Item], source_lang: str, target_lang: str) -> None:
+        if len(items) == 1:
+            await self._run_single(items[0], source_lang, target_lang)
+            return
+
+        deadlines = [item.deadline for item in items if item.deadline is not None]
+        deadline.set(min(deadlines) if deadlines else None)
+        try:
+            results = await self._translate_batch([i.text for i in items], source_lang, target_lang)
+        except Exception as e:
+            logger.warning("Batch translation failed, falling back to single calls: %s", e)
+            results = None
+
+        if results is None or len(results) != len(items):
+            metrics.inc("translation_batch_fallback")
+            await asyncio.gather(*(self._run_single(i, source_lang, target_lang) for i in items))
+            return
+
+        retries = []
+        for item, (translation, claimed) in zip(items, results):
+            if self._verify(translation, target_lang, claimed):
+                if not item.future.done():
+                    item.future.set_result((translation, True))
+            else:
+                retries.append(item)
+
+        if retries:
+            metrics.inc("translation_batch_item_retry", len(retries))
+            await asyncio.gather(*(self._run_single(i, source_lang, target_lang) for i in retries))
+
+    async def _run_single(self, item: _Item, source_lang: str, target_lang: str) -> None:
+        # gather запускает каждый вызов в своей копии контекста — срок не утекает к соседям
+        deadline.set(item.deadline)
+        try:
+            result = await self._translate_one(item.text, source_lang, target_lang)
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+            return
+        if not item.future.done():
+            item.future.set_result(result)
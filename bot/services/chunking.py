@@ -0,0 +1,66 @@
+import re
+from typing import Iterator, List
+
+# Лимит длины текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_PARAGRAPH_RE = re.compile(r"(\n\s*\n)")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…。])(\s+)")
+_WORD_RE = re.compile(r"(\s+)")
+
+
+def _split_keep(text: str, pattern: "re.Pattern[str]") -> List[str]:
+    """Split on pattern, gluing every separator to the piece before it."""
+    parts = pattern.split(text)
+    pieces = []
+    for i in range(0, len(parts), 2):
+        piece = parts[i] + (parts[i + 1] if i + 1 < len(parts) else "")
+        if piece:
+            pieces.append(piece)
+    return pieces
+
+
+def _pieces(text: str, max_chars: int) -> Iterator[str]:
+    """Pieces of at most max_chars: paragraphs, else sentences, else words, else a hard cut."""
+    for pattern in (_PARAGRAPH_RE, _SENTENCE_RE, _WORD_RE):
+        pieces = _split_keep(text, pattern)
+        if len(pieces) > 1:
+            for piece in pieces:
+                if len(piece) <= max_chars:
+                    yield piece
+                else:
+                    yield from _pieces(piece, max_chars)
+            return
+    for start in range(0, len(text), max_chars):
+        yield text[start:start + max_chars]
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    Разбить текст на куски не длиннее max_chars по границам абзацев, затем
+    предложений, затем слов. Разделители остаются в конце кусков, так что
+    "".join(split_text(text, n)) == text.
+    """
+    if len(text) <= max_chars:
+        return [text] if text else []
+
+    chunks: List[str] = []
+    current = ""
+    for piece in _pieces(text, max_chars):
+        if current and len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def trailing_whitespace(text: str) -> str:
+    return text[len(text.rstrip()):]
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Текст ответа, разбитый на сообщения Telegram (без пустых и без краевых пробелов)."""
+    parts = [part.strip() for part in split_text(text.strip(), limit)]
+    return [part for part in parts if part]
@@ -0,0 +1,202 @@
+"""
+Диагностика живого процесса: сторож задержки event loop (со стеком того, что
+его блокирует), логирование медленных колбэков asyncio и сэмплирующий профайлер
+по запросу (/profile), который пишет стеки в формате collapsed для flamegraph.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from bot.config import settings
+from bot.services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Как часто loop отмечается «живым» и как часто сторож это проверяет
+HEARTBEAT_INTERVAL = 0.1
+# Частота сэмплов профайлера (сек между снимками стеков)
+PROFILE_INTERVAL = 0.005
+
+
+def _format_stack(frame) -> str:
+    return "".join(traceback.format_stack(frame, limit=30))
+
+
+class LoopWatchdog:
+    """
+    A heartbeat task on the loop and a watchdog thread beside it.
+
+    The task measures how late its own wakeups are (loop_lag_seconds). The
+    thread notices when the heartbeat stops for longer than `threshold`, logs
+    the loop thread's current stack (what is blocking it) and, once the loop is
+    back, how long the stall lasted.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + HEARTBEAT_INTERVAL
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            self._last_beat = now
+            metrics.observe("loop_lag_seconds", max(0.0, now - expected))
+            metrics.set_gauge("asyncio_tasks", len(asyncio.all_tasks()))
+
+    def _watch(self) -> None:
+        stalled_since: Optional[float] = None
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            last_beat = self._last_beat
+            lag = time.monotonic() - last_beat - HEARTBEAT_INTERVAL
+            if lag > self.threshold:
+                if stalled_since != last_beat:
+                    # Новый простой: один стек на простой, пока loop не проснётся
+                    stalled_since = last_beat
+                    metrics.inc("loop_blocked")
+                    frame = sys._current_frames().get(self._loop_thread_id)
+                    logger.warning(
+                        "Event loop blocked for %.2fs, loop thread stack:\n%s",
+                        lag,
+                        _format_stack(frame) if frame is not None else "(unavailable)",
+                    )
+            elif stalled_since is not None and last_beat != stalled_since:
+                stall = last_beat - stalled_since - HEARTBEAT_INTERVAL
+                metrics.observe("loop_stall_seconds", stall)
+                logger.warning("Event loop unblocked after %.2fs", stall)
+                stalled_since = None
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Snapshots the stacks of all threads every PROFILE_INTERVAL seconds from a
+    background thread and counts them as collapsed stacks
+    ("thread;outer;...;inner count"), the input format of flamegraph.pl and
+    speedscope.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.running = False
+
+    def sample(self, seconds: float) -> Tuple[Counter, int]:
+        stacks: Counter = Counter()
+        names: Dict[int, str] = {}
+        me = threading.get_ident()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames: List[str] = []
+                while frame is not None:
+                    frames.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(frames))] += 1
+            samples += 1
+            time.sleep(PROFILE_INTERVAL)
+        return stacks, samples
+
+    def run(self, seconds: float, path: str, focus: str) -> Tuple[int, List[Tuple[str, int]]]:
+        """
+        Profile for `seconds` and write collapsed stacks to path. Returns the
+        number of samples and the most frequent leaf frames of the `focus` thread.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("a profile is already running")
+        self.running = True
+        # Иначе поток профайлера получает GIL в основном тогда, когда loop сам его
+        # отпускает (в select), и занятый CPU код в сэмплы почти не попадает
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, PROFILE_INTERVAL / 10))
+        try:
+            stacks, samples = self.sample(seconds)
+        finally:
+            sys.setswitchinterval(switch_interval)
+            self.running = False
+            self._lock.release()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        leaves: Counter = Counter()
+        for stack, count in stacks.items():
+            if stack.split(";", 1)[0] == focus:
+                leaves[stack.rsplit(";", 1)[-1]] += count
+        return samples, leaves.most_common(10)
+
+
+watchdog = LoopWatchdog(settings.loop_lag_threshold)
+profiler = SamplingProfiler()
+
+
+def start(loop: asyncio.AbstractEventLoop) -> None:
+    """Start the watchdog; in ASYNCIO_DEBUG mode also log callbacks slower than the threshold."""
+    if settings.asyncio_debug:
+        # Отладочный режим asyncio сам пишет «Executing <Handle ...> took N seconds»
+        loop.set_debug(True)
+        loop.slow_callback_duration = settings.loop_lag_threshold
+        logging.getLogger("asyncio").setLevel(logging.WARNING)
+    watchdog.start(loop)
+    logger.info("Loop watchdog started (threshold %.2fs)", settings.loop_lag_threshold)
+
+
+async def stop() -> None:
+    await watchdog.stop()
+
+
+async def run_profile(seconds: float) -> Tuple[str, int, List[Tuple[str, int]]]:
+    """
+    Time-boxed profile of the live process (at most settings.profile_max_seconds)
+    in a worker thread. Returns (file path, samples, top leaf frames).
+    """
+    seconds = max(1.0, min(seconds, settings.profile_max_seconds))
+    path = os.path.join(
+        settings.profile_dir, time.strftime("profile-%Y%m%d-%H%M%S.folded")
+    )
+    # Топ считаем по потоку event loop — в остальных обычно ждут пулы
+    focus = threading.current_thread().name
+    samples, top = await asyncio.to_thread(profiler.run, seconds, path, focus)
+    metrics.inc("profiles_taken")
+    return path, samples, top
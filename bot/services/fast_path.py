@@ -0,0 +1,167 @@
+"""
+Локальный быстрый путь перед переводом: сообщения без текста (эмодзи, числа,
+ссылки, команды) и частые короткие фразы обрабатываются без запроса к модели.
+"""
+import json
+import logging
+import re
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bot.services import metrics
+
+logger = logging.getLogger(__name__)
+
+LANG_ORDER = ("RU", "EN", "VI")
+
+# Строки таблицы: (RU, EN, VI). В ячейке через | — варианты: первый отдаём как
+# перевод, остальные только находятся поиском.
+PHRASES: List[Tuple[str, str, str]] = [
+    ("привет|приветик|здравствуй|здравствуйте|здрасте", "hello|hi|hey|hiya", "xin chào|chào"),
+    ("доброе утро", "good morning", "chào buổi sáng"),
+    ("добрый день", "good afternoon", "chào buổi chiều"),
+    ("добрый вечер", "good evening", "chào buổi tối"),
+    ("спокойной ночи", "good night", "chúc ngủ ngon"),
+    ("пока|до свидания|бай", "bye|goodbye|bye bye", "tạm biệt"),
+    ("до завтра", "see you tomorrow", "hẹn gặp lại ngày mai"),
+    ("до встречи|увидимся", "see you|see you later", "hẹn gặp lại"),
+    ("спасибо|спс|благодарю", "thank you|thanks|thx|ty", "cảm ơn|cám ơn|cảm ơn bạn"),
+    ("большое спасибо|спасибо большое", "thank you very much|thanks a lot", "cảm ơn rất nhiều"),
+    ("пожалуйста", "please", "làm ơn"),
+    ("не за что", "you're welcome|you are welcome", "không có gì"),
+    ("да", "yes|yeah|yep", "vâng|có|dạ"),
+    ("нет", "no|nope", "không"),
+    ("ок|окей|хорошо|ладно", "ok|okay|alright|fine", "được|được rồi"),
+    ("конечно", "of course|sure", "tất nhiên|dĩ nhiên"),
+    ("может быть|возможно", "maybe|perhaps", "có thể"),
+    ("извини|извините|простите|прости", "sorry|excuse me", "xin lỗi"),
+    ("как дела", "how are you", "bạn khỏe không"),
+    ("всё хорошо|все хорошо", "all good|everything is fine", "mọi thứ đều ổn"),
+    ("я не понимаю", "i don't understand|i do not understand", "tôi không hiểu"),
+    ("я понимаю|понимаю|понятно", "i understand|got it", "tôi hiểu"),
+    ("сколько стоит|сколько это стоит", "how much|how much is it|how much does it cost", "bao nhiêu tiền|cái này bao nhiêu tiền"),
+    ("где туалет", "where is the toilet|where is the restroom", "nhà vệ sinh ở đâu"),
+    ("помогите", "help", "cứu với|giúp tôi với"),
+    ("подождите|подожди|минутку", "wait|one moment|just a moment", "chờ một chút|đợi một chút"),
+    ("отлично|супер|класс", "great|excellent|awesome", "tuyệt vời"),
+    ("я люблю тебя", "i love you", "anh yêu em|em yêu anh"),
+    ("добро пожаловать", "welcome", "chào mừng"),
+    ("с днём рождения|с днем рождения", "happy birthday", "chúc mừng sinh nhật"),
+    ("с новым годом", "happy new year", "chúc mừng năm mới"),
+    ("приятного аппетита", "enjoy your meal|bon appetit", "chúc ngon miệng"),
+    ("очень вкусно", "very tasty|delicious", "rất ngon"),
+    ("счёт, пожалуйста|счет, пожалуйста", "the bill, please|check, please", "tính tiền|cho tôi hóa đơn"),
+    ("дорого", "expensive|too expensive", "đắt quá"),
+    ("дешевле", "cheaper", "rẻ hơn"),
+    ("меня зовут", "my name is", "tên tôi là"),
+    ("как тебя зовут|как вас зовут", "what is your name|what's your name", "bạn tên là gì"),
+    ("где ты", "where are you", "bạn ở đâu"),
+    ("я здесь", "i am here|i'm here", "tôi ở đây"),
+    ("я иду", "i'm coming|i am coming|on my way", "tôi đang đến"),
+    ("поздравляю", "congratulations|congrats", "chúc mừng"),
+]
+
+_URL_RE = re.compile(r"(?:https?://|www\.)\S+|\b[\w.-]+\.(?:com|ru|net|org|io|vn|me)(?:/\S*)?", re.IGNORECASE)
+_MENTION_RE = re.compile(r"[@#]\w+")
+_COMMAND_RE = re.compile(r"^/\w+(?:@\w+)?(?:\s|$)")
+_EDGE_PUNCT = "!?.,;:…¡¿ \t\n\"'«»()"
+
+# lang -> нормализованная фраза -> строка таблицы
+_index: Optional[Dict[str, Dict[str, Tuple[str, ...]]]] = None
+
+
+def _strip_marks(text: str) -> str:
+    """Vietnamese without diacritics: "cảm ơn" -> "cam on" (people often type so)."""
+    decomposed = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    return "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+
+
+def normalize_phrase(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).lower().replace("ё", "е")
+    return " ".join(text.strip(_EDGE_PUNCT).split())
+
+
+def _build_index(rows: Sequence[Sequence[str]]) -> Dict[str, Dict[str, Tuple[str, ...]]]:
+    index: Dict[str, Dict[str, Tuple[str, ...]]] = {lang: {} for lang in LANG_ORDER}
+    for row in rows:
+        canonical = tuple(cell.split("|")[0] for cell in row)
+        for lang, cell in zip(LANG_ORDER, row):
+            for variant in cell.split("|"):
+                key = normalize_phrase(variant)
+                index[lang].setdefault(key, canonical)
+                if lang == "VI":
+                    index[lang].setdefault(_strip_marks(key), canonical)
+    return index
+
+
+def load_phrases(path: str = "") -> int:
+    """
+    Build the lookup index from the built-in table plus an optional JSON file
+    (a list of [ru, en, vi] rows, same | syntax). Called once at startup.
+    Returns the number of rows.
+    """
+    global _index
+
+    rows: List[Sequence[str]] = list(PHRASES)
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                extra = json.load(f)
+            rows = [row for row in extra if len(row) == len(LANG_ORDER)] + rows
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to load phrase table %s: %s", path, e)
+    _index = _build_index(rows)
+    return len(rows)
+
+
+def untranslatable_kind(text: str) -> Optional[str]:
+    """
+    "command" / "link" / "symbols" (эмодзи, цифры, знаки) для сообщений, которые
+    нечего переводить, иначе None.
+    """
+    stripped = text.strip()
+    if not stripped:
+        return "symbols"
+    if _COMMAND_RE.match(stripped):
+        return "command"
+    rest = _URL_RE.sub(" ", stripped)
+    had_link = rest != stripped
+    rest = _MENTION_RE.sub(" ", rest)
+    if any(ch.isalpha() for ch in rest):
+        return None
+    return "link" if had_link else "symbols"
+
+
+def lookup_phrase(text: str, source_lang: str, target_lang: str) -> Optional[str]:
+    """Готовый перевод частой фразы из таблицы или None. Сохраняет заглавную букву и ?/! в конце."""
+    if _index is None:
+        load_phrases()
+    assert _index is not None
+
+    if len(text) > 40:
+        return None
+    key = normalize_phrase(text)
+    row = _index.get(source_lang, {}).get(key)
+    if row is None and source_lang == "VI":
+        row = _index["VI"].get(_strip_marks(key))
+    if row is None or target_lang not in LANG_ORDER:
+        return None
+
+    translation = row[LANG_ORDER.index(target_lang)]
+    stripped = text.strip()
+    if stripped[:1].isupper():
+        translation = translation[:1].upper() + translation[1:]
+    tail = stripped[len(stripped.rstrip("!?.…")):]
+    return translation + tail
+
+
+def record(hit: Optional[str]) -> None:
+    """Count a fast-path outcome (hit kind or None for a miss) and update the hit ratio."""
+    if hit:
+        metrics.inc(metrics.labeled("fast_path_hit", kind=hit))
+        metrics.inc("fast_path_hits")
+    else:
+        metrics.inc("fast_path_misses")
+    hits = metrics.counters["fast_path_hits"]
+    total = hits + metrics.counters["fast_path_misses"]
+    metrics.set_gauge("fast_path_hit_ratio", hits / total if total else 0.0)
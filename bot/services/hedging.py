@@ -0,0 +1,172 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple, TypeVar
+
+from bot.config import settings
+from bot.services import metrics
+
+T = TypeVar("T")
+
+# Крайний срок обработки текущего апдейта (time.monotonic()), None — без срока
+deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The update ran out of its time budget."""
+
+
+def set_deadline(seconds: Optional[float]) -> Token:
+    """Deadline `seconds` from now for the current update (None or <= 0 — no deadline)."""
+    return deadline.set(time.monotonic() + seconds if seconds and seconds > 0 else None)
+
+
+def set_audio_deadline(duration: Optional[float]) -> Token:
+    """
+    Deadline for a recording: it still has to be downloaded, transcoded and
+    transcribed, so update_deadline is extended by its duration.
+    UPDATE_DEADLINE=0 stays "no deadline".
+    """
+    if settings.update_deadline <= 0:
+        return set_deadline(None)
+    return set_deadline(settings.update_deadline + (duration or 0))
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the deadline, None without one."""
+    value = deadline.get()
+    if value is None:
+        return None
+    return value - time.monotonic()
+
+
+def check_deadline() -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.inc("deadline_exceeded")
+        raise DeadlineExceeded("update deadline exceeded")
+
+
+def _size_bucket(cost: float) -> int:
+    """Степень двойки стоимости: запросы сравнимого размера сравниваем между собой."""
+    return max(0, int(math.log2(max(cost, 1.0))))
+
+
+class HedgePolicy:
+    """
+    When to fire a duplicate request for one call type.
+
+    Latencies of successful calls are kept per size bucket (last `window`
+    values); the hedge delay is their p95, or settings.hedge_initial_delay until
+    enough samples are collected. Hedges are capped at settings.hedge_max_share
+    of primary calls.
+    """
+
+    def __init__(self, kind: str, window: int = 200, min_samples: int = 20):
+        self.kind = kind
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies: Dict[int, Deque[float]] = {}
+        # Сколько наблюдений записано в корзину за всё время (длина deque упирается в window)
+        self._observed: Dict[int, int] = {}
+        self._p95: Dict[int, Tuple[int, float]] = {}
+        self.primaries = 0
+        self.hedges = 0
+
+    def record(self, cost: float, seconds: float) -> None:
+        bucket = _size_bucket(cost)
+        self._latencies.setdefault(bucket, deque(maxlen=self.window)).append(seconds)
+        self._observed[bucket] = self._observed.get(bucket, 0) + 1
+
+    def delay(self, cost: float) -> float:
+        bucket = _size_bucket(cost)
+        samples = self._latencies.get(bucket)
+        if not samples or len(samples) < self.min_samples:
+            return settings.hedge_initial_delay
+
+        # p95 пересчитываем не на каждый вызов, а раз в 10 новых наблюдений
+        observed = self._observed[bucket]
+        cached = self._p95.get(bucket)
+        if cached is None or observed - cached[0] >= 10:
+            ordered = sorted(samples)
+            p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+            cached = self._p95[bucket] = (observed, p95)
+        return max(settings.hedge_min_delay, cached[1])
+
+    def allow_hedge(self) -> bool:
+        return self.hedges < settings.hedge_max_share * self.primaries
+
+
+async def run_hedged(
+    policy: HedgePolicy,
+    cost: float,
+    primary: Callable[[], Awaitable[T]],
+    hedge: Optional[Callable[[], Awaitable[T]]] = None,
+    is_valid: Optional[Callable[[T], bool]] = None,
+) -> T:
+    """
+    Run primary(); if it is still running after the policy's delay (and the
+    budget allows), also run hedge(). The first valid result wins and the other
+    call is cancelled. If no result is valid, the last completed one is returned;
+    if all calls fail, the last error is raised. Without hedge it is a plain
+    call bounded by the update deadline.
+    Raises DeadlineExceeded when the update deadline passes first.
+    """
+    check_deadline()
+    policy.primaries += 1
+    started = time.monotonic()
+    hedging_enabled = hedge is not None and settings.hedge_enabled and policy.allow_hedge()
+
+    primary_task = asyncio.ensure_future(primary())
+    tasks: Set[asyncio.Future] = {primary_task}
+    hedge_task: Optional[asyncio.Future] = None
+    fallback: Optional[Tuple[T]] = None
+    error: Optional[BaseException] = None
+
+    try:
+        while tasks:
+            timeout = remaining()
+            if hedge_task is None and hedging_enabled:
+                hedge_delay = policy.delay(cost) - (time.monotonic() - started)
+                timeout = hedge_delay if timeout is None else min(timeout, hedge_delay)
+
+            done, _ = await asyncio.wait(
+                tasks,
+                timeout=max(0.0, timeout) if timeout is not None else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            if not done:
+                check_deadline()
+                if hedge_task is None and hedging_enabled and policy.allow_hedge():
+                    policy.hedges += 1
+                    metrics.inc(f"hedge_{policy.kind}_fired")
+                    hedge_task = asyncio.ensure_future(hedge())  # type: ignore[misc]
+                    tasks.add(hedge_task)
+                hedging_enabled = False
+                continue
+
+            for task in done:
+                tasks.discard(task)
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                result = task.result()
+                if is_valid is None or is_valid(result):
+                    if hedge is not None:
+                        policy.record(cost, time.monotonic() - started)
+                    if task is hedge_task:
+                        metrics.inc(f"hedge_{policy.kind}_won")
+                    return result
+                fallback = (result,)
+    finally:
+        for task in (primary_task, hedge_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+    if fallback is not None:
+        return fallback[0]
+    assert error is not None
+    raise error
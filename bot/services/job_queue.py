@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import random
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from bot.config import settings
+from bot.db.storage import (
+    Job,
+    ack_job,
+    enqueue_job,
+    give_up_job,
+    job_queue_depths,
+    lease_job,
+    prune_failed_jobs,
+    renew_job_lease,
+    retry_job,
+    save_job_payload,
+)
+from bot.services import metrics
+from bot.services.hedging import set_deadline
+from bot.services.tracing import new_trace_id, trace_id
+
+logger = logging.getLogger(__name__)
+
+# Обработчик этапа возвращает следующую задачу (этап, payload) или None, если конвейер закончен
+NextJob = Optional[Tuple[str, Dict[str, Any]]]
+StageHandler = Callable[[Dict[str, Any]], Awaitable[NextJob]]
+# Вызывается, когда задача исчерпала попытки (например, чтобы сообщить пользователю об ошибке)
+GiveUpHandler = Callable[[Dict[str, Any], Exception], Awaitable[None]]
+
+# Задача, которую обрабатывает текущий этап (для checkpoint)
+_current_job: ContextVar[Optional[Job]] = ContextVar("current_job", default=None)
+# Упавшие задачи чистим раз в столько секунд
+PRUNE_INTERVAL = 3600.0
+
+
+@dataclass
+class Stage:
+    name: str
+    handler: StageHandler
+    concurrency: int
+    on_give_up: Optional[GiveUpHandler] = None
+
+
+class JobQueue:
+    """
+    Durable pipeline on top of the jobs table in SQLite.
+
+    Each stage has its own pool of `concurrency` workers that lease jobs, run the
+    stage handler and enqueue the next stage before acking the job. A job whose
+    lease is renewed while the handler runs; a job whose lease expires (the
+    process died mid-work) is picked up again, so delivery is at-least-once.
+    Failed jobs are retried with backoff up to settings.job_max_attempts times.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Stage] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def register(
+        self,
+        name: str,
+        handler: StageHandler,
+        concurrency: int,
+        on_give_up: Optional[GiveUpHandler] = None,
+    ) -> None:
+        self._stages[name] = Stage(name, handler, max(1, concurrency), on_give_up)
+
+    async def enqueue(self, stage: str, payload: Dict[str, Any]) -> int:
+        # Trace id апдейта едет с задачей через все этапы конвейера
+        if not payload.get("trace_id"):
+            payload["trace_id"] = trace_id.get()
+        job_id = await enqueue_job(stage, payload)
+        wakeup = self._wakeups.get(stage)
+        if wakeup is not None:
+            wakeup.set()
+        return job_id
+
+    async def checkpoint(self, payload: Dict[str, Any]) -> None:
+        """
+        Save the progress the running stage wrote into its payload, so a retry
+        of the job continues from there instead of repeating side effects.
+        """
+        job = _current_job.get()
+        if job is not None:
+            await save_job_payload(job.id, payload)
+
+    def start(self) -> None:
+        for stage in self._stages.values():
+            self._wakeups[stage.name] = asyncio.Event()
+            for _ in range(stage.concurrency):
+                self._tasks.append(asyncio.create_task(self._worker(stage)))
+        self._tasks.append(asyncio.create_task(self._report_depths()))
+        logger.info(
+            "Job queue started: %s",
+            ", ".join(f"{s.name}×{s.concurrency}" for s in self._stages.values()),
+        )
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _wait_for_work(self, stage: str) -> None:
+        wakeup = self._wakeups[stage]
+        try:
+            await asyncio.wait_for(wakeup.wait(), settings.job_poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+    async def _worker(self, stage: Stage) -> None:
+        while True:
+            try:
+                job = await lease_job(stage.name, settings.job_lease_seconds)
+            except Exception as e:
+                logger.warning("Failed to lease %s job: %s", stage.name, e)
+                job = None
+
+            if job is None:
+                await self._wait_for_work(stage.name)
+                continue
+
+            try:
+                await self._process(stage, job)
+            except Exception:
+                # Аренда истечёт, и задачу подберут снова
+                logger.exception("Job %s (%s) could not be completed", job.id, stage.name)
+
+    async def _process(self, stage: Stage, job: Job) -> None:
+        payload_trace = job.payload.get("trace_id")
+        trace_id.set(payload_trace if payload_trace and payload_trace != "-" else new_trace_id())
+        # Срок — на один этап; этап может продлить его для длинных входов
+        set_deadline(settings.update_deadline)
+        _current_job.set(job)
+        started = time.time()
+        metrics.observe(f"job_{stage.name}_queue_seconds", max(0.0, started - job.created_at))
+        keeper = asyncio.create_task(self._keep_lease(stage, job))
+        try:
+            next_job = await stage.handler(job.payload)
+        except Exception as e:
+            await self._on_error(stage, job, e)
+            return
+        finally:
+            keeper.cancel()
+            metrics.observe(f"job_{stage.name}_seconds", time.time() - started)
+
+        if next_job is not None:
+            await self.enqueue(*next_job)
+        await ack_job(job.id)
+        metrics.inc(f"job_{stage.name}_done")
+
+    async def _keep_lease(self, stage: Stage, job: Job) -> None:
+        """Renew the lease every third of its length so a long stage is not picked up twice."""
+        lease = settings.job_lease_seconds
+        while True:
+            await asyncio.sleep(lease / 3)
+            try:
+                if not await renew_job_lease(job, lease):
+                    logger.warning("Lost the lease of job %s (%s)", job.id, stage.name)
+                    metrics.inc(f"job_{stage.name}_lease_lost")
+                    return
+            except Exception as e:
+                logger.warning("Failed to renew the lease of job %s: %s", job.id, e)
+
+    async def _on_error(self, stage: Stage, job: Job, error: Exception) -> None:
+        if job.attempts < settings.job_max_attempts:
+            delay = min(60.0, 2 ** job.attempts) * random.uniform(0.5, 1.5)
+            logger.warning(
+                "Job %s (%s) failed on attempt %s, retry in %.1fs: %s",
+                job.id,
+                stage.name,
+                job.attempts,
+                delay,
+                error,
+            )
+            metrics.inc(f"job_{stage.name}_retried")
+            await retry_job(job.id, repr(error), delay)
+            return
+
+        logger.error(
+            "Job %s (%s) gave up after %s attempts: %s", job.id, stage.name, job.attempts, error
+        )
+        metrics.inc(f"job_{stage.name}_failed")
+        await give_up_job(job.id, repr(error))
+        if stage.on_give_up is not None:
+            try:
+                await stage.on_give_up(job.payload, error)
+            except Exception:
+                logger.exception("Give-up handler of %s failed", stage.name)
+
+    async def _report_depths(self) -> None:
+        pruned_at = time.monotonic()
+        while True:
+            if time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                pruned_at = time.monotonic()
+                try:
+                    await prune_failed_jobs()
+                except Exception as e:
+                    logger.warning("Failed to prune failed jobs: %s", e)
+            try:
+                depths = await job_queue_depths()
+                for name in self._stages:
+                    metrics.set_gauge(f"job_{name}_depth", depths.get(name, 0))
+            except Exception as e:
+                logger.warning("Failed to read job queue depths: %s", e)
+            await asyncio.sleep(5)
+
+
+job_queue = JobQueue()
@@ -1,6 +1,11 @@
-from typing import Optional
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Optional, Tuple
 
-from langdetect import detect, DetectorFactory, LangDetectException
+from langdetect import detect_langs, DetectorFactory, LangDetectException
+
+from bot.services import metrics
 
 DetectorFactory.seed = 0
 
@@ -13,19 +18,220 @@ ISO_TO_APP = {
     "vn": "VI",
 }
 
+# Ниже этой уверенности отдаём текст langdetect'у
+FALLBACK_CONFIDENCE = 0.6
+# На более коротком тексте langdetect уверенно угадывает что попало («Hi» → sw 1.0):
+# его «другой язык» не считаем ответом
+FALLBACK_MIN_LETTERS = 15
 
-def detect_language(text: str) -> Optional[str]:
+# Все вьетнамские буквы с диакритикой (строчные)
+VI_LETTERS = frozenset(
+    "àáảãạăằắẳẵặâầấẩẫậđèéẻẽẹêềếểễệìíỉĩịòóỏõọôồốổỗộơờớởỡợùúủũụưừứửữựỳýỷỹỵ"
+)
+# Общие с французским/португальским — сами по себе вьетнамский не доказывают
+VI_SHARED = frozenset("àáâãèéêìíòóôõùúý")
+VI_STRONG = VI_LETTERS - VI_SHARED
+
+# Компактные таблицы для трудного случая: латиница без диакритики
+# (английский против вьетнамского, набранного без тонов).
+EN_WORDS = frozenset(
     """
-    Detect language of text and map to RU/EN/VI if possible.
-    Returns: "RU", "EN", "VI" or None if not recognized.
+    the be to of and a in that have i it for not on with he as you do at this but
+    his by from they we say her she or will my one all would there their what so
+    up out if about who get which go me when make can like time no just him know
+    take people into year your good some could them see other than then now look
+    only come its over think also back after use two how our work first well way
+    even new want because any these give day most us is are was were am has had
+    been does did hello hi thanks thank please yes yeah ok okay much many where
+    why sorry excuse price here let lets meet tomorrow today tonight morning
+    """.split()
+)
+VI_WORDS = frozenset(
     """
-    text = (text or "").strip()
-    if not text:
-        return None
+    xin chao cam on khong toi ban la co cua nguoi duoc nay mot va cho voi anh em
+    chi di an uong nha bao nhieu tien gi sao the nao roi da dang se lam biet hieu
+    noi tieng viet nam ngay hom qua mai rat it vui ve khoe cac nhung minh chung ta
+    ho day kia do dau oi nhe nha vang da duoc roi thi cung nhu nhung lai con ra vao
+    muon can phai den tu sang chieu toi dem gio phut bay tam chin muoi tram nghin
+    """.split()
+)
+_OVERLAP = EN_WORDS & VI_WORDS
+EN_WORDS = EN_WORDS - _OVERLAP
+VI_WORDS = VI_WORDS - _OVERLAP
+
+# Допустимый вьетнамский слог без диакритики: начальная согласная, 1–3 гласные, финаль.
+# В английских словах часто встречаются f/j/w/z и финали s/d/r/l/k/x — такие слоги не пройдут.
+VI_SYLLABLE_RE = re.compile(
+    r"^(ngh|ng|nh|ch|gh|gi|kh|ph|qu|th|tr|[bcdghklmnpqrstvx])?"
+    r"[aeiouy]{1,3}"
+    r"(ng|nh|ch|[cmnpt])?$"
+)
+WORD_RE = re.compile(r"[a-z]+")
+
+
+@dataclass
+class TextStats:
+    """Script statistics of a text, collected in one pass."""
+
+    letters: int = 0
+    latin: int = 0  # ASCII a-z
+    cyrillic: int = 0  # а-я, ё
+    vi_marked: int = 0  # латинские буквы с вьетнамской диакритикой
+    vi_strong: int = 0  # из них встречающиеся только во вьетнамском (ă, đ, ơ, ư, ạ, ả…)
+    other: int = 0  # прочие буквы (ü, ñ, иероглифы…)
+    digits: int = 0
+
+    @property
+    def has_cyrillic(self) -> bool:
+        return self.cyrillic > 0
+
+    @property
+    def looks_latin(self) -> bool:
+        """Грубая эвристика: текст похож на латиницу (английский)."""
+        return self.letters > 0 and self.latin / self.letters > 0.6
+
+
+@dataclass
+class Detection:
+    lang: Optional[str]
+    confidence: float
+    stats: TextStats
+
+
+def analyze_text(text: str) -> TextStats:
+    """Single pass over the text: count letters per script and Vietnamese diacritics."""
+    stats = TextStats()
+    for ch in text:
+        if ch.isalpha():
+            stats.letters += 1
+            lo = ch.lower()
+            if "a" <= lo <= "z":
+                stats.latin += 1
+            elif "а" <= lo <= "я" or lo == "ё":
+                stats.cyrillic += 1
+            elif lo in VI_LETTERS:
+                stats.vi_marked += 1
+                if lo in VI_STRONG:
+                    stats.vi_strong += 1
+            else:
+                stats.other += 1
+        elif ch.isdigit():
+            stats.digits += 1
+    return stats
+
+
+def _score_plain_latin(text: str) -> Tuple[Optional[str], float]:
+    """EN vs diacritic-free VI using the word tables and VI syllable structure."""
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return None, 0.0
+
+    en_hits = vi_hits = 0
+    en_score = vi_score = 0.0
+    for w in words:
+        if w in EN_WORDS:
+            en_hits += 1
+            en_score += 1.0
+        elif w in VI_WORDS:
+            vi_hits += 1
+            vi_score += 1.0
+        elif VI_SYLLABLE_RE.match(w) is None:
+            # Не вьетнамский слог — против VI, но за EN только наполовину (может быть любой язык)
+            en_score += 0.5
+        else:
+            # Под шаблон слога подходят и короткие английские слова (see, you, soon) — слабый довод
+            vi_score += 0.25
+
+    if en_score == vi_score:
+        return None, 0.0
+    lang = "EN" if en_score > vi_score else "VI"
+    margin = abs(en_score - vi_score) / (en_score + vi_score)
+    # Доля слов, которые словарь победителя действительно узнал:
+    # без попаданий в словари это может быть любой латинский язык
+    coverage = (en_hits if lang == "EN" else vi_hits) / len(words)
+    return lang, 0.5 + margin * coverage / 2
+
+
+def _strip_marks(text: str) -> str:
+    decomposed = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
 
+
+def _classify(text: str, stats: TextStats) -> Tuple[Optional[str], float]:
+    if stats.letters == 0:
+        return None, 0.0
+
+    cyr_ratio = stats.cyrillic / stats.letters
+    if cyr_ratio >= 0.6:
+        return "RU", cyr_ratio
+
+    latin_total = stats.latin + stats.vi_marked
+    latin_ratio = latin_total / stats.letters
+    if latin_ratio < 0.6:
+        # Смесь алфавитов или чужая письменность
+        if cyr_ratio > latin_ratio:
+            return "RU", cyr_ratio
+        return None, 0.0
+
+    if stats.vi_strong > 0:
+        return "VI", min(1.0, 0.85 + stats.vi_strong / latin_total)
+
+    vi_ratio = stats.vi_marked / latin_total
+    if vi_ratio >= 0.12:
+        # Только общие с испанским/французским знаки (á, é, ó…): вьетнамский — если
+        # слова складываются во вьетнамские слоги («xin chào»), а не «días», «estás»
+        words = WORD_RE.findall(_strip_marks(text))
+        vi_valid = sum(VI_SYLLABLE_RE.match(w) is not None for w in words)
+        if vi_valid * 2 < len(words):
+            return None, 0.3
+        return "VI", min(1.0, 0.6 + vi_ratio)
+    if stats.vi_marked > 0 or stats.other > 0:
+        # é/à/ü/ñ… — похоже на французский или немецкий, пусть решает langdetect
+        return None, 0.3
+
+    return _score_plain_latin(text)
+
+
+def _detect_langdetect(text: str) -> Tuple[Optional[str], float]:
     try:
-        iso_code = detect(text)
+        candidates = detect_langs(text)
     except LangDetectException:
-        return None
+        return None, 0.0
+    if not candidates:
+        return None, 0.0
+
+    best = candidates[0]
+    return ISO_TO_APP.get(best.lang), best.prob
 
-    return ISO_TO_APP.get(iso_code)
\ No newline at end of file
+
+@metrics.timed("lang_detect")
+def detect_language_ex(text: str) -> Detection:
+    """
+    Detect RU/EN/VI with a confidence score and the script statistics
+    (reused by choose_direction instead of rescanning the text).
+    Falls back to langdetect only when the fast classifier is unsure.
+    """
+    text = (text or "").strip()
+    if text and not unicodedata.is_normalized("NFC", text):
+        text = unicodedata.normalize("NFC", text)
+
+    stats = analyze_text(text)
+    lang, confidence = _classify(text, stats)
+    if confidence < FALLBACK_CONFIDENCE and stats.letters > 0:
+        metrics.inc("lang_detect_fallback")
+        fallback_lang, fallback_conf = _detect_langdetect(text)
+        if fallback_lang is not None:
+            lang, confidence = fallback_lang, fallback_conf
+        elif stats.letters >= FALLBACK_MIN_LETTERS and fallback_conf >= confidence:
+            # langdetect уверенно видит другой язык (например, немецкий) — тоже ответ
+            lang, confidence = None, fallback_conf
+        # Иначе доводов нет: остаётся догадка быстрого классификатора с низкой уверенностью
+    return Detection(lang=lang, confidence=confidence, stats=stats)
+
+
+def detect_language(text: str) -> Optional[str]:
+    """
+    Detect language of text and map to RU/EN/VI if possible.
+    Returns: "RU", "EN", "VI" or None if not recognized.
+    """
+    return detect_language_ex(text).lang
@@ -0,0 +1,251 @@
+import functools
+import inspect
+import logging
+import math
+import re
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Имена метрик могут нести метки в формате Prometheus: stage_seconds{stage="whisper"}
+# (см. labeled). Без меток — просто имя.
+
+# Простые счётчики процесса (хиты кэша, ретраи и т.п.)
+counters: Counter = Counter()
+
+# Текущие значения (глубина очередей и т.п.)
+gauges: Dict[str, float] = {}
+
+# Наблюдения длительностей: имя -> {"count", "sum", "max"}
+observations: Dict[str, Dict[str, float]] = {}
+
+# Гистограммы для /metrics: имя -> (границы корзин, счётчики по корзинам)
+histograms: Dict[str, Tuple[Sequence[float], List[int]]] = {}
+
+# Вызываются перед каждой выдачей /metrics: обновляют gauges из состояния,
+# которое живёт в других модулях (размер и хиты LRU-кэшей и т.п.)
+_collectors: List[Callable[[], None]] = []
+
+# Границы по умолчанию — для задержек в секундах
+LATENCY_BUCKETS: Sequence[float] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+# Для размеров и долей (размер пачки, заполненность и т.п.)
+SIZE_BUCKETS: Sequence[float] = (0.1, 0.25, 0.5, 0.75, 1, 2, 4, 8, 16, 32, 64)
+
+PREFIX = "translator_"
+
+
+def labeled(name: str, **labels: Any) -> str:
+    """Metric name with Prometheus labels: labeled("errors", kind="text") -> errors{kind="text"}."""
+    if not labels:
+        return name
+    parts = ",".join(f'{k}="{_escape(str(v))}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{parts}}}"
+
+
+def inc(name: str, value: int = 1) -> None:
+    """Increase a named counter."""
+    counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Set the current value of a gauge."""
+    gauges[name] = value
+
+
+def observe(name: str, value: float, buckets: Optional[Sequence[float]] = None) -> None:
+    """
+    Record one observation (e.g. a latency in seconds). Bucket bounds are fixed
+    by the first observation of a name; LATENCY_BUCKETS unless given.
+    """
+    item = observations.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+    item["count"] += 1
+    item["sum"] += value
+    item["max"] = max(item["max"], value)
+
+    bounds, counts = histograms.setdefault(
+        name, (tuple(buckets or LATENCY_BUCKETS), [0] * len(buckets or LATENCY_BUCKETS))
+    )
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            counts[i] += 1
+            break
+
+
+def register_collector(collect: Callable[[], None]) -> None:
+    """Call collect() before every render_prometheus (e.g. to set gauges from a cache's stats)."""
+    _collectors.append(collect)
+
+
+def export_stats(prefix: str, stats: Dict[str, float]) -> None:
+    """Set a gauge prefix_<key> for every value of a stats dict (LRUCache.stats())."""
+    for key, value in stats.items():
+        set_gauge(f"{prefix}_{key}", value)
+
+
+def snapshot() -> Dict[str, int]:
+    """Return a copy of all counters."""
+    return dict(counters)
+
+
+class timed:
+    """
+    Measure a stage: context manager (sync or inside async code) and decorator
+    for plain and async functions.
+
+        with metrics.timed("telegram_send"):
+            await message.answer(text)
+
+        @metrics.timed("db_get_user_languages")
+        async def get_user_languages(...): ...
+
+    Records stage_seconds{stage=...}; an exception also counts
+    stage_errors{stage=...} and is re-raised.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._started: List[float] = []
+
+    def _done(self, started: float, failed: bool) -> None:
+        observe(labeled("stage_seconds", stage=self.stage), time.monotonic() - started)
+        if failed:
+            inc(labeled("stage_errors", stage=self.stage))
+
+    def __enter__(self) -> "timed":
+        self._started.append(time.monotonic())
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._done(self._started.pop(), exc_type is not None)
+
+    def __call__(self, func: F) -> F:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.monotonic()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    self._done(started, True)
+                    raise
+                self._done(started, False)
+                return result
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                self._done(started, True)
+                raise
+            self._done(started, False)
+            return result
+
+        return wrapper  # type: ignore[return-value]
+
+
+# ---------------------------------------------------------------------------
+# Prometheus text format
+# ---------------------------------------------------------------------------
+
+_INVALID_CHARS = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _split(name: str) -> Tuple[str, str]:
+    """errors{kind="text"} -> ("translator_errors", 'kind="text"')."""
+    base, _, labels = name.partition("{")
+    return PREFIX + _INVALID_CHARS.sub("_", base), labels.rstrip("}")
+
+
+def _with_labels(base: str, labels: str, extra: str = "") -> str:
+    joined = ",".join(part for part in (labels, extra) if part)
+    return f"{base}{{{joined}}}" if joined else base
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus() -> str:
+    """All counters, gauges and histograms in Prometheus text exposition format."""
+    for collect in _collectors:
+        try:
+            collect()
+        except Exception as e:
+            logger.warning("Metrics collector %s failed: %s", collect, e)
+
+    lines: List[str] = []
+    typed = set()
+
+    def header(base: str, kind: str) -> None:
+        if base not in typed:
+            typed.add(base)
+            lines.append(f"# TYPE {base} {kind}")
+
+    for name in sorted(counters):
+        base, labels = _split(name)
+        base += "_total"
+        header(base, "counter")
+        lines.append(f"{_with_labels(base, labels)} {counters[name]}")
+
+    for name in sorted(gauges):
+        base, labels = _split(name)
+        header(base, "gauge")
+        lines.append(f"{_with_labels(base, labels)} {_format_value(gauges[name])}")
+
+    for name in sorted(histograms):
+        base, labels = _split(name)
+        header(base, "histogram")
+        bounds, counts = histograms[name]
+        cumulative = 0
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{_with_labels(base + '_bucket', labels, le)} {cumulative}")
+        item = observations[name]
+        inf = 'le="+Inf"'
+        lines.append(f"{_with_labels(base + '_bucket', labels, inf)} {int(item['count'])}")
+        lines.append(f"{_with_labels(base + '_sum', labels)} {_format_value(item['sum'])}")
+        lines.append(f"{_with_labels(base + '_count', labels)} {int(item['count'])}")
+
+    return "\n".join(lines) + "\n"
+
+
+async def start_http_server(host: str, port: int):
+    """
+    Serve GET /metrics on host:port (aiohttp). Returns the runner — pass it to
+    stop_http_server on shutdown.
+    """
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics available on http://%s:%s/metrics", host, port)
+    return runner
+
+
+async def stop_http_server(runner) -> None:
+    if runner is not None:
+        await runner.cleanup()
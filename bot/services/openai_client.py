@@ -2,4 +2,10 @@ from openai import AsyncOpenAI
 
 from bot.config import settings
 
-client = AsyncOpenAI(api_key=settings.openai_api_key)
\ No newline at end of file
+# Повторы делает планировщик в bot.services.rate_limit (с учётом Retry-After)
+client = AsyncOpenAI(
+    api_key=settings.openai_api_key,
+    base_url=settings.openai_base_url or None,
+    max_retries=0,
+    timeout=settings.openai_timeout or None,
+)
@@ -0,0 +1,270 @@
+"""
+Исходящие сообщения в Telegram через одну очередь: общий лимит бота и лимит
+на чат (token bucket), порядок внутри чата, пауза чата по RetryAfter и
+склейка промежуточных правок одного сообщения.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from bot.config import settings
+from bot.services import metrics
+from bot.services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Состояние чата без очереди и без отправок дольше этого — забываем
+CHAT_IDLE_SECONDS = 300.0
+
+
+@dataclass
+class _Item:
+    call: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    # Ключ сообщения для правок: промежуточная правка заменяет предыдущую с тем же ключом
+    key: Optional[Hashable] = None
+    intermediate: bool = False
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    queue: Deque[_Item] = field(default_factory=deque)
+    worker: Optional[asyncio.Task] = None
+    paused_until: float = 0.0
+    last_active: float = field(default_factory=time.monotonic)
+
+
+class Outbox:
+    """
+    Scheduler for outbound Bot API calls.
+
+    Every chat has a FIFO queue served by its own worker task; a call goes out
+    when both the global bucket (settings.telegram_global_rate per second) and
+    the chat's bucket (telegram_chat_rate per second for private chats,
+    telegram_group_rate per minute for groups) have a token. RetryAfter pauses
+    only that chat and the call is repeated. A queued intermediate edit is
+    replaced by a newer edit of the same message, so a slow chat gets the latest
+    text instead of every step.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, group_rate: float, burst: int):
+        self.global_bucket = TokenBucket(global_rate * 60, capacity=max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self._chats: Dict[int, _Chat] = {}
+
+    def _chat(self, chat_id: int) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) > 1000:
+                self._prune()
+            # Отрицательный id — группа или канал: там лимит в минуту
+            rate = self.group_rate if chat_id < 0 else self.chat_rate * 60
+            chat = _Chat(bucket=TokenBucket(rate, capacity=self.burst))
+            self._chats[chat_id] = chat
+        return chat
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for chat_id, chat in list(self._chats.items()):
+            if not chat.queue and chat.worker is None and now - chat.last_active > CHAT_IDLE_SECONDS:
+                del self._chats[chat_id]
+
+    def scale_global_limit(self, share: float) -> None:
+        """
+        Keep only `share` of the global limit — it is per bot token, so worker
+        processes split it. Chat limits stay as they are: a chat lives in one worker.
+        """
+        self.global_bucket.scale(share)
+
+    def queue_depth(self) -> int:
+        return sum(len(chat.queue) for chat in self._chats.values())
+
+    def enqueue(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        key: Optional[Hashable] = None,
+        intermediate: bool = False,
+    ) -> asyncio.Future:
+        """
+        Queue call() for the chat. The future gets its result or error; a dropped
+        intermediate edit resolves to None.
+        """
+        chat = self._chat(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        item = _Item(call, future, key, intermediate)
+
+        if key is not None:
+            for i, queued in enumerate(chat.queue):
+                if queued.key != key or not queued.intermediate:
+                    continue
+                # Ещё не отправленная промежуточная правка устарела
+                if not queued.future.done():
+                    queued.future.set_result(None)
+                metrics.inc("outbox_edits_dropped")
+                if intermediate:
+                    chat.queue[i] = item
+                else:
+                    del chat.queue[i]
+                    chat.queue.append(item)
+                break
+            else:
+                chat.queue.append(item)
+        else:
+            chat.queue.append(item)
+
+        metrics.set_gauge("outbox_queue_depth", self.queue_depth())
+        if chat.worker is None:
+            chat.worker = asyncio.create_task(self._serve(chat_id, chat))
+        return future
+
+    async def send(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[Any]],
+        key: Optional[Hashable] = None,
+    ) -> Any:
+        return await self.enqueue(chat_id, call, key)
+
+    async def _wait_for_token(self, chat: _Chat) -> None:
+        while True:
+            wait = max(
+                chat.paused_until - time.monotonic(),
+                chat.bucket.delay(1),
+                self.global_bucket.delay(1),
+            )
+            if wait <= 0:
+                chat.bucket.take(1)
+                self.global_bucket.take(1)
+                return
+            await asyncio.sleep(wait)
+
+    async def _serve(self, chat_id: int, chat: _Chat) -> None:
+        try:
+            while chat.queue:
+                if chat.queue[0].future.done():
+                    # Отправитель уже не ждёт (отменён) — токен не тратим
+                    chat.queue.popleft()
+                    continue
+                await self._wait_for_token(chat)
+                if not chat.queue:
+                    break
+                item = chat.queue.popleft()
+                metrics.set_gauge("outbox_queue_depth", self.queue_depth())
+                if item.future.done():
+                    continue
+                metrics.observe("outbox_wait_seconds", time.monotonic() - item.queued_at)
+                await self._deliver(chat_id, chat, item)
+                chat.last_active = time.monotonic()
+        finally:
+            chat.worker = None
+            if chat.queue:
+                # Воркер отменили с непустой очередью (остановка) — будим ожидающих
+                for item in chat.queue:
+                    if not item.future.done():
+                        item.future.cancel()
+                chat.queue.clear()
+
+    async def _deliver(self, chat_id: int, chat: _Chat, item: _Item) -> None:
+        attempt = 0
+        while True:
+            try:
+                result = await item.call()
+            except TelegramRetryAfter as e:
+                metrics.inc("outbox_retry_after")
+                chat.paused_until = time.monotonic() + e.retry_after
+                logger.warning("Flood control in chat %s, pause %ss", chat_id, e.retry_after)
+                if item.future.done():
+                    return
+                if item.intermediate:
+                    # Промежуточную правку не повторяем — её перекроет следующая
+                    metrics.inc("outbox_edits_dropped")
+                    item.future.set_result(None)
+                    return
+                attempt += 1
+                if attempt > settings.outbox_max_retries:
+                    item.future.set_exception(e)
+                    return
+                await self._wait_for_token(chat)
+                continue
+            except TelegramBadRequest as e:
+                if item.future.done():
+                    return
+                if item.intermediate:
+                    # «message is not modified» и т.п. для промежуточных правок не важны
+                    logger.debug("Intermediate edit skipped: %s", e)
+                    item.future.set_result(None)
+                else:
+                    item.future.set_exception(e)
+                return
+            except Exception as e:
+                if item.future.done():
+                    return
+                if item.intermediate:
+                    # Результат промежуточной правки никто не ждёт
+                    logger.warning("Intermediate edit failed in chat %s: %s", chat_id, e)
+                    item.future.set_result(None)
+                else:
+                    item.future.set_exception(e)
+                return
+
+            metrics.inc("outbox_sent")
+            if not item.future.done():
+                item.future.set_result(result)
+            return
+
+    async def drain(self, timeout: float = 5.0) -> None:
+        """Wait (up to timeout) until queued messages are sent, then stop the workers."""
+        workers = [chat.worker for chat in self._chats.values() if chat.worker is not None]
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+        for chat in self._chats.values():
+            if chat.worker is not None:
+                chat.worker.cancel()
+
+
+outbox = Outbox(
+    global_rate=settings.telegram_global_rate,
+    chat_rate=settings.telegram_chat_rate,
+    group_rate=settings.telegram_group_rate,
+    burst=settings.telegram_chat_burst,
+)
+
+
+async def answer(message: Message, text: str, **kwargs) -> Message:
+    """message.answer через очередь чата."""
+    return await outbox.send(message.chat.id, lambda: message.answer(text, **kwargs))
+
+
+async def send_message(bot: Bot, chat_id: int, text: str, **kwargs) -> Message:
+    return await outbox.send(chat_id, lambda: bot.send_message(chat_id, text, **kwargs))
+
+
+async def edit_text(message: Message, text: str, **kwargs) -> Any:
+    """Финальная правка: отменяет ещё не отправленные промежуточные правки этого сообщения."""
+    return await outbox.send(
+        message.chat.id,
+        lambda: message.edit_text(text, **kwargs),
+        key=message.message_id,
+    )
+
+
+def edit_text_later(message: Message, text: str, **kwargs) -> None:
+    """Промежуточная правка без ожидания: может быть заменена более новой или пропущена."""
+    outbox.enqueue(
+        message.chat.id,
+        lambda: message.edit_text(text, **kwargs),
+        key=message.message_id,
+        intermediate=True,
+    )
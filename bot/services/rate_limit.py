@@ -0,0 +1,306 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import openai
+
+from bot.config import settings
+from bot.services import metrics
+from bot.services.hedging import DeadlineExceeded, HedgePolicy, remaining, run_hedged
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Пользователь, от имени которого идёт текущий запрос (для честной очереди)
+current_user_id: ContextVar[Optional[int]] = ContextVar("current_user_id", default=None)
+
+# Ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class SchedulerBusy(RuntimeError):
+    """The OpenAI request queue is full."""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most
+    `capacity` tokens (a minute's worth by default). rate <= 0 means unlimited.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.max_rate = rate_per_minute
+        self.rate = rate_per_minute
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate / 60.0)
+        self._updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 — available now)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic())
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.rate
+
+    def take(self, amount: float) -> None:
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+    def scale(self, share: float) -> None:
+        """Keep only `share` of the rate and capacity (a limit shared by several processes)."""
+        self.max_rate *= share
+        self.rate *= share
+        self.capacity *= share
+        self.tokens = min(self.tokens, self.capacity)
+
+    def slow_down(self, factor: float = 0.7, floor: float = 0.2) -> None:
+        """Multiplicative decrease after a 429."""
+        self.rate = max(self.max_rate * floor, self.rate * factor)
+
+    def speed_up(self, step: float = 0.02) -> None:
+        """Additive increase after a success, up to the configured rate."""
+        self.rate = min(self.max_rate, self.rate + self.max_rate * step)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds from Retry-After / retry-after-ms headers of an OpenAI error."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class OpenAIScheduler:
+    """
+    Admission control for one kind of OpenAI call (chat or whisper).
+
+    Requests wait in a bounded priority queue and are released while the
+    requests-per-minute and tokens-per-minute buckets allow. The queue is ordered
+    by how many requests the same user already has in flight (fairness), then by
+    estimated cost (short texts first), then by arrival. A 429 pauses the whole
+    queue for Retry-After and lowers the rate; successes raise it back.
+    """
+
+    def __init__(self, kind: str, rpm: float, tpm: float, max_queue: int):
+        self.kind = kind
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_queue = max_queue
+        self._heap: List[Tuple[int, float, int, float, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        self._user_active: Dict[Optional[int], int] = {}
+        self.hedge_policy = HedgePolicy(kind)
+
+    def queue_depth(self) -> int:
+        return sum(1 for entry in self._heap if not entry[-1].done())
+
+    def _update_gauge(self) -> None:
+        metrics.set_gauge(f"openai_{self.kind}_queue_depth", self.queue_depth())
+
+    def _ensure_dispatcher(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            while self._heap and self._heap[0][-1].done():
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            cost = self._heap[0][3]
+            wait = max(
+                self._paused_until - time.monotonic(),
+                self.requests.delay(1),
+                self.tokens.delay(cost),
+            )
+            if wait > 0:
+                # Ждём токены, но просыпаемся раньше, если пришёл более приоритетный запрос
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            entry = heapq.heappop(self._heap)
+            self.requests.take(1)
+            self.tokens.take(cost)
+            entry[-1].set_result(None)
+            self._update_gauge()
+
+    async def _acquire(self, cost: float, user_id: Optional[int]) -> None:
+        if self.queue_depth() >= self.max_queue:
+            metrics.inc(f"openai_{self.kind}_rejected")
+            raise SchedulerBusy(f"OpenAI {self.kind} queue is full")
+
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        entry = (self._user_active.get(user_id, 0), cost, next(self._seq), cost, future)
+        heapq.heappush(self._heap, entry)
+        self._update_gauge()
+        self._wakeup.set()
+
+        started = time.monotonic()
+        try:
+            await future
+        finally:
+            if not future.done():
+                future.cancel()
+            self._update_gauge()
+            metrics.observe(f"openai_{self.kind}_wait_seconds", time.monotonic() - started)
+
+    async def _acquire_before_deadline(self, cost: float, user_id: Optional[int]) -> None:
+        left = remaining()
+        if left is None:
+            await self._acquire(cost, user_id)
+            return
+        try:
+            await asyncio.wait_for(self._acquire(cost, user_id), max(0.0, left))
+        except asyncio.TimeoutError:
+            metrics.inc("deadline_exceeded")
+            raise DeadlineExceeded(f"deadline passed while waiting in the {self.kind} queue") from None
+
+    async def run(
+        self,
+        factory: Callable[[], Awaitable[T]],
+        cost: float = 1.0,
+        user_id: Optional[int] = None,
+        hedge: Optional[Callable[[], Awaitable[T]]] = None,
+        is_valid: Optional[Callable[[T], bool]] = None,
+    ) -> T:
+        """
+        Run factory() once the limits allow, retrying retryable errors with
+        exponential backoff and jitter (Retry-After wins when the server sends it).
+        With `hedge`, a call that runs longer than usual gets a duplicate hedge()
+        (see hedging.run_hedged); the hedge takes its own slot in the queue.
+        Everything is bounded by the update deadline (DeadlineExceeded).
+        """
+        if user_id is None:
+            user_id = current_user_id.get()
+
+        hedge_call: Optional[Callable[[], Awaitable[T]]] = None
+        if hedge is not None:
+
+            async def queued_hedge() -> T:
+                await self._acquire_before_deadline(cost, user_id)
+                return await hedge()
+
+            hedge_call = queued_hedge
+
+        self._user_active[user_id] = self._user_active.get(user_id, 0) + 1
+        try:
+            attempt = 0
+            while True:
+                await self._acquire_before_deadline(cost, user_id)
+                try:
+                    result = await run_hedged(
+                        self.hedge_policy, cost, factory, hedge_call, is_valid
+                    )
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= settings.openai_max_retries:
+                        raise
+                    delay = self._on_error(e, attempt)
+                    left = remaining()
+                    if left is not None and left <= delay:
+                        # До дедлайна повтор не успеет — сдаёмся сразу
+                        metrics.inc("deadline_exceeded")
+                        raise DeadlineExceeded(f"no time left to retry the {self.kind} call") from e
+                    attempt += 1
+                    metrics.inc(f"openai_{self.kind}_retries")
+                    logger.warning(
+                        "OpenAI %s call failed (%s), retry %s in %.1fs",
+                        self.kind,
+                        type(e).__name__,
+                        attempt,
+                        delay,
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+
+                self.requests.speed_up()
+                self.tokens.speed_up()
+                return result
+        finally:
+            self._user_active[user_id] -= 1
+            if self._user_active[user_id] <= 0:
+                del self._user_active[user_id]
+
+    def _on_error(self, error: Exception, attempt: int) -> float:
+        backoff = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+        if not isinstance(error, openai.RateLimitError):
+            return backoff
+
+        metrics.inc(f"openai_{self.kind}_429")
+        self.requests.slow_down()
+        self.tokens.slow_down()
+        retry_after = _retry_after(error)
+        delay = retry_after if retry_after is not None else backoff
+        # Лимит общий для всех — ставим на паузу всю очередь, а не только этот запрос
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+
+def estimate_chat_tokens(text: str) -> float:
+    """Rough token estimate for a translation: prompt + text in, about as much out."""
+    return 60 + len(text) / 2
+
+
+chat_scheduler = OpenAIScheduler(
+    "chat",
+    rpm=settings.openai_chat_rpm,
+    tpm=settings.openai_chat_tpm,
+    max_queue=settings.openai_queue_limit,
+)
+
+whisper_scheduler = OpenAIScheduler(
+    "whisper",
+    rpm=settings.openai_whisper_rpm,
+    tpm=0,
+    max_queue=settings.openai_queue_limit,
+)
+
+
+def scale_limits(share: float) -> None:
+    """
+    Keep only `share` of the configured limits in this process — used when
+    several worker processes share one OpenAI account.
+    """
+    for scheduler in (chat_scheduler, whisper_scheduler):
+        for bucket in (scheduler.requests, scheduler.tokens):
+            bucket.scale(share)
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from bot.services import metrics
+
+T = TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one upstream call.
+
+    Every caller awaits the shared task through asyncio.shield(), so a cancelled
+    caller only stops waiting; the upstream call is cancelled when the last
+    waiter is gone. Exceptions of the upstream call are raised in every waiter.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _on_done(self, key: Hashable, call: _Call, task: asyncio.Future) -> None:
+        self._forget(key, call)
+        # Помечаем исключение полученным, даже если его уже некому ждать
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(
+                lambda task, key=key, call=call: self._on_done(key, call, task)
+            )
+            metrics.inc(f"singleflight_{self.name}_leader")
+        else:
+            metrics.inc(f"singleflight_{self.name}_shared")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Все отказались ждать — отменяем запрос и не даём новым к нему присоединиться
+                self._forget(key, call)
+                call.task.cancel()
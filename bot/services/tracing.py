@@ -0,0 +1,82 @@
+import logging
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from bot.config import settings
+from bot.services import metrics
+from bot.services.hedging import deadline, set_deadline
+
+# Идентификатор текущего апдейта (или задачи очереди) — попадает в каждую строку лога
+trace_id: ContextVar[str] = ContextVar("trace_id", default="-")
+
+LOG_FORMAT = "%(asctime)s [%(levelname)s] [%(trace_id)s] %(name)s - %(message)s"
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds record.trace_id from the current context."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id.get()
+        return True
+
+
+def configure_logging(prefix: str = "") -> None:
+    """
+    basicConfig with the trace id in the format. The filter sits on the root
+    handlers, so records of every logger get the field.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format=LOG_FORMAT.replace("%(name)s", prefix + "%(name)s"),
+        force=True,
+    )
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+
+
+def _update_kind(update: Update) -> str:
+    return update.event_type or "unknown"
+
+
+class TraceMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: a fresh trace id and deadline per update, total
+    processing time per update type, a counter of updates whose handler raised
+    and the number of updates being handled right now (updates_in_flight).
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        kind = _update_kind(event) if isinstance(event, Update) else type(event).__name__
+        token = trace_id.set(new_trace_id())
+        deadline_token = set_deadline(settings.update_deadline)
+        started = time.monotonic()
+        self.in_flight += 1
+        metrics.set_gauge("updates_in_flight", self.in_flight)
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc(metrics.labeled("update_errors", type=kind))
+            raise
+        finally:
+            self.in_flight -= 1
+            metrics.set_gauge("updates_in_flight", self.in_flight)
+            metrics.observe(metrics.labeled("update_seconds", type=kind), time.monotonic() - started)
+            deadline.reset(deadline_token)
+            trace_id.reset(token)
@@ -1,8 +1,27 @@
-from typing import Literal
+import asyncio
+import difflib
+import hashlib
+import json
+import logging
+import unicodedata
+from typing import AsyncIterator, List, Literal, Optional, Tuple
 
 from bot.config import settings
+from bot.db.storage import (
+    get_cached_translation,
+    prune_translation_cache,
+    put_cached_translation,
+)
+from bot.services import metrics
+from bot.services.batcher import MicroBatcher
+from bot.services.cache import LRUCache
+from bot.services.chunking import split_text, trailing_whitespace
 from bot.services.openai_client import client
-from bot.services.lang_detect import detect_language
+from bot.services.rate_limit import chat_scheduler, estimate_chat_tokens
+from bot.services.singleflight import SingleFlight
+from bot.services.lang_detect import detect_language, detect_language_ex
+
+logger = logging.getLogger(__name__)
 
 AppLang = Literal["RU", "EN", "VI"]
 
@@ -12,6 +31,107 @@ LANG_NAMES = {
     "VI": "Vietnamese",  # язык
 }
 
+# Первый уровень кэша — в памяти процесса, второй — таблица translation_cache в SQLite
+_memory_cache = LRUCache(
+    settings.translation_cache_size,
+    ttl=settings.translation_cache_ttl,
+    policy=settings.translation_cache_policy,
+)
+
+# Хиты по уровням уже считаются счётчиками translation_cache_*; размер и вытеснения — здесь
+metrics.register_collector(
+    lambda: metrics.export_stats("translation_cache_memory", _memory_cache.stats())
+)
+
+# Одинаковые переводы, запрошенные одновременно (группы, пересылки), идут одним запросом
+_translation_flight = SingleFlight("translation")
+
+# Локальный детектор с такой уверенностью может оспорить язык, заявленный моделью
+VERIFY_CONFIDENCE = 0.8
+# Перевод, похожий на исходник сильнее этого, считаем непереведённым (см. is_unchanged)
+SIMILARITY_UNCHANGED = 0.85
+
+SYSTEM_PROMPT = (
+    "You are a professional translator.\n"
+    "Translate user text between languages without explanations.\n"
+    "Return ONLY the translated text, no quotes, no commentary."
+)
+
+STRUCTURED_SYSTEM_PROMPT = (
+    "You are a professional translator.\n"
+    "Translate user text between languages without explanations.\n"
+    "Respond with a JSON object: "
+    '{"translation": "<translated text>", "language": "<RU|EN|VI>"}, '
+    "where language is the code of the language the translation is actually written in."
+)
+
+BATCH_SYSTEM_PROMPT = (
+    "You are a professional translator.\n"
+    "The user message contains a JSON array of items with id and text.\n"
+    "Translate the text of every item independently, without explanations.\n"
+    "Respond with a JSON object: "
+    '{"translations": [{"id": <id>, "translation": "<translated text>", '
+    '"language": "<RU|EN|VI>"}]} '
+    "with exactly one entry per input item and the same ids; language is the code "
+    "of the language the translation is actually written in."
+)
+
+# Раз в столько записей в SQLite чистим устаревшие/лишние строки
+PRUNE_EVERY = 500
+_writes_since_prune = 0
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC + collapsed whitespace — the form used for cache keys."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(
+    text: str,
+    source_lang: AppLang,
+    target_lang: AppLang,
+    model: Optional[str] = None,
+) -> str:
+    raw = "\x1f".join(
+        (model or settings.openai_model, source_lang, target_lang, normalize_text(text))
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _cache_get(key: str) -> Optional[str]:
+    cached = _memory_cache.get(key)
+    if cached is not None:
+        metrics.inc("translation_cache_memory_hit")
+        return cached
+
+    try:
+        cached = await get_cached_translation(key)
+    except Exception as e:
+        logger.warning("Translation cache read failed: %s", e)
+        cached = None
+
+    if cached is not None:
+        metrics.inc("translation_cache_db_hit")
+        _memory_cache.set(key, cached)
+        return cached
+
+    metrics.inc("translation_cache_miss")
+    return None
+
+
+async def _cache_put(key: str, translation: str) -> None:
+    global _writes_since_prune
+
+    _memory_cache.set(key, translation)
+    try:
+        await put_cached_translation(key, translation)
+        _writes_since_prune += 1
+        if _writes_since_prune >= PRUNE_EVERY:
+            _writes_since_prune = 0
+            await prune_translation_cache()
+    except Exception as e:
+        logger.warning("Translation cache write failed: %s", e)
+
 
 async def translate_text(
     text: str,
@@ -19,55 +139,435 @@ async def translate_text(
     target_lang: AppLang,
 ) -> str:
     """
-    Перевод между RU/EN/VI с пост‑проверкой языка ответа.
-    Если модель вернула не целевой язык, принудительно
-    перезапрашиваем перевод уже полученного текста.
+    Перевод между RU/EN/VI с кэшем (память → SQLite → модель).
+    В кэш попадают только ответы, прошедшие проверку языка.
+    Одновременные запросы с тем же ключом кэша ждут один общий вызов модели.
     """
-    source_name = LANG_NAMES[source_lang]
-    target_name = LANG_NAMES[target_lang]
+    key = cache_key(text, source_lang, target_lang)
+    cached = await _cache_get(key)
+    if cached is not None:
+        return cached
 
-    system_prompt = (
-        "You are a professional translator.\n"
-        "Translate user text between languages without explanations.\n"
-        "Return ONLY the translated text, no quotes, no commentary."
-    )
+    async def translate_and_cache() -> str:
+        if _batcher is not None and len(text) <= settings.batch_max_text_chars:
+            translation, verified = await _batcher.submit(text, source_lang, target_lang)
+        else:
+            translation, verified = await _translate_uncached(text, source_lang, target_lang)
+        if translation and verified:
+            await _cache_put(key, translation)
+        return translation
 
-    base_user_prompt = (
-        f"Source language: {source_name}\n"
-        f"Target language: {target_name}\n"
-        "Instructions: Translate the text below from the source language "
-        f"to the target language.\n\n"
-        f"Text:\n{text}"
-    )
+    return await _translation_flight.do(key, translate_and_cache)
 
-    async def call_model(user_prompt: str) -> str:
-        resp = await client.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.2,
+
+async def translate_chunked(
+    text: str,
+    source_lang: AppLang,
+    target_lang: AppLang,
+) -> AsyncIterator[str]:
+    """
+    Длинный текст: режем по абзацам/предложениям на куски до settings.chunk_max_chars,
+    переводим параллельно (не больше settings.chunk_concurrency одновременно)
+    и отдаём в исходном порядке. Каждый yield — перевод очередного куска вместе со
+    следующими, которые уже готовы, так что начало ответа можно отправить, пока
+    остальное ещё переводится. Направление одно на весь текст.
+    """
+    chunks = split_text(text, settings.chunk_max_chars)
+    semaphore = asyncio.Semaphore(max(1, settings.chunk_concurrency))
+    metrics.observe("translation_chunks", len(chunks), metrics.SIZE_BUCKETS)
+
+    async def translate_chunk(chunk: str) -> str:
+        body = chunk.strip()
+        if not body:
+            return chunk
+        async with semaphore:
+            translation = await translate_text(body, source_lang, target_lang)
+        # Разделитель (абзац или пробел) сохраняем, чтобы склеить куски как в оригинале
+        return translation + trailing_whitespace(chunk)
+
+    tasks = [asyncio.create_task(translate_chunk(chunk)) for chunk in chunks]
+    try:
+        i = 0
+        while i < len(tasks):
+            ready = [await tasks[i]]
+            i += 1
+            while i < len(tasks) and tasks[i].done():
+                ready.append(tasks[i].result())
+                i += 1
+            yield "".join(ready)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def translate_long_text(
+    text: str,
+    source_lang: AppLang,
+    target_lang: AppLang,
+) -> str:
+    """translate_chunked целиком одной строкой (для очереди задач)."""
+    parts = [part async for part in translate_chunked(text, source_lang, target_lang)]
+    return "".join(parts).strip()
+
+
+async def translate_text_stream(
+    text: str,
+    source_lang: AppLang,
+    target_lang: AppLang,
+) -> AsyncIterator[str]:
+    """
+    Потоковый перевод: отдаёт куски текста по мере генерации.
+    Закэшированный перевод приходит одним куском. Поток идёт в обычном
+    (не JSON) режиме, поэтому собранный текст нужно передать в finalize_stream().
+    """
+    key = cache_key(text, source_lang, target_lang)
+    cached = await _cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    metrics.inc("translation_first_pass_stream")
+    user_prompt = _build_user_prompt(text, source_lang, target_lang)
+    with metrics.timed("chat_stream_open"):
+        stream = await chat_scheduler.run(
+            lambda: client.chat.completions.create(
+                model=settings.openai_model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": user_prompt},
+                ],
+                temperature=0.2,
+                stream=True,
+            ),
+            cost=estimate_chat_tokens(text),
         )
-        return (resp.choices[0].message.content or "").strip()
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
 
-    # 1. Первый вызов
-    translation = await call_model(base_user_prompt)
 
-    # 2. Проверяем язык результата
-    out_lang = detect_language(translation)
-    if out_lang is not None and out_lang == target_lang:
+async def finalize_stream(
+    text: str,
+    streamed: str,
+    source_lang: AppLang,
+    target_lang: AppLang,
+) -> str:
+    """
+    Проверка языка собранного потокового перевода.
+    Если проверка не прошла — тот же второй шанс, что и в translate_text.
+    """
+    translation = streamed.strip()
+    key = cache_key(text, source_lang, target_lang)
+    if translation and _memory_cache.peek(key) == translation:
         return translation
 
-    # 3. Второй шанс: заставляем ещё раз перевести уже полученный текст
-    retry_prompt = (
-        f"Source language: {source_name}\n"
-        f"Target language: {target_name}\n"
+    if verify_translation(translation, target_lang):
+        await _cache_put(key, translation)
+        return translation
+
+    _log_retry("stream")
+    retry_prompt = _build_retry_prompt(translation or text, source_lang, target_lang)
+    translation2 = (await _call_model(SYSTEM_PROMPT, retry_prompt)).strip()
+    if translation2 and detect_language(translation2) in (None, target_lang):
+        await _cache_put(key, translation2)
+    return translation2
+
+
+def _build_user_prompt(text: str, source_lang: AppLang, target_lang: AppLang) -> str:
+    return (
+        f"Source language: {LANG_NAMES[source_lang]}\n"
+        f"Target language: {LANG_NAMES[target_lang]}\n"
+        "Instructions: Translate the text below from the source language "
+        f"to the target language.\n\n"
+        f"Text:\n{text}"
+    )
+
+
+def _build_retry_prompt(translation: str, source_lang: AppLang, target_lang: AppLang) -> str:
+    return (
+        f"Source language: {LANG_NAMES[source_lang]}\n"
+        f"Target language: {LANG_NAMES[target_lang]}\n"
         "The previous attempt did not produce text in the target language.\n"
         "Now, translate the following text to the target language.\n"
         "Answer ONLY in the target language, without explanations "
         "or mixing languages.\n\n"
         f"Text:\n{translation}"
     )
-    translation2 = await call_model(retry_prompt)
-    return translation2.strip()
\ No newline at end of file
+
+
+async def _call_model(system_prompt: str, user_prompt: str, json_mode: bool = False) -> str:
+    params = {
+        "model": settings.openai_model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        "temperature": 0.2,
+    }
+    if json_mode:
+        params["response_format"] = {"type": "json_object"}
+    # Дубль зависшего запроса можно отправить в более быструю модель
+    hedge_params = {**params, "model": settings.openai_fallback_model or settings.openai_model}
+
+    with metrics.timed("chat_completion"):
+        resp = await chat_scheduler.run(
+            lambda: client.chat.completions.create(**params),
+            cost=estimate_chat_tokens(user_prompt),
+            hedge=lambda: client.chat.completions.create(**hedge_params),
+            is_valid=lambda r: bool(r.choices and (r.choices[0].message.content or "").strip()),
+        )
+    return (resp.choices[0].message.content or "").strip()
+
+
+def _parse_structured(content: str) -> Tuple[str, Optional[str]]:
+    """
+    Разбираем JSON-ответ модели: (перевод, заявленный код языка).
+    Если JSON не разобрался, считаем весь ответ переводом без заявленного языка.
+    """
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return content, None
+    if not isinstance(data, dict) or not isinstance(data.get("translation"), str):
+        return content, None
+
+    language = data.get("language")
+    claimed = language.strip().upper() if isinstance(language, str) else None
+    if claimed == "VN":
+        claimed = "VI"
+    return data["translation"].strip(), claimed
+
+
+def verify_translation(
+    translation: str,
+    target_lang: AppLang,
+    claimed_lang: Optional[str] = None,
+) -> bool:
+    """
+    Локальная проверка языка перевода.
+    Без заявленного языка требуем, чтобы детектор увидел целевой язык.
+    С заявленным языком доверяем модели, пока детектор уверенно не видит другой язык.
+    """
+    if not translation:
+        return False
+
+    detection = detect_language_ex(translation)
+    if claimed_lang is None:
+        return detection.lang == target_lang
+
+    if claimed_lang != target_lang:
+        return False
+    if (
+        detection.lang is not None
+        and detection.lang != target_lang
+        and detection.confidence >= VERIFY_CONFIDENCE
+    ):
+        return False
+    return True
+
+
+async def _translate_batch(
+    texts: List[str],
+    source_lang: AppLang,
+    target_lang: AppLang,
+) -> Optional[List[Tuple[str, Optional[str]]]]:
+    """
+    Один запрос на несколько коротких текстов одного направления.
+    Возвращает [(перевод, заявленный язык)] в порядке texts или None, если ответ битый.
+    """
+    items = [{"id": i, "text": t} for i, t in enumerate(texts)]
+    user_prompt = (
+        f"Source language: {LANG_NAMES[source_lang]}\n"
+        f"Target language: {LANG_NAMES[target_lang]}\n"
+        "Items:\n"
+        f"{json.dumps(items, ensure_ascii=False)}"
+    )
+    metrics.inc("translation_batch_requests")
+    content = await _call_model(BATCH_SYSTEM_PROMPT, user_prompt, json_mode=True)
+
+    try:
+        entries = json.loads(content)["translations"]
+        by_id = {int(e["id"]): e for e in entries}
+        results = []
+        for i in range(len(texts)):
+            entry = by_id[i]
+            translation = entry["translation"]
+            if not isinstance(translation, str):
+                return None
+            language = entry.get("language")
+            claimed = language.strip().upper() if isinstance(language, str) else None
+            results.append((translation.strip(), "VI" if claimed == "VN" else claimed))
+    except (ValueError, KeyError, TypeError):
+        return None
+    return results
+
+
+def _log_retry(mode: str) -> None:
+    metrics.inc("translation_retry")
+    metrics.inc(f"translation_retry_{mode}")
+    counters = metrics.snapshot()
+    total = counters.get(f"translation_first_pass_{mode}", 0)
+    retries = counters.get(f"translation_retry_{mode}", 0)
+    logger.info(
+        "Translation retry fired (mode=%s): %s of %s first passes (%.1f%%)",
+        mode,
+        retries,
+        total,
+        100.0 * retries / total if total else 0.0,
+    )
+
+
+async def _translate_uncached(
+    text: str,
+    source_lang: AppLang,
+    target_lang: AppLang,
+) -> Tuple[str, bool]:
+    """
+    Перевод между RU/EN/VI с пост‑проверкой языка ответа.
+    В структурированном режиме модель сразу сообщает язык ответа, и повторный
+    запрос уходит, только если локальная проверка действительно не прошла.
+    Возвращает (перевод, прошёл ли он проверку языка).
+    """
+    # 1-2. Первый вызов и проверка языка результата
+    translation, verified = await _translate_first_pass(text, source_lang, target_lang)
+    if verified:
+        return translation, True
+
+    # 3. Второй шанс: заставляем ещё раз перевести уже полученный текст
+    return await _translate_retry(text, translation, source_lang, target_lang)
+
+
+async def _translate_first_pass(
+    text: str,
+    source_lang: AppLang,
+    target_lang: AppLang,
+) -> Tuple[str, bool]:
+    """Один вызов модели и локальная проверка языка: (перевод, прошёл ли проверку)."""
+    mode = "structured" if settings.translation_structured else "plain"
+    user_prompt = _build_user_prompt(text, source_lang, target_lang)
+
+    metrics.inc(f"translation_first_pass_{mode}")
+    if settings.translation_structured:
+        content = await _call_model(STRUCTURED_SYSTEM_PROMPT, user_prompt, json_mode=True)
+        translation, claimed = _parse_structured(content)
+    else:
+        translation = await _call_model(SYSTEM_PROMPT, user_prompt)
+        claimed = None
+    return translation, verify_translation(translation, target_lang, claimed)
+
+
+async def _translate_retry(
+    text: str,
+    translation: str,
+    source_lang: AppLang,
+    target_lang: AppLang,
+) -> Tuple[str, bool]:
+    _log_retry("structured" if settings.translation_structured else "plain")
+    retry_prompt = _build_retry_prompt(translation or text, source_lang, target_lang)
+    translation2 = (await _call_model(SYSTEM_PROMPT, retry_prompt)).strip()
+    return translation2, detect_language(translation2) in (None, target_lang)
+
+
+def is_unchanged(text: str, translation: str) -> bool:
+    """
+    Перевод почти совпадает с исходником — модель вернула текст как есть,
+    обычно потому что он уже на целевом языке (направление угадано неверно).
+    """
+    a, b = normalize_text(text).lower(), normalize_text(translation).lower()
+    if len(a) < 4:
+        return a == b
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio() >= SIMILARITY_UNCHANGED
+
+
+def _record_speculation(outcome: str) -> None:
+    """outcome: primary (угаданное направление верно, второй запрос — впустую), secondary, none."""
+    metrics.inc(f"translation_speculative_{outcome}")
+    counters = metrics.snapshot()
+    runs = sum(counters.get(f"translation_speculative_{o}", 0) for o in ("primary", "secondary", "none"))
+    metrics.set_gauge(
+        "translation_speculative_win_ratio",
+        counters.get("translation_speculative_secondary", 0) / runs,
+    )
+    metrics.set_gauge(
+        "translation_speculative_waste_ratio",
+        counters.get("translation_speculative_primary", 0) / runs,
+    )
+
+
+async def translate_speculative(
+    text: str,
+    lang_from: AppLang,
+    lang_to: AppLang,
+    guess: Tuple[AppLang, AppLang],
+) -> Tuple[str, AppLang, AppLang]:
+    """
+    Направление не ясно (детектор не уверен): переводим сразу в обе стороны
+    пары пользователя (lang_from → lang_to и lang_to → lang_from). guess —
+    догадка choose_direction: направление пары с тем же целевым языком идёт
+    первым и остаётся запасным вариантом. Побеждает первый перевод, прошедший
+    проверку языка и не совпадающий с исходником; второй запрос отменяется.
+    Возвращает (перевод, src, dst).
+    """
+    directions: List[Tuple[AppLang, AppLang]] = [(lang_from, lang_to), (lang_to, lang_from)]
+    # Догадка может быть вне пары (детектор увидел третий язык) — берём из неё только цель
+    if guess[1] == lang_from:
+        directions.reverse()
+    source_lang, target_lang = directions[0]
+    for src, dst in directions:
+        cached = await _cache_get(cache_key(text, src, dst))
+        if cached is not None:
+            return cached, src, dst
+
+    tasks = {
+        asyncio.ensure_future(_translate_first_pass(text, src, dst)): (src, dst)
+        for src, dst in directions
+    }
+    primary = next(iter(tasks))
+    first_pass = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Готовы оба сразу — предпочитаем догадку
+            for task in sorted(done, key=lambda t: t is not primary):
+                if task.exception() is not None:
+                    logger.warning("Speculative translation failed: %s", task.exception())
+                    continue
+                translation, verified = task.result()
+                first_pass[task] = translation
+                src, dst = tasks[task]
+                if verified and not is_unchanged(text, translation):
+                    _record_speculation("primary" if task is primary else "secondary")
+                    await _cache_put(cache_key(text, src, dst), translation)
+                    return translation, src, dst
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    # Ни одно направление не прошло проверку — обычный второй шанс для догадки
+    _record_speculation("none")
+    if primary not in first_pass:
+        return await translate_text(text, source_lang, target_lang), source_lang, target_lang
+    translation, verified = await _translate_retry(text, first_pass[primary], source_lang, target_lang)
+    if translation and verified:
+        await _cache_put(cache_key(text, source_lang, target_lang), translation)
+    return translation, source_lang, target_lang
+
+
+# Микробатчинг коротких текстов (settings.batch_enabled)
+_batcher: Optional[MicroBatcher] = (
+    MicroBatcher(
+        translate_batch=_translate_batch,
+        translate_one=_translate_uncached,
+        verify=verify_translation,
+        window=settings.batch_window,
+        max_items=settings.batch_max_items,
+        max_chars=settings.batch_max_chars,
+    )
+    if settings.batch_enabled
+    else None
+)
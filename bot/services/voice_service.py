@@ -1,59 +1,481 @@
-import os
-import tempfile
-from pathlib import Path
-from typing import Optional
-
-from pydub import AudioSegment
+import asyncio
+import io
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import PurePath
+from typing import Any, AsyncIterator, List, Optional, Tuple, Union
 
 from bot.config import settings
+from bot.db.storage import VoiceResult, get_voice_result, prune_voice_cache, put_voice_result
+from bot.services import audio_ops, metrics
+from bot.services.audio_pool import run_audio_job
+from bot.services.lang_detect import detect_language
 from bot.services.openai_client import client
+from bot.services.rate_limit import whisper_scheduler
+from bot.services.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Одно и то же пересланное аудио (одинаковый file_unique_id) скачиваем и распознаём один раз
+_transcription_flight = SingleFlight("transcription")
+
+# Раз в столько записей в voice_cache чистим устаревшие/лишние строки
+VOICE_PRUNE_EVERY = 200
+_voice_writes_since_prune = 0
+
+# Форматы, которые Whisper принимает как есть — их не перекодируем
+WHISPER_FORMATS = {"flac", "m4a", "mp3", "mp4", "mpeg", "mpga", "oga", "ogg", "wav", "webm"}
+
+MIME_TO_FORMAT = {
+    "audio/ogg": "ogg",
+    "audio/opus": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/mp4": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/m4a": "m4a",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/webm": "webm",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+}
+
+WHISPER_LANGS = {"RU": "ru", "EN": "en", "VI": "vi"}
+
+# verbose_json возвращает язык полным названием
+WHISPER_LANG_TO_APP = {
+    "russian": "RU",
+    "english": "EN",
+    "vietnamese": "VI",
+    "ru": "RU",
+    "en": "EN",
+    "vi": "VI",
+}
+
+
+class AudioDownloadError(RuntimeError):
+    """Telegram file could not be downloaded."""
+
 
+@dataclass
+class AudioRef:
+    """Telegram file reference restored from a queued job (duck-types Voice/Audio)."""
 
-async def convert_ogg_to_mp3(input_path: Path) -> Path:
+    file_id: str
+    file_unique_id: str
+    mime_type: Optional[str] = None
+    file_name: Optional[str] = None
+    duration: Optional[int] = None
+
+
+@dataclass
+class Transcript:
+    text: str
+    language: Optional[str]  # RU/EN/VI по версии Whisper, None — другой язык
+    avg_logprob: float = 0.0  # средняя по сегментам, ближе к 0 — увереннее
+    no_speech_prob: float = 0.0  # максимальная по сегментам
+    forced_lang: Optional[str] = None
+
+
+def audio_filename(
+    file_name: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    default: str = "voice.ogg",
+) -> str:
     """
-    Convert OGG/OPUS file to MP3 using pydub (requires ffmpeg installed).
-    Returns path to MP3 file.
+    Имя файла для загрузки в Whisper: по нему API определяет формат.
+    Голосовые Telegram — всегда OGG/Opus.
     """
-    audio = AudioSegment.from_file(input_path)
-    tmp_dir = Path(tempfile.gettempdir())
-    output_path = tmp_dir / (input_path.stem + ".mp3")
-    audio.export(output_path, format="mp3")
-    return output_path
+    if file_name and PurePath(file_name).suffix:
+        return file_name
+    fmt = MIME_TO_FORMAT.get((mime_type or "").lower())
+    if fmt:
+        return f"audio.{fmt}"
+    return default
 
 
-async def transcribe_audio(input_path: Path, forced_lang: Optional[str] = None) -> str:
+async def prepare_audio(data: bytes, filename: str) -> Tuple[bytes, str]:
+    """
+    Return (data, filename) ready for Whisper: supported formats pass through
+    untouched, everything else is transcoded to MP3 once in the audio process pool.
     """
-    Transcribe audio file using Whisper (OpenAI).
-    Accepts OGG/MP3/etc; converts if needed.
+    path = PurePath(filename)
+    fmt = path.suffix.lower().lstrip(".")
+    if fmt in WHISPER_FORMATS:
+        return data, filename
+    with metrics.timed("audio_transcode"):
+        mp3 = await run_audio_job(audio_ops.transcode_to_mp3, data, fmt or None)
+    return mp3, f"{path.stem or 'audio'}.mp3"
+
+
+async def transcribe_audio(
+    audio: Union[bytes, io.BytesIO],
+    filename: str = "voice.ogg",
+    forced_lang: Optional[str] = None,
+) -> str:
+    """
+    Transcribe in-memory audio using Whisper (OpenAI).
+    OGG/MP3/WAV/… are uploaded as is; other formats are transcoded to MP3 first.
     Returns recognized text.
     If forced_lang is provided (RU/EN/VI), we tell Whisper to use this language
     instead of auto-detecting, which делает распознавание устойчивее.
     """
-    path = Path(input_path)
+    data = audio.getvalue() if isinstance(audio, io.BytesIO) else audio
+    data, filename = await prepare_audio(data, filename)
+
+    params = {
+        "model": settings.openai_whisper_model,
+        "file": (filename, data),
+        "response_format": "text",
+    }
+
+    language = WHISPER_LANGS.get(forced_lang or "")
+    if language:
+        params["language"] = language
+
+    # Вес в очереди — размер файла: короткие голосовые идут раньше длинных записей
+    with metrics.timed("whisper"):
+        response = await whisper_scheduler.run(
+            lambda: client.audio.transcriptions.create(**params),
+            cost=len(data) / 16000,
+            hedge=lambda: client.audio.transcriptions.create(**params),
+            is_valid=lambda r: bool(r.strip()),
+        )
+    return response.strip()
+
+
+def _segment_value(segment, name: str, default: float) -> float:
+    value = segment.get(name) if isinstance(segment, dict) else getattr(segment, name, None)
+    return float(value) if value is not None else default
+
+
+async def transcribe_verbose(
+    data: bytes,
+    filename: str = "voice.ogg",
+    forced_lang: Optional[str] = None,
+) -> Transcript:
+    """
+    Transcribe with response_format=verbose_json: besides the text Whisper returns
+    the detected language and per-segment confidences.
+    """
+    params = {
+        "model": settings.openai_whisper_model,
+        "file": (filename, data),
+        "response_format": "verbose_json",
+    }
+    language = WHISPER_LANGS.get(forced_lang or "")
+    if language:
+        params["language"] = language
+
+    # Вес в очереди — размер файла: короткие голосовые идут раньше длинных записей
+    with metrics.timed("whisper_verbose"):
+        response = await whisper_scheduler.run(
+            lambda: client.audio.transcriptions.create(**params),
+            cost=len(data) / 16000,
+            hedge=lambda: client.audio.transcriptions.create(**params),
+            is_valid=lambda r: bool((r.text or "").strip()),
+        )
+
+    segments = getattr(response, "segments", None) or []
+    if segments:
+        avg_logprob = sum(_segment_value(s, "avg_logprob", 0.0) for s in segments) / len(segments)
+        no_speech_prob = max(_segment_value(s, "no_speech_prob", 0.0) for s in segments)
+    else:
+        avg_logprob, no_speech_prob = 0.0, 0.0
+
+    whisper_lang = (getattr(response, "language", None) or "").lower()
+    return Transcript(
+        text=(response.text or "").strip(),
+        language=forced_lang or WHISPER_LANG_TO_APP.get(whisper_lang),
+        avg_logprob=avg_logprob,
+        no_speech_prob=no_speech_prob,
+        forced_lang=forced_lang,
+    )
+
+
+def _is_acceptable(transcript: Transcript, pair: Tuple[str, str]) -> bool:
+    """
+    Можно ли обойтись без прохода с принудительным языком: Whisper видит язык
+    из пары, либо распознавание уверенное и локальный детектор видит язык из пары.
+    """
+    if not transcript.text:
+        return False
+    if transcript.language in pair:
+        return True
+    if transcript.avg_logprob < settings.voice_min_avg_logprob:
+        return False
+    return detect_language(transcript.text) in pair
+
+
+def _record_path(path: str) -> None:
+    metrics.inc(f"voice_path_{path}")
+    counters = metrics.snapshot()
+    total = sum(v for k, v in counters.items() if k.startswith("voice_path_"))
+    logger.info(
+        "Voice transcription path=%s (%s of %s voice messages)",
+        path,
+        counters.get(f"voice_path_{path}", 0),
+        total,
+    )
+
+
+async def _transcribe_text_mode(
+    data: bytes,
+    filename: str,
+    pair: Tuple[str, str],
+) -> Transcript:
+    """Прежнее поведение: текст, локальная детекция, при промахе — второй проход."""
+    text = await transcribe_audio(data, filename=filename)
+    detected = detect_language(text)
+    if detected in pair or not text.strip():
+        _record_path("auto")
+        return Transcript(text=text, language=detected)
+
+    text2 = await transcribe_audio(data, filename=filename, forced_lang=pair[0])
+    _record_path("forced")
+    if text2 and text2.strip():
+        return Transcript(text=text2, language=pair[0], forced_lang=pair[0])
+    return Transcript(text=text, language=detected)
+
+
+async def transcribe_for_pair(
+    data: bytes,
+    filename: str,
+    lang_from: str,
+    lang_to: str,
+) -> Transcript:
+    """
+    Transcribe audio for a user's language pair.
 
-    if path.suffix.lower() != ".mp3":
-        path = await convert_ogg_to_mp3(path)
+    With settings.voice_verbose the first pass returns Whisper's own language and
+    segment confidences, so the forced-language pass (lang_from) runs only when
+    they say the result is unusable. With settings.voice_speculative the forced
+    pass starts concurrently with the first one and is cancelled if the first
+    result is acceptable — latency of one pass at the cost of extra Whisper calls.
+    """
+    pair = (lang_from, lang_to)
+    if not settings.voice_verbose:
+        return await _transcribe_text_mode(data, filename, pair)
+
+    forced_task: Optional[asyncio.Task] = None
+    if settings.voice_speculative:
+        forced_task = asyncio.create_task(
+            transcribe_verbose(data, filename, forced_lang=lang_from)
+        )
+
+    try:
+        first = await transcribe_verbose(data, filename)
+        if _is_acceptable(first, pair) or not first.text:
+            _record_path("speculative_auto" if forced_task else "auto")
+            return first
+
+        if forced_task is None:
+            forced_task = asyncio.create_task(
+                transcribe_verbose(data, filename, forced_lang=lang_from)
+            )
+        forced = await forced_task
+        _record_path("speculative_forced" if settings.voice_speculative else "forced")
+        return forced if forced.text else first
+    finally:
+        if forced_task is not None and not forced_task.done():
+            forced_task.cancel()
+
+
+def _record_cache(hit: bool) -> None:
+    metrics.inc("voice_cache_hit" if hit else "voice_cache_miss")
+
+
+async def _cached_transcript(
+    file_unique_id: str,
+    lang_from: str,
+    lang_to: str,
+) -> Optional[Transcript]:
+    """
+    Распознавание из voice_cache, если его хватает для пары: проход с
+    автоопределением языка, когда он годится (как в transcribe_for_pair),
+    иначе проход с принудительным lang_from. None — нужно скачивать и распознавать.
+    Пустое распознавание попаданием не считаем: пустой ответ Whisper мог быть
+    случайным, и повторная отправка должна распознаваться заново.
+    """
+    if not settings.voice_cache_enabled:
+        return None
+    try:
+        stored = await get_voice_result(file_unique_id, None)
+        if stored is not None:
+            transcript = _from_stored(stored, None)
+            if transcript.text.strip() and _is_acceptable(transcript, (lang_from, lang_to)):
+                _record_cache(True)
+                return transcript
+
+        stored = await get_voice_result(file_unique_id, lang_from)
+        if stored is not None and stored.transcript.strip():
+            _record_cache(True)
+            return _from_stored(stored, lang_from)
+    except Exception as e:
+        logger.warning("Voice cache read failed: %s", e)
+
+    _record_cache(False)
+    return None
+
+
+def _from_stored(stored: VoiceResult, forced_lang: Optional[str]) -> Transcript:
+    return Transcript(
+        text=stored.transcript,
+        language=stored.language,
+        avg_logprob=stored.avg_logprob,
+        no_speech_prob=stored.no_speech_prob,
+        forced_lang=forced_lang,
+    )
+
+
+async def _store_transcript(file_unique_id: str, transcript: Transcript) -> None:
+    global _voice_writes_since_prune
+
+    if not settings.voice_cache_enabled or not transcript.text.strip():
+        return
+    try:
+        await put_voice_result(
+            file_unique_id,
+            transcript.forced_lang,
+            VoiceResult(
+                transcript=transcript.text,
+                language=transcript.language,
+                avg_logprob=transcript.avg_logprob,
+                no_speech_prob=transcript.no_speech_prob,
+            ),
+        )
+        _voice_writes_since_prune += 1
+        if _voice_writes_since_prune >= VOICE_PRUNE_EVERY:
+            _voice_writes_since_prune = 0
+            await prune_voice_cache()
+    except Exception as e:
+        logger.warning("Voice cache write failed: %s", e)
+
+
+async def _download(bot: Any, audio: Any) -> Tuple[bytes, str]:
+    """Download a Telegram file into memory: (data, filename for Whisper)."""
+    buffer = io.BytesIO()
+    try:
+        with metrics.timed("telegram_download"):
+            await bot.download(audio, destination=buffer)
+    except Exception as e:
+        raise AudioDownloadError(str(e)) from e
+
+    filename = audio_filename(getattr(audio, "file_name", None), audio.mime_type)
+    return buffer.getvalue(), filename
+
+
+async def recognize_voice(
+    bot: Any,
+    audio: Any,
+    lang_from: str,
+    lang_to: str,
+) -> Transcript:
+    """
+    Download a Telegram Voice/Audio into memory and transcribe it for the pair.
+    A file recognized before (same file_unique_id, e.g. a forwarded voice) is
+    answered from voice_cache without downloading. Concurrent calls for the same
+    file and pair share one download and one set of Whisper calls.
+    Raises AudioDownloadError if the download fails.
+    """
+
+    async def download_and_transcribe() -> Transcript:
+        cached = await _cached_transcript(audio.file_unique_id, lang_from, lang_to)
+        if cached is not None:
+            return cached
+
+        data, filename = await _download(bot, audio)
+        # Перекодируем (если формат не принимает Whisper) один раз на все проходы
+        data, filename = await prepare_audio(data, filename)
+        transcript = await transcribe_for_pair(data, filename, lang_from, lang_to)
+        await _store_transcript(audio.file_unique_id, transcript)
+        return transcript
+
+    key = (audio.file_unique_id, lang_from, lang_to)
+    return await _transcription_flight.do(key, download_and_transcribe)
+
+
+def is_long_audio(audio: Any) -> bool:
+    """Длинная запись (по duration из Telegram) — распознаём кусками."""
+    duration = getattr(audio, "duration", None) or 0
+    return 0 < settings.long_audio_seconds < duration
+
+
+async def segment_audio(data: bytes, filename: str, duration: float = 0.0) -> List[bytes]:
+    """Cut audio on pauses into segments of at most settings.audio_segment_seconds (in the audio pool)."""
+    fmt = PurePath(filename).suffix.lower().lstrip(".") or None
+    with metrics.timed("audio_segment"):
+        return await run_audio_job(
+            audio_ops.split_on_silence,
+            data,
+            fmt,
+            settings.audio_segment_seconds * 1000,
+            settings.audio_min_silence_ms,
+            # Декодирование длинной записи занимает заметно дольше обычной задачи
+            timeout=settings.audio_job_timeout + duration / 4,
+        )
+
+
+def join_transcripts(transcripts: List[Transcript]) -> Transcript:
+    """Склеить распознанные куски: язык — тот, на котором больше текста."""
+    parts = [t for t in transcripts if t.text]
+    if not parts:
+        return Transcript(text="", language=None)
+
+    weights: Counter = Counter()
+    for t in parts:
+        weights[t.language] += len(t.text)
+    forced = {t.forced_lang for t in parts}
+    return Transcript(
+        text=" ".join(t.text for t in parts),
+        language=weights.most_common(1)[0][0],
+        avg_logprob=sum(t.avg_logprob for t in parts) / len(parts),
+        no_speech_prob=max(t.no_speech_prob for t in parts),
+        forced_lang=forced.pop() if len(forced) == 1 else None,
+    )
+
+
+async def recognize_long_voice(
+    bot: Any,
+    audio: Any,
+    lang_from: str,
+    lang_to: str,
+) -> AsyncIterator[Transcript]:
+    """
+    Long audio: download once, cut on pauses in the audio pool and transcribe
+    the segments concurrently (at most settings.audio_segment_concurrency), each
+    with the same pass logic as a voice note. Yields segment transcripts in
+    order, each as soon as it and all before it are ready, so translation can
+    start while later segments are still being transcribed. The stitched result
+    goes to voice_cache; a cached file yields one transcript without downloading.
+    """
+    cached = await _cached_transcript(audio.file_unique_id, lang_from, lang_to)
+    if cached is not None:
+        yield cached
+        return
 
-    with path.open("rb") as audio_file:
-        params = {
-            "model": settings.openai_whisper_model,
-            "file": audio_file,
-            "response_format": "text",
-        }
+    data, filename = await _download(bot, audio)
+    segments = await segment_audio(data, filename, getattr(audio, "duration", None) or 0)
+    metrics.observe("audio_segments", len(segments), metrics.SIZE_BUCKETS)
 
-        if forced_lang == "RU":
-            params["language"] = "ru"
-        elif forced_lang == "EN":
-            params["language"] = "en"
-        elif forced_lang == "VI":
-            params["language"] = "vi"
+    semaphore = asyncio.Semaphore(max(1, settings.audio_segment_concurrency))
 
-        response = await client.audio.transcriptions.create(**params)
+    async def transcribe_segment(segment: bytes) -> Transcript:
+        async with semaphore:
+            return await transcribe_for_pair(segment, "segment.mp3", lang_from, lang_to)
 
+    tasks = [asyncio.create_task(transcribe_segment(segment)) for segment in segments]
+    done: List[Transcript] = []
     try:
-        if path.exists() and path.suffix.lower() == ".mp3":
-            os.remove(path)
-    except OSError:
-        pass
+        for task in tasks:
+            transcript = await task
+            done.append(transcript)
+            yield transcript
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
 
-    return response.strip()
\ No newline at end of file
+    await _store_transcript(audio.file_unique_id, join_transcripts(done))
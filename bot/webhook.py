@@ -0,0 +1,223 @@
+"""
+Webhook mode: python -m bot.webhook
+
+WEBHOOK_WORKERS=1 — aiogram's SimpleRequestHandler in this process.
+WEBHOOK_WORKERS=N — this process only accepts updates on WEBHOOK_PORT and hands
+them to N worker processes by chat id (chat_id % N), so all updates of a chat
+land in the same worker and are processed there in arrival order. Every worker
+has its own event loop, OpenAI client, SQLite connection and caches.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import queue
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from bot.config import settings
+from bot.main import create_bot, create_dispatcher
+from bot.services.outbox import outbox
+from bot.services.rate_limit import scale_limits
+from bot.services.tracing import configure_logging
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(data: Dict[str, Any]) -> int:
+    """Chat id of a raw update (user id for updates without a chat, 0 if neither)."""
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if key in data:
+            return data[key]["chat"]["id"]
+    callback = data.get("callback_query")
+    if callback:
+        if callback.get("message"):
+            return callback["message"]["chat"]["id"]
+        return callback["from"]["id"]
+    for item in data.values():
+        if isinstance(item, dict) and isinstance(item.get("from"), dict):
+            return item["from"]["id"]
+    return 0
+
+
+async def _set_webhook(bot: Bot) -> None:
+    if not settings.webhook_url:
+        logger.info("WEBHOOK_URL is empty, setWebhook is not called")
+        return
+    await bot.set_webhook(
+        settings.webhook_url.rstrip("/") + settings.webhook_path,
+        secret_token=settings.webhook_secret or None,
+    )
+
+
+class ChatSerializer:
+    """Runs jobs of one chat strictly one after another, different chats concurrently."""
+
+    def __init__(self):
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, job: Callable[[], Awaitable[Any]]) -> None:
+        previous = self._tails.get(chat_id)
+        task = asyncio.create_task(self._run(previous, job))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._forget(chat_id, t))
+
+    def _forget(self, chat_id: int, task: asyncio.Task) -> None:
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    @staticmethod
+    async def _run(previous: Optional[asyncio.Task], job: Callable[[], Awaitable[Any]]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await job()
+        except Exception:
+            logger.exception("Update processing failed")
+
+    async def drain(self) -> None:
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+async def _run_worker(index: int, workers: int, updates: "multiprocessing.Queue") -> None:
+    # Лимиты OpenAI общие на аккаунт, общий лимит Telegram — на токен бота:
+    # делим их между воркерами
+    scale_limits(1 / workers)
+    outbox.scale_global_limit(1 / workers)
+    # У каждого воркера свои метрики — и свой порт /metrics
+    if settings.metrics_port:
+        settings.metrics_port += index
+
+    bot = create_bot()
+    dp = create_dispatcher()
+    await dp.emit_startup(bot=bot)
+    logger.info("Webhook worker %s started", index)
+
+    serializer = ChatSerializer()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            data = json.loads(raw)
+            update = Update.model_validate(data, context={"bot": bot})
+            serializer.submit(
+                update_chat_id(data),
+                lambda update=update: dp.feed_update(bot, update),
+            )
+    finally:
+        await serializer.drain()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+
+def _worker_main(index: int, workers: int, updates: "multiprocessing.Queue") -> None:
+    configure_logging(prefix=f"worker-{index} ")
+    asyncio.run(_run_worker(index, workers, updates))
+
+
+async def _serve(app: web.Application) -> None:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.webhook_host, settings.webhook_port)
+    await site.start()
+    logger.info(
+        "Webhook listening on %s:%s%s",
+        settings.webhook_host,
+        settings.webhook_port,
+        settings.webhook_path,
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_single() -> None:
+    """One process: aiogram's own webhook handler."""
+    bot = create_bot()
+    dp = create_dispatcher()
+    dp.startup.register(_set_webhook)
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=settings.webhook_secret or None,
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+    await _serve(app)
+
+
+async def run_sharded(workers: int) -> None:
+    """Front process: accept updates and route them to workers by chat id."""
+    ctx = multiprocessing.get_context("spawn")
+    queues: List[multiprocessing.Queue] = [
+        ctx.Queue(maxsize=settings.webhook_queue_size) for _ in range(workers)
+    ]
+    # Не daemon: воркеру нужен свой пул процессов для аудио (audio_pool),
+    # а daemon-процессы не могут запускать дочерние. Остановка — через None в очереди
+    processes = [
+        ctx.Process(target=_worker_main, args=(i, workers, queues[i]))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if settings.webhook_secret and request.headers.get(SECRET_HEADER) != settings.webhook_secret:
+            return web.Response(status=401)
+
+        raw = await request.read()
+        try:
+            chat_id = update_chat_id(json.loads(raw))
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        try:
+            queues[chat_id % workers].put_nowait(raw)
+        except queue.Full:
+            # Telegram повторит доставку позже
+            logger.warning("Worker %s queue is full, update rejected", chat_id % workers)
+            return web.Response(status=503)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(settings.webhook_path, handle_update)
+
+    bot = create_bot()
+    try:
+        await _set_webhook(bot)
+    finally:
+        await bot.session.close()
+
+    try:
+        await _serve(app)
+    finally:
+        for updates in queues:
+            updates.put(None)
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, terminating", process.pid)
+                process.terminate()
+
+
+def main() -> None:
+    workers = max(1, settings.webhook_workers)
+    if workers == 1:
+        asyncio.run(run_single())
+    else:
+        asyncio.run(run_sharded(workers))
+
+
+if __name__ == "__main__":
+    main()